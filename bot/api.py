@@ -1,20 +1,53 @@
+import hmac
 import logging
+import time
 
 from aiogram import Bot
 from aiogram.types import LabeledPrice
-from fastapi import FastAPI, Header, Query
+from fastapi import FastAPI, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import uvicorn
 
-from config import ALLOWED_PRICES, BOT_TOKEN, CORS_ALLOW_ORIGIN, INIT_DATA_MAX_AGE_SECONDS
+from config import (
+    ADMIN_TOKEN,
+    ALLOWED_PRICES,
+    BOT_TOKEN,
+    CORS_ALLOW_ORIGIN,
+    INIT_DATA_CACHE_SIZE,
+    INIT_DATA_CACHE_TTL_SECONDS,
+    INIT_DATA_MAX_AGE_SECONDS,
+    INVOICE_LINK_CACHE_SIZE,
+    INVOICE_LINK_CACHE_TTL_SECONDS,
+    INVOICE_PREWARM_AMOUNTS,
+    LEADERBOARD_RESPONSE_CACHE_SIZE,
+    METRICS_ENABLED,
+)
+from database import decode_leaderboard_cursor, next_leaderboard_cursor
+from export import CONTENT_TYPES, EXPORT_FORMATS, EXPORT_KINDS, aiter_export_chunks, storage_paths
+from invoice_links import InvoiceLinkCache
+from leaderboard_windows import ALL_TIME_WINDOW, is_valid_window, window_id
+from metrics import (
+    INIT_DATA_VERIFY,
+    REGISTRY,
+    REQUEST_SECONDS,
+    TELEGRAM_CREATE_INVOICE_LINK,
+    register_component_metrics,
+    reject,
+)
+from outbound import Lane, OutboundRateLimited, send_outbound
 from payments import build_invoice_payload
-from security import extract_user_from_init_data, verify_telegram_init_data
+from response_cache import ResponseCache, etag_matches, leaderboard_cache_key
+from security import InitDataCache, verify_init_data_user
+from sharded_storage import LeaderboardOffsetTooDeep
 
 
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
+init_data_cache = InitDataCache(max_size=INIT_DATA_CACHE_SIZE, ttl_seconds=INIT_DATA_CACHE_TTL_SECONDS)
+leaderboard_responses = ResponseCache(max_entries=LEADERBOARD_RESPONSE_CACHE_SIZE)
+invoice_links = InvoiceLinkCache(ttl_seconds=INVOICE_LINK_CACHE_TTL_SECONDS, max_size=INVOICE_LINK_CACHE_SIZE)
 
 if CORS_ALLOW_ORIGIN:
     allow_origins = [origin.strip() for origin in CORS_ALLOW_ORIGIN.split(",") if origin.strip()]
@@ -24,9 +57,23 @@ if CORS_ALLOW_ORIGIN:
             allow_origins=allow_origins,
             allow_methods=["GET", "POST", "OPTIONS"],
             allow_headers=["*"],
+            expose_headers=["ETag"],
         )
         logger.info("cors_enabled", extra={"allow_origins": allow_origins})
 
+if METRICS_ENABLED:
+
+    @app.middleware("http")
+    async def timing_middleware(request: Request, call_next):
+        started_at = time.perf_counter()
+        try:
+            return await call_next(request)
+        finally:
+            route = request.scope.get("route")
+            REQUEST_SECONDS.labels(route.path if route is not None else "unmatched").observe(
+                time.perf_counter() - started_at
+            )
+
 
 async def create_stars_invoice(bot: Bot, amount: int, user_id: int) -> str:
     prices = [
@@ -36,13 +83,43 @@ async def create_stars_invoice(bot: Bot, amount: int, user_id: int) -> str:
         )
     ]
 
-    return await bot.create_invoice_link(
-        title="Random Gift",
-        description=f"Покупка подарка за {amount} звезд.",
-        payload=build_invoice_payload(amount, user_id),
-        currency="XTR",
-        prices=prices,
-    )
+    started_at = time.perf_counter()
+    try:
+        return await bot.create_invoice_link(
+            title="Random Gift",
+            description=f"Покупка подарка за {amount} звезд.",
+            payload=build_invoice_payload(amount, user_id),
+            currency="XTR",
+            prices=prices,
+        )
+    finally:
+        TELEGRAM_CREATE_INVOICE_LINK.observe(time.perf_counter() - started_at)
+
+
+async def create_stars_invoice_queued(bot: Bot, amount: int, user_id: int, lane: Lane = Lane.INVOICE) -> str:
+    outbound = getattr(app.state, "outbound", None)
+    return await send_outbound(outbound, lambda: create_stars_invoice(bot, amount, user_id), lane=lane)
+
+
+async def create_stars_invoice_once(bot: Bot, amount: int, user_id: int) -> str:
+    return await invoice_links.get_or_create(amount, user_id, lambda: create_stars_invoice_queued(bot, amount, user_id))
+
+
+def _reject(reason: str, status: int, headers: dict | None = None) -> JSONResponse:
+    # The error key doubles as the rejection reason in metrics.
+    reject(reason)
+    return JSONResponse(status_code=status, content={"error": reason}, headers=headers)
+
+
+def _rate_limited_response(exc: OutboundRateLimited) -> JSONResponse:
+    return _reject("rate_limited", 503, {"Retry-After": str(int(exc.retry_after) or 1)})
+
+
+def _verify_init_data(init_data: str) -> tuple[dict, dict | None] | None:
+    started_at = time.perf_counter()
+    verified = verify_init_data_user(init_data, BOT_TOKEN, INIT_DATA_MAX_AGE_SECONDS, init_data_cache)
+    INIT_DATA_VERIFY.observe(time.perf_counter() - started_at)
+    return verified
 
 
 def _resolve_init_data(
@@ -75,25 +152,21 @@ async def _create_invoice_response(
 
     if amount not in ALLOWED_PRICES:
         logger.warning("invoice_request_invalid_amount", extra={"amount": amount})
-        return JSONResponse(status_code=400, content={"error": "invalid_amount"})
+        return _reject("invalid_amount", 400)
 
     if not effective_init_data:
         logger.warning("invoice_request_missing_init_data")
-        return JSONResponse(status_code=401, content={"error": "invalid_init_data"})
+        return _reject("invalid_init_data", 401)
 
-    parsed_init_data = verify_telegram_init_data(
-        effective_init_data,
-        BOT_TOKEN,
-        INIT_DATA_MAX_AGE_SECONDS,
-    )
-    if not parsed_init_data:
+    verified = _verify_init_data(effective_init_data)
+    if not verified:
         logger.warning("invoice_request_invalid_init_data")
-        return JSONResponse(status_code=401, content={"error": "invalid_init_data"})
+        return _reject("invalid_init_data", 401)
 
-    user = extract_user_from_init_data(parsed_init_data)
+    _, user = verified
     if not user:
         logger.warning("invoice_request_user_missing_in_init_data")
-        return JSONResponse(status_code=401, content={"error": "invalid_init_data"})
+        return _reject("invalid_init_data", 401)
 
     db = app.state.db
     bot = app.state.bot
@@ -101,10 +174,13 @@ async def _create_invoice_response(
     await db.upsert_user(user)
 
     try:
-        invoice_link = await create_stars_invoice(bot, amount, int(user["id"]))
+        invoice_link = await create_stars_invoice_once(bot, amount, int(user["id"]))
+    except OutboundRateLimited as exc:
+        logger.warning("invoice_creation_rate_limited", extra={"user_id": user.get("id"), "amount": amount})
+        return _rate_limited_response(exc)
     except Exception:
         logger.exception("invoice_creation_failed", extra={"user_id": user.get("id"), "amount": amount})
-        return JSONResponse(status_code=500, content={"error": "invoice_creation_failed"})
+        return _reject("invoice_creation_failed", 500)
 
     return {
         "invoice_link": invoice_link,
@@ -135,10 +211,10 @@ async def handle_invoice_post(
     init_data = payload.get("init_data")
 
     if not isinstance(amount, int):
-        return JSONResponse(status_code=400, content={"error": "invalid_amount"})
+        return _reject("invalid_amount", 400)
 
     if init_data is not None and not isinstance(init_data, str):
-        return JSONResponse(status_code=400, content={"error": "invalid_init_data"})
+        return _reject("invalid_init_data", 400)
 
     return await _create_invoice_response(
         amount=amount,
@@ -154,16 +230,19 @@ async def create_invoice_legacy(payload: dict):
     user_id = payload.get("user_id")
 
     if not isinstance(amount, int) or amount not in ALLOWED_PRICES:
-        return JSONResponse(status_code=400, content={"error": "invalid_amount"})
+        return _reject("invalid_amount", 400)
 
     if not isinstance(user_id, int):
-        return JSONResponse(status_code=400, content={"error": "invalid_user_id"})
+        return _reject("invalid_user_id", 400)
 
     try:
-        invoice_link = await create_stars_invoice(app.state.bot, amount, user_id)
+        invoice_link = await create_stars_invoice_once(app.state.bot, amount, user_id)
+    except OutboundRateLimited as exc:
+        logger.warning("invoice_creation_rate_limited", extra={"user_id": user_id, "amount": amount})
+        return _rate_limited_response(exc)
     except Exception:
         logger.exception("invoice_creation_failed", extra={"user_id": user_id, "amount": amount})
-        return JSONResponse(status_code=500, content={"error": "invoice_creation_failed"})
+        return _reject("invoice_creation_failed", 500)
 
     return {"invoiceLink": invoice_link}
 
@@ -173,36 +252,151 @@ async def handle_leaderboard(
     x_telegram_init_data: str | None = Header(default=None),
     limit: int = Query(default=50, ge=1, le=100),
     offset: int = Query(default=0, ge=0),
+    next_cursor: str | None = Query(default=None, alias="next"),
+    window: str = Query(default=ALL_TIME_WINDOW),
+    if_none_match: str | None = Header(default=None),
+    accept_encoding: str | None = Header(default=None),
 ):
     if not x_telegram_init_data:
-        return JSONResponse(status_code=401, content={"error": "invalid_init_data"})
+        return _reject("invalid_init_data", 401)
 
-    parsed_init_data = verify_telegram_init_data(
-        x_telegram_init_data,
-        BOT_TOKEN,
-        INIT_DATA_MAX_AGE_SECONDS,
-    )
-    if not parsed_init_data:
-        return JSONResponse(status_code=401, content={"error": "invalid_init_data"})
+    if not is_valid_window(window):
+        return _reject("invalid_window", 400)
+
+    after = None
+    if next_cursor:
+        after = decode_leaderboard_cursor(next_cursor)
+        if after is None:
+            return _reject("invalid_cursor", 400)
+
+    verified = _verify_init_data(x_telegram_init_data)
+    if not verified:
+        return _reject("invalid_init_data", 401)
 
-    user = extract_user_from_init_data(parsed_init_data)
+    _, user = verified
     if not user:
-        return JSONResponse(status_code=401, content={"error": "invalid_init_data"})
+        return _reject("invalid_init_data", 401)
+
+    db = app.state.db
+    await db.upsert_user(user)
+    if INVOICE_PREWARM_AMOUNTS and offset == 0 and not next_cursor:
+        bot = app.state.bot
+        user_id = int(user["id"])
+        invoice_links.prewarm(
+            user_id,
+            INVOICE_PREWARM_AMOUNTS,
+            lambda amount: create_stars_invoice_queued(bot, amount, user_id, Lane.CHAT),
+        )
+
+    window_key = window if window == ALL_TIME_WINDOW else window_id(window)
+    cache_key = leaderboard_cache_key(window_key, limit, offset, next_cursor)
+    version = db.data_version
+    etag = leaderboard_responses.etag(cache_key, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(if_none_match, etag):
+        leaderboard_responses.not_modified += 1
+        return Response(status_code=304, headers=headers)
+
+    cached = leaderboard_responses.get(cache_key, version)
+    if cached is None:
+        try:
+            leaderboard = await db.get_leaderboard(limit=limit, offset=offset, after=after, window=window)
+        except LeaderboardOffsetTooDeep:
+            return _reject("offset_too_deep", 400)
+        cached = leaderboard_responses.put(
+            cache_key,
+            version,
+            {
+                "leaderboard": leaderboard,
+                "window": window,
+                "pagination": {
+                    "limit": limit,
+                    "offset": offset,
+                    "next": next_leaderboard_cursor(leaderboard, limit),
+                },
+            },
+        )
+
+    body, encoding = cached.negotiate(accept_encoding)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/leaderboard/me")
+async def handle_leaderboard_me(
+    x_telegram_init_data: str | None = Header(default=None),
+    neighbours: int = Query(default=1, ge=0, le=10),
+):
+    if not x_telegram_init_data:
+        return _reject("invalid_init_data", 401)
+
+    verified = _verify_init_data(x_telegram_init_data)
+    if not verified:
+        return _reject("invalid_init_data", 401)
+
+    _, user = verified
+    if not user:
+        return _reject("invalid_init_data", 401)
 
     await app.state.db.upsert_user(user)
-    leaderboard = await app.state.db.get_leaderboard(limit=limit, offset=offset)
-    return {
-        "leaderboard": leaderboard,
-        "pagination": {
-            "limit": limit,
-            "offset": offset,
-        },
-    }
+    rank = await app.state.db.get_user_rank(int(user["id"]), neighbours=neighbours)
+    if rank is None:
+        return JSONResponse(status_code=404, content={"error": "user_not_ranked"})
 
+    return rank
 
-async def run_api_server(bot_instance, db_instance, host, port):
+
+def _admin_authorized(authorization: str | None) -> bool:
+    if not ADMIN_TOKEN:
+        return False
+    provided = (authorization or "").removeprefix("Bearer ").encode()
+    return hmac.compare_digest(provided, ADMIN_TOKEN.encode())
+
+
+@app.get("/api/admin/export")
+async def handle_admin_export(
+    authorization: str | None = Header(default=None),
+    kind: str = Query(default="leaderboard"),
+    format: str = Query(default="ndjson"),
+):
+    if not _admin_authorized(authorization):
+        return _reject("forbidden", 403)
+    if kind not in EXPORT_KINDS or format not in EXPORT_FORMATS:
+        return _reject("invalid_export", 400)
+
+    paths = storage_paths(app.state.db)
+    if paths is None:
+        return _reject("export_unsupported", 501)
+
+    await app.state.db.flush()
+    return StreamingResponse(
+        aiter_export_chunks(paths, kind, format),
+        media_type=CONTENT_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'},
+    )
+
+
+async def handle_metrics(authorization: str | None = Header(default=None)):
+    if ADMIN_TOKEN and not _admin_authorized(authorization):
+        return _reject("forbidden", 403)
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+if METRICS_ENABLED:
+    app.add_api_route("/metrics", handle_metrics, methods=["GET"])
+
+
+async def run_api_server(bot_instance, db_instance, host, port, outbound_instance=None):
     app.state.bot = bot_instance
     app.state.db = db_instance
+    app.state.outbound = outbound_instance
+    if METRICS_ENABLED:
+        register_component_metrics(
+            db_instance,
+            {"init_data": init_data_cache, "leaderboard_response": leaderboard_responses, "invoice_link": invoice_links},
+            outbound_instance,
+        )
 
     config = uvicorn.Config(
         app,
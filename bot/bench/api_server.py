@@ -0,0 +1,84 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import api  # noqa: E402
+from aiogram import Dispatcher  # noqa: E402
+from bot_handlers import register_bot_handlers  # noqa: E402
+from config import (  # noqa: E402
+    API_HOST,
+    API_PORT,
+    PAYMENT_OUTBOX_BATCH_SIZE,
+    PAYMENT_OUTBOX_FLUSH_MS,
+    PAYMENT_OUTBOX_FSYNC,
+    PAYMENT_OUTBOX_PATH,
+    UPDATE_OTHER_WORKERS,
+    UPDATE_PAYMENT_WORKERS,
+    UPDATE_PRE_CHECKOUT_WORKERS,
+    UPDATE_QUEUE_SIZE,
+)
+from log_setup import setup_logging  # noqa: E402
+from main import build_bot, build_outbound  # noqa: E402
+from payment_outbox import PaymentOutbox  # noqa: E402
+from storage import create_storage  # noqa: E402
+from update_scheduler import OTHER, PRE_CHECKOUT, SUCCESSFUL_PAYMENT, UpdateScheduler, poll_updates  # noqa: E402
+
+
+async def serve() -> None:
+    # The bot as main.main() runs it in polling mode, with the FastAPI app
+    # from api.py in place of the aiohttp routes, so loadgen.py can drive
+    # /api/payments/invoice and the payment flow in one process.
+    bot = build_bot()
+    dp = Dispatcher()
+    db = create_storage()
+    await db.init()
+    outbound = build_outbound()
+    await outbound.start()
+    outbox = PaymentOutbox(
+        PAYMENT_OUTBOX_PATH,
+        db,
+        batch_size=PAYMENT_OUTBOX_BATCH_SIZE,
+        flush_interval_ms=PAYMENT_OUTBOX_FLUSH_MS,
+        fsync=PAYMENT_OUTBOX_FSYNC,
+    )
+    await outbox.start()
+
+    register_bot_handlers(dp, db, outbound, outbox)
+    updates = UpdateScheduler(
+        dp,
+        bot,
+        queue_size=UPDATE_QUEUE_SIZE,
+        workers={
+            PRE_CHECKOUT: UPDATE_PRE_CHECKOUT_WORKERS,
+            SUCCESSFUL_PAYMENT: UPDATE_PAYMENT_WORKERS,
+            OTHER: UPDATE_OTHER_WORKERS,
+        },
+    )
+    await updates.start()
+    await bot.delete_webhook()
+    poller = asyncio.create_task(poll_updates(bot, updates, allowed_updates=dp.resolve_used_update_types()))
+    try:
+        await api.run_api_server(bot, db, API_HOST, API_PORT, outbound)
+    finally:
+        poller.cancel()
+        await updates.stop()
+        await outbox.stop()
+        await outbound.stop()
+        await db.close()
+        await bot.session.close()
+
+
+def main() -> None:
+    listener = setup_logging()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.stop()
+
+
+if __name__ == "__main__":
+    main()
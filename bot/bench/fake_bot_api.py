@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter, deque
+from pathlib import Path
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.webhook_harness import _percentile, pre_checkout_update, successful_payment_update  # noqa: E402
+
+
+logger = logging.getLogger(__name__)
+
+
+class FakeBotApi:
+    # A local stand-in for api.telegram.org. Point TELEGRAM_API_BASE_URL at
+    # base_url to exercise the outbound scheduler with controllable latency and
+    # injected 429 responses instead of real flood limits. push_payment()
+    # queues a synthetic pre-checkout query for getUpdates; once the bot
+    # approves it the matching successful_payment follows, and the bot's
+    # confirmation message completes the flow.
+    def __init__(
+        self,
+        *,
+        latency_ms: float = 0.0,
+        rate_limit_ratio: float = 0.0,
+        retry_after: int = 1,
+        seed: int | None = None,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.counts: Counter[str] = Counter()
+        self.rate_limited: Counter[str] = Counter()
+        self.calls: list[tuple[str, dict, float]] = []
+        self._forced_rate_limits = 0
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+        self.base_url = ""
+
+        self._updates: deque[dict] = deque()
+        self._updates_changed = asyncio.Event()
+        self._pending_pre_checkouts: dict[str, tuple[int, int, float]] = {}
+        self._pending_confirmations: dict[int, deque[float]] = {}
+        self.payments: Counter[str] = Counter()
+        self.pre_checkout_latencies: list[float] = []
+        self.payment_latencies: list[float] = []
+
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self._handle)
+        self.app.router.add_get("/bot{token}/{method}", self._handle)
+
+    def rate_limit_next(self, count: int = 1, retry_after: int | None = None) -> None:
+        self._forced_rate_limits += count
+        if retry_after is not None:
+            self.retry_after = retry_after
+
+    def push_payment(self, user_id: int, amount: int = 25) -> str:
+        update = pre_checkout_update(user_id, amount)
+        query_id = update["pre_checkout_query"]["id"]
+        self._pending_pre_checkouts[query_id] = (user_id, amount, time.perf_counter())
+        self.payments["pushed"] += 1
+        self._queue_update(update)
+        return query_id
+
+    async def generate_payments(self, rate: float, users: int, amounts: tuple[int, ...] = (25, 50, 100)) -> None:
+        # Pushes payments at a steady rate until cancelled.
+        interval = 1 / rate
+        next_at = time.perf_counter()
+        while True:
+            self.push_payment(1_000_000 + self._random.randrange(users), self._random.choice(amounts))
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    def _queue_update(self, update: dict) -> None:
+        self._updates.append(update)
+        self._updates_changed.set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_host, bound_port = self._runner.addresses[0][:2]
+        self.base_url = f"http://{bound_host}:{bound_port}"
+        logger.info("fake_bot_api_started", extra={"base_url": self.base_url})
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _read_params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        form = await request.post()
+        params = {}
+        for key, value in form.items():
+            params[key] = value if isinstance(value, str) else value.file.read().decode()
+        return params
+
+    def _should_rate_limit(self) -> bool:
+        if self._forced_rate_limits:
+            self._forced_rate_limits -= 1
+            return True
+        return self.rate_limit_ratio > 0 and self._random.random() < self.rate_limit_ratio
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._read_params(request)
+        self.counts[method] += 1
+        self.calls.append((method, params, time.monotonic()))
+
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+        if method != "getUpdates" and self._should_rate_limit():
+            self.rate_limited[method] += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                status=429,
+            )
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        handler = getattr(self, f"_method_{method}", None)
+        if handler is None:
+            return web.json_response(
+                {"ok": False, "error_code": 404, "description": "Not Found: method not found"},
+                status=404,
+            )
+        return web.json_response({"ok": True, "result": handler(params)})
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        # Long polling as Telegram does it: updates below offset are
+        # confirmed and dropped, and an empty queue waits up to timeout.
+        offset = int(params.get("offset") or 0)
+        limit = max(1, min(int(params.get("limit") or 100), 100))
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        while True:
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            if self._updates or time.monotonic() >= deadline:
+                return [update for update, _ in zip(self._updates, range(limit))]
+            self._updates_changed.clear()
+            try:
+                await asyncio.wait_for(self._updates_changed.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+
+    def _method_getMe(self, params: dict) -> dict:
+        return {"id": 1, "is_bot": True, "first_name": "Fake Bot", "username": "fake_bot"}
+
+    def _method_createInvoiceLink(self, params: dict) -> str:
+        return f"https://t.me/$fake_invoice_{next(self._ids)}"
+
+    def _method_answerPreCheckoutQuery(self, params: dict) -> bool:
+        pending = self._pending_pre_checkouts.pop(params.get("pre_checkout_query_id", ""), None)
+        if pending is None:
+            return True
+        user_id, amount, pushed_at = pending
+        self.pre_checkout_latencies.append(time.perf_counter() - pushed_at)
+        if str(params.get("ok")).lower() != "true":
+            self.payments["rejected"] += 1
+            return True
+
+        self.payments["approved"] += 1
+        self._pending_confirmations.setdefault(user_id, deque()).append(pushed_at)
+        self._queue_update(successful_payment_update(user_id, amount))
+        return True
+
+    def _method_deleteWebhook(self, params: dict) -> bool:
+        return True
+
+    def _method_sendMessage(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        waiting = self._pending_confirmations.get(chat_id)
+        if waiting:
+            self.payments["completed"] += 1
+            self.payment_latencies.append(time.perf_counter() - waiting.popleft())
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    def stats(self) -> dict:
+        stats = {"counts": dict(self.counts), "rate_limited": dict(self.rate_limited)}
+        if self.payments:
+            stats["payments"] = {
+                **self.payments,
+                "pre_checkout_p99_ms": round(_percentile(self.pre_checkout_latencies, 0.99) * 1000, 3),
+                "payment_p99_ms": round(_percentile(self.payment_latencies, 0.99) * 1000, 3),
+            }
+        return stats
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    fake = FakeBotApi(
+        latency_ms=args.latency_ms,
+        rate_limit_ratio=args.rate_limit_ratio,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    base_url = await fake.start(args.host, args.port)
+    print(f"TELEGRAM_API_BASE_URL={base_url}", flush=True)
+    generator = None
+    if args.payments_per_second > 0:
+        generator = asyncio.create_task(fake.generate_payments(args.payments_per_second, args.users))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if generator is not None:
+            generator.cancel()
+        print(json.dumps(fake.stats()), flush=True)
+        await fake.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a local fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--payments-per-second", type=float, default=0.0, help="synthetic payments served via getUpdates")
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlencode
+
+import aiohttp
+
+BOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BOT_DIR))
+
+from bench.fake_bot_api import FakeBotApi  # noqa: E402
+from bench.webhook_harness import _percentile  # noqa: E402
+
+
+BENCH_BOT_TOKEN = "123456:BENCH-TOKEN"
+# HTTP scenarios and the request each one sends; "payments" is the update
+# flow through the fake Bot API instead (pre-checkout, successful_payment,
+# confirmation message).
+HTTP_SCENARIOS = {
+    "invoice": "GET /api/invoice",
+    "payments_invoice": "POST /api/payments/invoice",
+    "leaderboard": "GET /api/leaderboard",
+}
+PAYMENTS = "payments"
+PRE_CHECKOUT = "pre_checkout"
+SERVERS = {
+    "aiohttp": BOT_DIR / "supervisor.py",
+    "fastapi": BOT_DIR / "bench" / "api_server.py",
+}
+DEFAULT_RATES = {
+    "aiohttp": "invoice=10,leaderboard=50,payments=5",
+    "fastapi": "invoice=10,payments_invoice=10,leaderboard=50,payments=5",
+}
+AMOUNTS = (25, 50, 100)
+
+
+def sign_init_data(bot_token: str, user: dict, auth_date: int | None = None) -> str:
+    # Signed the way Telegram signs Mini App initData, so the server runs its
+    # real HMAC check (and its cache) on every request.
+    data = {
+        "auth_date": str(auth_date or int(time.time())),
+        "query_id": f"bench-{user['id']}",
+        "user": json.dumps(user, separators=(",", ":")),
+    }
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(data.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    data["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(data)
+
+
+def parse_rates(text: str) -> dict[str, float]:
+    rates = {}
+    for item in text.split(","):
+        name, _, rate = item.partition("=")
+        name = name.strip()
+        if not name:
+            continue
+        if name not in HTTP_SCENARIOS and name != PAYMENTS:
+            raise ValueError(f"unknown scenario: {name}")
+        rates[name] = float(rate)
+    return rates
+
+
+def summarize(latencies: list[float], statuses: Counter, elapsed: float) -> dict:
+    completed = sum(statuses.values())
+    ok = sum(total for status, total in statuses.items() if str(status)[0] in "23")
+    return {
+        "requests": completed,
+        "ok": ok,
+        "error_ratio": round((completed - ok) / completed, 4) if completed else 0.0,
+        "statuses": {str(status): total for status, total in sorted(statuses.items(), key=str)},
+        "rps": round(completed / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+
+async def _open_loop(rate: float, duration: float, max_in_flight: int, fire) -> tuple[Counter, list[float]]:
+    # Requests start on a fixed schedule whether or not earlier ones have
+    # finished, and latency counts from the scheduled start, so a stalled
+    # server shows up in the tail instead of silently lowering the rate.
+    statuses: Counter = Counter()
+    latencies: list[float] = []
+    in_flight: set[asyncio.Task] = set()
+    interval = 1 / rate
+    started_at = time.perf_counter()
+    scheduled = started_at
+
+    async def one(scheduled_at: float) -> None:
+        try:
+            status = await fire()
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except aiohttp.ClientError:
+            status = "connection_error"
+        statuses[status] += 1
+        latencies.append(time.perf_counter() - scheduled_at)
+
+    while scheduled < started_at + duration:
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        if len(in_flight) >= max_in_flight:
+            statuses["dropped"] += 1
+        else:
+            task = asyncio.create_task(one(scheduled))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        scheduled += interval
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    return statuses, latencies
+
+
+async def drive_http(
+    session: aiohttp.ClientSession,
+    base_url: str,
+    scenario: str,
+    rate: float,
+    duration: float,
+    init_data: list[str],
+    rng: random.Random,
+    max_in_flight: int,
+) -> dict:
+    method, path = HTTP_SCENARIOS[scenario].split(" ", 1)
+
+    async def fire():
+        headers = {"X-Telegram-Init-Data": rng.choice(init_data)}
+        if scenario == "leaderboard":
+            request = session.get(f"{base_url}{path}", params={"limit": "50"}, headers=headers)
+        elif method == "POST":
+            request = session.post(f"{base_url}{path}", json={"amount": rng.choice(AMOUNTS)}, headers=headers)
+        else:
+            request = session.get(f"{base_url}{path}", params={"amount": str(rng.choice(AMOUNTS))}, headers=headers)
+        async with request as response:
+            await response.read()
+            return response.status
+
+    started_at = time.perf_counter()
+    statuses, latencies = await _open_loop(rate, duration, max_in_flight, fire)
+    return summarize(latencies, statuses, time.perf_counter() - started_at)
+
+
+async def drive_payments(
+    fake: FakeBotApi,
+    rate: float,
+    duration: float,
+    users: int,
+    rng: random.Random,
+    drain_seconds: float,
+) -> dict[str, dict]:
+    fake.payments.clear()
+    fake.pre_checkout_latencies.clear()
+    fake.payment_latencies.clear()
+
+    async def fire():
+        fake.push_payment(1_000_000 + rng.randrange(users), rng.choice(AMOUNTS))
+        return "pushed"
+
+    started_at = time.perf_counter()
+    await _open_loop(rate, duration, sys.maxsize, fire)
+    elapsed = time.perf_counter() - started_at
+    deadline = time.perf_counter() + drain_seconds
+    while fake.payments["completed"] + fake.payments["rejected"] < fake.payments["pushed"]:
+        if time.perf_counter() >= deadline:
+            break
+        await asyncio.sleep(0.05)
+
+    pushed = fake.payments["pushed"]
+    answered = len(fake.pre_checkout_latencies)
+    completed = fake.payments["completed"]
+    pre_checkout = Counter({"approved": fake.payments["approved"], "rejected": fake.payments["rejected"]})
+    pre_checkout["unanswered"] = pushed - answered
+    flow = Counter({"completed": completed, "rejected": fake.payments["rejected"]})
+    flow["unfinished"] = pushed - completed - fake.payments["rejected"]
+    reports = {
+        PRE_CHECKOUT: summarize(fake.pre_checkout_latencies, +pre_checkout, elapsed),
+        PAYMENTS: summarize(fake.payment_latencies, +flow, elapsed),
+    }
+    # Outcomes here are not HTTP statuses; only approved/completed count as ok.
+    reports[PRE_CHECKOUT]["ok"] = pre_checkout["approved"]
+    reports[PAYMENTS]["ok"] = completed
+    for report in reports.values():
+        report["error_ratio"] = round((pushed - report["ok"]) / pushed, 4) if pushed else 0.0
+    return reports
+
+
+async def run_load(
+    base_url: str,
+    rates: dict[str, float],
+    *,
+    duration: float,
+    users: int,
+    bot_token: str,
+    fake: FakeBotApi | None,
+    seed: int,
+    max_in_flight: int,
+    drain_seconds: float,
+) -> dict[str, dict]:
+    rng = random.Random(seed)
+    init_data = [
+        sign_init_data(bot_token, {"id": 1_000_000 + index, "first_name": f"Load{index}", "username": f"load{index}"})
+        for index in range(users)
+    ]
+    timeout = aiohttp.ClientTimeout(total=30)
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        jobs = {
+            scenario: drive_http(session, base_url, scenario, rate, duration, init_data, rng, max_in_flight)
+            for scenario, rate in rates.items()
+            if scenario in HTTP_SCENARIOS and rate > 0
+        }
+        if rates.get(PAYMENTS, 0) > 0 and fake is not None:
+            jobs[PAYMENTS] = drive_payments(fake, rates[PAYMENTS], duration, users, rng, drain_seconds)
+        results = dict(zip(jobs, await asyncio.gather(*jobs.values())))
+
+    scenarios = {}
+    for name, result in results.items():
+        if name == PAYMENTS:
+            scenarios.update(result)
+        else:
+            scenarios[name] = result
+    return scenarios
+
+
+def _git_revision() -> dict:
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=BOT_DIR, capture_output=True, text=True, check=False
+        ).stdout.strip()
+
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(server: str, fake_base_url: str, port: int, data_dir: Path, extra_env: dict[str, str]) -> subprocess.Popen:
+    # A throwaway database and outbox per run, Telegram pointed at the fake,
+    # polling instead of a webhook; --env overrides anything here.
+    env = {
+        **os.environ,
+        "BOT_TOKEN": BENCH_BOT_TOKEN,
+        "WEB_APP_URL": "https://bench.invalid",
+        "TELEGRAM_API_BASE_URL": fake_base_url,
+        "WEBHOOK_URL": "",
+        "API_HOST": "127.0.0.1",
+        "API_PORT": str(port),
+        "DB_PATH": str(data_dir / "app.db"),
+        "PAYMENT_OUTBOX_PATH": str(data_dir / "app.outbox.jsonl"),
+        "DB_BACKUP_INTERVAL_SECONDS": "0",
+        "LOG_LEVEL": "WARNING",
+        **extra_env,
+    }
+    # The server's own output goes to stderr so stdout carries only the report.
+    return subprocess.Popen([sys.executable, str(SERVERS[server])], env=env, stdout=sys.stderr)
+
+
+async def wait_ready(base_url: str, process: subprocess.Popen | None, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"server exited with code {process.returncode}")
+            try:
+                async with session.get(f"{base_url}/api/leaderboard") as response:
+                    await response.read()
+                    return
+            except aiohttp.ClientError:
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"server at {base_url} did not come up in {timeout:.0f}s")
+                await asyncio.sleep(0.2)
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def compare_reports(baseline: dict, current: dict, tolerance: float) -> dict:
+    # Relative change per scenario; a regression is a p99 or p95 that grew, or
+    # an RPS that fell, by more than `tolerance`, or an error ratio that rose
+    # by more than `tolerance` in absolute terms.
+    scenarios = {}
+    regressions = []
+    for name, now in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        deltas = {}
+        for key in ("p50_ms", "p95_ms", "p99_ms", "rps"):
+            deltas[key] = round((now[key] - before[key]) / before[key], 4) if before[key] else None
+        deltas["error_ratio"] = round(now["error_ratio"] - before["error_ratio"], 4)
+        scenarios[name] = deltas
+
+        for key in ("p95_ms", "p99_ms"):
+            if deltas[key] is not None and deltas[key] > tolerance:
+                regressions.append(f"{name}.{key} {before[key]} -> {now[key]}")
+        if deltas["rps"] is not None and deltas["rps"] < -tolerance:
+            regressions.append(f"{name}.rps {before['rps']} -> {now['rps']}")
+        if deltas["error_ratio"] > tolerance:
+            regressions.append(f"{name}.error_ratio {before['error_ratio']} -> {now['error_ratio']}")
+
+    return {
+        "baseline": baseline.get("meta", {}).get("commit"),
+        "current": current.get("meta", {}).get("commit"),
+        "tolerance": tolerance,
+        "scenarios": scenarios,
+        "regressions": regressions,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    server = args.server
+    rates = parse_rates(args.rates or DEFAULT_RATES[server])
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    fake = FakeBotApi(latency_ms=args.api_latency_ms, rate_limit_ratio=args.rate_limit_ratio, seed=args.seed)
+    await fake.start(port=args.fake_port)
+
+    process = None
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            if args.target:
+                base_url = args.target.rstrip("/")
+            else:
+                port = _free_port()
+                base_url = f"http://127.0.0.1:{port}"
+                process = spawn_server(server, fake.base_url, port, Path(tmp), extra_env)
+            await wait_ready(base_url, process)
+
+            load = dict(
+                users=args.users,
+                bot_token=args.bot_token,
+                fake=fake,
+                seed=args.seed,
+                max_in_flight=args.max_in_flight,
+                drain_seconds=args.drain,
+            )
+            if args.warmup > 0:
+                await run_load(base_url, rates, duration=args.warmup, **load)
+            scenarios = await run_load(base_url, rates, duration=args.duration, **load)
+        finally:
+            if process is not None:
+                stop_server(process)
+            await fake.stop()
+
+    return {
+        "meta": {
+            **_git_revision(),
+            "started_at": int(time.time()),
+            "server": "external" if args.target else server,
+            "duration_s": args.duration,
+            "rates": rates,
+            "users": args.users,
+            "api_latency_ms": args.api_latency_ms,
+            "rate_limit_ratio": args.rate_limit_ratio,
+            "env": extra_env,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "scenarios": scenarios,
+        "fake_bot_api": fake.stats(),
+    }
+
+
+def _load_report(path: str) -> dict:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drive the API and payment flow against a fake Bot API and report latency")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="start the bot against a fake Bot API and apply load")
+    run_parser.add_argument("--server", choices=tuple(SERVERS), default="aiohttp")
+    run_parser.add_argument("--target", help="base URL of an already running server instead of spawning one")
+    run_parser.add_argument("--bot-token", default=BENCH_BOT_TOKEN, help="token the target verifies initData with")
+    run_parser.add_argument("--fake-port", type=int, default=0, help="fixed port for the fake Bot API, for --target")
+    run_parser.add_argument("--rates", help="requests or payments per second, e.g. invoice=10,leaderboard=50,payments=5")
+    run_parser.add_argument("--duration", type=float, default=30.0)
+    run_parser.add_argument("--warmup", type=float, default=3.0)
+    run_parser.add_argument("--drain", type=float, default=10.0, help="seconds to wait for in-flight payments")
+    run_parser.add_argument("--users", type=int, default=1000)
+    run_parser.add_argument("--max-in-flight", type=int, default=1000)
+    run_parser.add_argument("--api-latency-ms", type=float, default=50.0)
+    run_parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--env", action="append", default=[], help="KEY=VALUE for the spawned server")
+    run_parser.add_argument("--output", help="write the JSON report here as well")
+    run_parser.add_argument("--baseline", help="compare against an earlier report")
+    run_parser.add_argument("--tolerance", type=float, default=0.1)
+
+    compare_parser = commands.add_parser("compare", help="compare two saved reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        comparison = compare_reports(_load_report(args.baseline), _load_report(args.current), args.tolerance)
+        print(json.dumps(comparison, indent=2))
+        sys.exit(1 if comparison["regressions"] else 0)
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        report["comparison"] = compare_reports(_load_report(args.baseline), report, args.tolerance)
+    print(json.dumps(report, indent=2))
+    if args.baseline and report["comparison"]["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage import STORAGE_BACKENDS, create_storage  # noqa: E402
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "first_name": f"Bench{user_id}", "username": f"bench{user_id}"}
+
+
+def _payments(users: int, count: int, seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    payments = []
+    for index in range(count):
+        user_id = 1_000_000 + rng.randrange(users)
+        payments.append(
+            {
+                "charge_id": f"bench-{index}",
+                "user_id": user_id,
+                "amount": rng.choice((25, 50, 100)),
+                "payer": _user(user_id),
+            }
+        )
+    return payments
+
+
+async def _timed(name: str, count: int, operation) -> dict:
+    started_at = time.perf_counter()
+    await operation()
+    elapsed = time.perf_counter() - started_at
+    return {
+        "phase": name,
+        "operations": count,
+        "elapsed_s": round(elapsed, 3),
+        "ops_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+async def run_workload(
+    backend: str,
+    path: Path,
+    *,
+    users: int,
+    payments: int,
+    batch_size: int,
+    reads: int,
+    seed: int,
+    concurrency: int,
+) -> dict:
+    # The same operations for every backend: register users, credit a
+    # replayed payment stream through the ledger from `concurrency` writers,
+    # then page the leaderboard and look up ranks. "sqlite:4" names the
+    # SQLite engine split over four shards.
+    name, _, shards = backend.partition(":")
+    storage = create_storage(name, path, shards=int(shards or 1))
+    await storage.init()
+    stream = _payments(users, payments, seed)
+    rng = random.Random(seed)
+    phases = []
+    try:
+        async def upserts() -> None:
+            for index in range(users):
+                await storage.upsert_user(_user(1_000_000 + index))
+
+        batches = [stream[start : start + batch_size] for start in range(0, len(stream), batch_size)]
+        star_user_ids = [1_000_000 + rng.randrange(users) for _ in range(reads)]
+
+        async def concurrently(items: list, operation) -> None:
+            async def writer(offset: int) -> None:
+                for item in items[offset :: max(1, concurrency)]:
+                    await operation(item)
+
+            await asyncio.gather(*(writer(offset) for offset in range(max(1, concurrency))))
+
+        async def credits() -> None:
+            await concurrently(batches, storage.apply_payments)
+            # Replaying the stream must not credit anything twice.
+            await concurrently(batches, storage.apply_payments)
+
+        async def stars() -> None:
+            await concurrently(star_user_ids, lambda user_id: storage.add_spent_stars(user_id, 25))
+
+        async def pages() -> None:
+            for _ in range(reads):
+                await storage.get_leaderboard(limit=50, offset=rng.randrange(max(1, users - 50)))
+
+        async def ranks() -> None:
+            for _ in range(reads):
+                await storage.get_user_rank(1_000_000 + rng.randrange(users), neighbours=2)
+
+        phases.append(await _timed("upsert_user", users, upserts))
+        phases.append(await _timed("apply_payments", 2 * len(stream), credits))
+        phases.append(await _timed("add_spent_stars", reads, stars))
+        await storage.flush()
+        phases.append(await _timed("get_leaderboard", reads, pages))
+        phases.append(await _timed("get_user_rank", reads, ranks))
+        top = await storage.get_leaderboard(limit=10)
+    finally:
+        await storage.close()
+
+    return {"backend": backend, "phases": phases, "top_user_ids": [entry["userId"] for entry in top]}
+
+
+async def compare(backends: tuple[str, ...], **workload) -> dict:
+    reports = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            name = backend.replace(":", "-")
+            reports.append(await run_workload(backend, Path(tmp) / name / "app.db", **workload))
+    # Identical workloads must end in identical rankings, otherwise the
+    # throughput numbers are not comparable.
+    rankings = {tuple(report["top_user_ids"]) for report in reports}
+    return {"workload": workload, "consistent": len(rankings) <= 1, "backends": reports}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run the same storage workload against each backend, e.g. --backends memory,sqlite,sqlite:4"
+    )
+    parser.add_argument("--backends", default=",".join(STORAGE_BACKENDS))
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--payments", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--reads", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    backends = tuple(backend.strip() for backend in args.backends.split(",") if backend.strip())
+    report = asyncio.run(
+        compare(
+            backends,
+            users=args.users,
+            payments=args.payments,
+            batch_size=args.batch_size,
+            reads=args.reads,
+            seed=args.seed,
+            concurrency=args.concurrency,
+        )
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+import aiohttp
+
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+UPDATE_KINDS = ("start", "pre_checkout", "successful_payment")
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}", "username": f"load{user_id}"}
+
+
+def start_update(user_id: int) -> dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+def pre_checkout_update(user_id: int, amount: int = 25) -> dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "pre_checkout_query": {
+            "id": f"pcq-{update_id}",
+            "from": _user(user_id),
+            "currency": "XTR",
+            "total_amount": amount,
+            "invoice_payload": json.dumps({"amount": amount, "user_id": user_id}),
+        },
+    }
+
+
+def successful_payment_update(user_id: int, amount: int = 25) -> dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "successful_payment": {
+                "currency": "XTR",
+                "total_amount": amount,
+                "invoice_payload": json.dumps({"amount": amount, "user_id": user_id}),
+                "telegram_payment_charge_id": f"charge-{update_id}",
+                "provider_payment_charge_id": "",
+            },
+        },
+    }
+
+
+def build_update(kind: str, user_id: int, amount: int = 25) -> dict:
+    if kind == "start":
+        return start_update(user_id)
+    if kind == "pre_checkout":
+        return pre_checkout_update(user_id, amount)
+    if kind == "successful_payment":
+        return successful_payment_update(user_id, amount)
+    raise ValueError(f"unknown update kind: {kind}")
+
+
+def _percentile(samples: list[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def post_updates(
+    url: str,
+    secret: str,
+    *,
+    count: int,
+    concurrency: int = 10,
+    kinds: tuple[str, ...] = UPDATE_KINDS,
+    users: int = 100,
+    amount: int = 25,
+) -> dict:
+    statuses: Counter[int] = Counter()
+    latencies: list[float] = []
+    queue: asyncio.Queue[dict] = asyncio.Queue()
+    for index in range(count):
+        queue.put_nowait(build_update(kinds[index % len(kinds)], 1_000_000 + index % users, amount))
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        while not queue.empty():
+            update = queue.get_nowait()
+            started_at = time.perf_counter()
+            async with session.post(url, json=update, headers={SECRET_TOKEN_HEADER: secret}) as response:
+                await response.read()
+                statuses[response.status] += 1
+            latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - started_at
+
+    return {
+        "requests": count,
+        "statuses": {str(status): total for status, total in sorted(statuses.items())},
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="POST synthetic Telegram updates to a webhook endpoint")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram/webhook")
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--amount", type=int, default=25)
+    parser.add_argument("--kinds", default=",".join(UPDATE_KINDS))
+    args = parser.parse_args()
+
+    kinds = tuple(kind.strip() for kind in args.kinds.split(",") if kind.strip())
+    report = asyncio.run(
+        post_updates(
+            args.url,
+            args.secret,
+            count=args.count,
+            concurrency=args.concurrency,
+            kinds=kinds,
+            users=args.users,
+            amount=args.amount,
+        )
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
 import logging
+import time
 
 from aiogram import Dispatcher, types
 from aiogram.filters import CommandStart
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from config import ALLOWED_PRICES, MINI_APP_BUTTON, MINI_APP_URL
-from database import Database
+from metrics import PRE_CHECKOUT_ANSWER, reject
+from outbound import Lane, OutboundScheduler, send_outbound
+from payment_outbox import PaymentOutbox
 from payments import parse_invoice_payload, validate_payment_request
+from storage import Storage
 
 
 logger = logging.getLogger(__name__)
@@ -19,7 +23,21 @@ def build_start_keyboard() -> types.InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-async def process_pre_checkout_query(pre_checkout_query: types.PreCheckoutQuery) -> None:
+async def process_pre_checkout_query(
+    pre_checkout_query: types.PreCheckoutQuery,
+    outbound: OutboundScheduler | None = None,
+) -> None:
+    started_at = time.perf_counter()
+    try:
+        await _answer_pre_checkout_query(pre_checkout_query, outbound)
+    finally:
+        PRE_CHECKOUT_ANSWER.observe(time.perf_counter() - started_at)
+
+
+async def _answer_pre_checkout_query(
+    pre_checkout_query: types.PreCheckoutQuery,
+    outbound: OutboundScheduler | None,
+) -> None:
     logger.info(
         "pre_checkout_query_received",
         extra={
@@ -39,11 +57,16 @@ async def process_pre_checkout_query(pre_checkout_query: types.PreCheckoutQuery)
         },
     )
     if not payload:
+        reject("pre_checkout_invalid_payload")
         logger.warning(
             "pre_checkout_query_rejected",
             extra={"query_id": pre_checkout_query.id, "reason": "invalid_payload"},
         )
-        await pre_checkout_query.answer(ok=False, error_message="Некорректные данные платежа.")
+        await send_outbound(
+            outbound,
+            lambda: pre_checkout_query.answer(ok=False, error_message="Некорректные данные платежа."),
+            lane=Lane.PRE_CHECKOUT,
+        )
         return
 
     validation = validate_payment_request(
@@ -55,6 +78,7 @@ async def process_pre_checkout_query(pre_checkout_query: types.PreCheckoutQuery)
         from_user_id=pre_checkout_query.from_user.id,
     )
     if not validation.ok:
+        reject("pre_checkout_validation_failed")
         logger.warning(
             "pre_checkout_query_rejected",
             extra={
@@ -65,13 +89,21 @@ async def process_pre_checkout_query(pre_checkout_query: types.PreCheckoutQuery)
                 "payload": payload,
             },
         )
-        await pre_checkout_query.answer(ok=False, error_message=validation.error_message)
+        await send_outbound(
+            outbound,
+            lambda: pre_checkout_query.answer(ok=False, error_message=validation.error_message),
+            lane=Lane.PRE_CHECKOUT,
+        )
         return
 
-    await pre_checkout_query.answer(ok=True)
+    await send_outbound(outbound, lambda: pre_checkout_query.answer(ok=True), lane=Lane.PRE_CHECKOUT)
 
 
-async def process_successful_payment(message: types.Message, db: Database) -> None:
+async def process_successful_payment(
+    message: types.Message,
+    db: Storage,
+    outbox: PaymentOutbox | None = None,
+) -> None:
     successful_payment = message.successful_payment
     if not successful_payment:
         return
@@ -99,19 +131,33 @@ async def process_successful_payment(message: types.Message, db: Database) -> No
         },
     )
 
-    await db.upsert_user(
-        {
-            "id": message.from_user.id,
-            "username": message.from_user.username,
-            "first_name": message.from_user.first_name,
-            "last_name": message.from_user.last_name,
-            "photo_url": None,
-        }
-    )
+    payer = {
+        "id": message.from_user.id,
+        "username": message.from_user.username,
+        "first_name": message.from_user.first_name,
+        "last_name": message.from_user.last_name,
+        "photo_url": None,
+    }
+    if outbox is not None:
+        await outbox.append(
+            successful_payment.telegram_payment_charge_id,
+            payload["user_id"],
+            payload["amount"],
+            payer,
+            paid_at=int(message.date.timestamp()),
+        )
+        return
+
+    await db.upsert_user(payer)
     await db.add_spent_stars(payload["user_id"], payload["amount"])
 
 
-def register_bot_handlers(dp: Dispatcher, db: Database) -> None:
+def register_bot_handlers(
+    dp: Dispatcher,
+    db: Storage,
+    outbound: OutboundScheduler | None = None,
+    outbox: PaymentOutbox | None = None,
+) -> None:
     @dp.message(CommandStart())
     async def handle_start(message: types.Message) -> None:
         await db.upsert_user(
@@ -127,12 +173,23 @@ def register_bot_handlers(dp: Dispatcher, db: Database) -> None:
             "Привет! 🎁\n"
             "Жми на кнопку ниже, чтобы открыть мини-приложение и забрать подарки."
         )
-        await message.answer(text, reply_markup=build_start_keyboard())
+        await send_outbound(
+            outbound,
+            lambda: message.answer(text, reply_markup=build_start_keyboard()),
+            lane=Lane.CHAT,
+            chat_id=message.chat.id,
+        )
 
     @dp.pre_checkout_query()
     async def handle_pre_checkout(pre_checkout_query: types.PreCheckoutQuery) -> None:
-        await process_pre_checkout_query(pre_checkout_query)
+        await process_pre_checkout_query(pre_checkout_query, outbound)
 
     @dp.message(lambda message: message.successful_payment is not None)
     async def handle_successful_payment(message: types.Message) -> None:
-        await process_successful_payment(message, db)
+        await process_successful_payment(message, db, outbox)
+        await send_outbound(
+            outbound,
+            lambda: message.answer("Оплата прошла успешно! 🎉"),
+            lane=Lane.PAYMENT_REPLY,
+            chat_id=message.chat.id,
+        )
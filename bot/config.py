@@ -4,6 +4,23 @@ from pathlib import Path
 from dotenv import load_dotenv
 
 
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
+
+def _env_rates(name: str, default: str) -> dict[str, float]:
+    # "event=value,event=value" -> {"event": value}
+    rates = {}
+    for item in os.getenv(name, default).split(","):
+        event, _, value = item.partition("=")
+        if event.strip() and value.strip():
+            rates[event.strip()] = float(value)
+    return rates
+
+
 def _load_env_file() -> None:
     config_dir = Path(__file__).resolve().parent
     env_candidates = (
@@ -22,15 +39,98 @@ def _load_env_file() -> None:
 _load_env_file()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL")
 WEB_APP_URL = os.getenv("WEB_APP_URL") or os.getenv("APP_PUBLIC_URL")
 MINI_APP_URL = os.getenv("MINI_APP_URL") or WEB_APP_URL
 MINI_APP_BUTTON = os.getenv("MINI_APP_BUTTON", "Открыть мини-приложение")
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", "8080"))
+API_WORKERS = max(1, int(os.getenv("API_WORKERS", "1")))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", str(API_PORT + 1)))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_PRE_CHECKOUT_WORKERS = int(os.getenv("UPDATE_PRE_CHECKOUT_WORKERS", "4"))
+UPDATE_PAYMENT_WORKERS = int(os.getenv("UPDATE_PAYMENT_WORKERS", "4"))
+UPDATE_OTHER_WORKERS = int(os.getenv("UPDATE_OTHER_WORKERS", "8"))
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").strip().lower()
 DB_PATH = Path(os.getenv("DB_PATH", Path(__file__).with_name("app.db")))
+PAYMENT_OUTBOX_PATH = Path(os.getenv("PAYMENT_OUTBOX_PATH", DB_PATH.with_suffix(".outbox.jsonl")))
+PAYMENT_OUTBOX_BATCH_SIZE = int(os.getenv("PAYMENT_OUTBOX_BATCH_SIZE", "100"))
+PAYMENT_OUTBOX_FLUSH_MS = int(os.getenv("PAYMENT_OUTBOX_FLUSH_MS", "50"))
+PAYMENT_OUTBOX_FSYNC = _env_flag("PAYMENT_OUTBOX_FSYNC", True)
+DB_SHARDS = max(1, int(os.getenv("DB_SHARDS", "1")))
+# Deepest offset page served with DB_SHARDS > 1; deeper pages use the `next` cursor.
+LEADERBOARD_SHARDED_MAX_OFFSET = int(os.getenv("LEADERBOARD_SHARDED_MAX_OFFSET", "1000"))
+DB_SHARED = _env_flag("DB_SHARED", API_WORKERS > 1)
+DB_SYNC_INTERVAL_MS = int(os.getenv("DB_SYNC_INTERVAL_MS", "100"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "50000"))
+DB_WRITE_BEHIND = _env_flag("DB_WRITE_BEHIND", False)
+DB_WRITE_BEHIND_FLUSH_MS = int(os.getenv("DB_WRITE_BEHIND_FLUSH_MS", "50"))
+DB_WRITE_BEHIND_MAX_OPS = int(os.getenv("DB_WRITE_BEHIND_MAX_OPS", "500"))
+DB_STRICT_STAR_WRITES = _env_flag("DB_STRICT_STAR_WRITES", True)
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_EXECUTOR_MAX_BATCH = int(os.getenv("DB_EXECUTOR_MAX_BATCH", "64"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Same meaning as PRAGMA cache_size: negative values are KiB, positive are pages.
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-65536"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MAINTENANCE_ENABLED = _env_flag("DB_MAINTENANCE_ENABLED", True)
+# With maintenance on, commits no longer checkpoint on their own; the
+# maintenance task does it in the background instead.
+DB_WAL_AUTOCHECKPOINT = int(os.getenv("DB_WAL_AUTOCHECKPOINT", "0" if DB_MAINTENANCE_ENABLED else "1000"))
+DB_CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("DB_CHECKPOINT_INTERVAL_SECONDS", "10"))
+DB_CHECKPOINT_TRUNCATE_PAGES = int(os.getenv("DB_CHECKPOINT_TRUNCATE_PAGES", "4000"))
+DB_MAINTENANCE_IDLE_MS = int(os.getenv("DB_MAINTENANCE_IDLE_MS", "500"))
+DB_OPTIMIZE_INTERVAL_SECONDS = float(os.getenv("DB_OPTIMIZE_INTERVAL_SECONDS", "3600"))
+DB_ANALYZE_INTERVAL_SECONDS = float(os.getenv("DB_ANALYZE_INTERVAL_SECONDS", "86400"))
+DB_WINDOW_PRUNE_INTERVAL_SECONDS = float(os.getenv("DB_WINDOW_PRUNE_INTERVAL_SECONDS", "3600"))
+DB_BACKUP_DIR = Path(os.getenv("DB_BACKUP_DIR", DB_PATH.parent / "backups"))
+DB_BACKUP_INTERVAL_SECONDS = float(os.getenv("DB_BACKUP_INTERVAL_SECONDS", "86400"))
+DB_BACKUP_RETENTION = int(os.getenv("DB_BACKUP_RETENTION", "7"))
+DB_BACKUP_PAGES_PER_STEP = int(os.getenv("DB_BACKUP_PAGES_PER_STEP", "256"))
+DB_BACKUP_STEP_PAUSE_MS = int(os.getenv("DB_BACKUP_STEP_PAUSE_MS", "5"))
+DB_BACKUP_VERIFY = _env_flag("DB_BACKUP_VERIFY", True)
+LEADERBOARD_CACHE_SIZE = int(os.getenv("LEADERBOARD_CACHE_SIZE", "1000"))
+RANK_INDEX_ENABLED = _env_flag("RANK_INDEX_ENABLED", True)
+LEADERBOARD_SEASON_ID = os.getenv("LEADERBOARD_SEASON_ID")
+LEADERBOARD_RESPONSE_CACHE_SIZE = int(os.getenv("LEADERBOARD_RESPONSE_CACHE_SIZE", "256"))
 INIT_DATA_MAX_AGE_SECONDS = int(os.getenv("INIT_DATA_MAX_AGE_SECONDS", "600"))
+INIT_DATA_CACHE_SIZE = int(os.getenv("INIT_DATA_CACHE_SIZE", "4096"))
+INIT_DATA_CACHE_TTL_SECONDS = int(os.getenv("INIT_DATA_CACHE_TTL_SECONDS", str(INIT_DATA_MAX_AGE_SECONDS)))
 CORS_ALLOW_ORIGIN = os.getenv("CORS_ALLOW_ORIGIN")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+METRICS_ENABLED = _env_flag("METRICS_ENABLED", True)
+# With API_WORKERS > 1 the bot process serves /metrics on METRICS_PORT and
+# API worker N on METRICS_PORT + 1 + N.
+METRICS_PORT = int(os.getenv("METRICS_PORT", str(API_PORT + 2)))
 ALLOWED_PRICES = {25, 50, 100}
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_PER_CHAT_RATE = float(os.getenv("OUTBOUND_PER_CHAT_RATE", "1"))
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "4"))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "3"))
+INVOICE_LINK_CACHE_TTL_SECONDS = int(os.getenv("INVOICE_LINK_CACHE_TTL_SECONDS", "3600"))
+INVOICE_LINK_CACHE_SIZE = int(os.getenv("INVOICE_LINK_CACHE_SIZE", "10000"))
+INVOICE_PREWARM_AMOUNTS = {
+    int(amount) for amount in os.getenv("INVOICE_PREWARM_AMOUNTS", "").split(",") if amount.strip()
+} & ALLOWED_PRICES
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of records kept per event name; events not listed are kept in full.
+LOG_SAMPLE_RATES = _env_rates(
+    "LOG_SAMPLE_RATES",
+    "get_leaderboard_result=0.01,invoice_request_received=0.1,pre_checkout_query_payload_parsed=0.1",
+)
+# Records per second per event name, applied after sampling.
+LOG_RATE_LIMITS = _env_rates("LOG_RATE_LIMITS", "get_leaderboard_result=20,invoice_request_received=50")
+# Events starting with these prefixes are never sampled or rate limited.
+LOG_ALWAYS_KEEP = tuple(
+    prefix.strip()
+    for prefix in os.getenv("LOG_ALWAYS_KEEP", "payment_,successful_payment,add_spent_stars").split(",")
+    if prefix.strip()
+)
 
 
 def validate_config() -> None:
@@ -41,3 +141,17 @@ def validate_config() -> None:
         raise RuntimeError(
             "WEB_APP_URL is not set. Add WEB_APP_URL or MINI_APP_URL to .env so the bot can open your domain."
         )
+
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is not set. Webhook mode requires a secret token to verify Telegram requests.")
+
+    if STORAGE_BACKEND not in ("sqlite", "memory"):
+        raise RuntimeError(f"STORAGE_BACKEND must be 'sqlite' or 'memory', got {STORAGE_BACKEND!r}.")
+
+    if STORAGE_BACKEND == "memory" and API_WORKERS > 1:
+        raise RuntimeError("STORAGE_BACKEND=memory keeps data per process and cannot be used with API_WORKERS > 1.")
+
+    if not DB_SHARED and API_WORKERS > 1:
+        raise RuntimeError(
+            "DB_SHARED=false cannot be used with API_WORKERS > 1: workers would never see payments from the bot process."
+        )
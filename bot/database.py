@@ -1,56 +1,411 @@
 import asyncio
+import base64
+import binascii
 import logging
 import sqlite3
-import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
+from typing import Any, Callable
+
+from config import (
+    DB_ANALYZE_INTERVAL_SECONDS,
+    DB_BACKUP_DIR,
+    DB_BACKUP_INTERVAL_SECONDS,
+    DB_BACKUP_PAGES_PER_STEP,
+    DB_BACKUP_RETENTION,
+    DB_BACKUP_STEP_PAUSE_MS,
+    DB_BACKUP_VERIFY,
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE,
+    DB_CHECKPOINT_INTERVAL_SECONDS,
+    DB_CHECKPOINT_TRUNCATE_PAGES,
+    DB_EXECUTOR_MAX_BATCH,
+    DB_MAINTENANCE_ENABLED,
+    DB_MAINTENANCE_IDLE_MS,
+    DB_MMAP_SIZE,
+    DB_OPTIMIZE_INTERVAL_SECONDS,
+    DB_READ_POOL_SIZE,
+    DB_SHARED,
+    DB_SYNC_INTERVAL_MS,
+    DB_STRICT_STAR_WRITES,
+    DB_WAL_AUTOCHECKPOINT,
+    DB_WINDOW_PRUNE_INTERVAL_SECONDS,
+    DB_WRITE_BEHIND,
+    DB_WRITE_BEHIND_FLUSH_MS,
+    DB_WRITE_BEHIND_MAX_OPS,
+    LEADERBOARD_CACHE_SIZE,
+    PROFILE_CACHE_SIZE,
+    RANK_INDEX_ENABLED,
+)
+from db_backup import DbBackup
+from db_executor import DbExecutor
+from db_maintenance import DbMaintenance
+from db_pool import ReadConnectionPool
+from leaderboard_cache import TopLeaderboard
+from leaderboard_windows import ALL_TIME_WINDOW, current_window_ids, payment_window_ids, window_id
+from rank_index import RankIndex
+from singleflight import SingleFlight
 
 
 logger = logging.getLogger(__name__)
 
+_UPSERT_USER_SQL = """
+    INSERT INTO users (user_id, username, first_name, last_name, photo_url)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = COALESCE(excluded.username, users.username),
+        first_name = COALESCE(excluded.first_name, users.first_name),
+        last_name = COALESCE(excluded.last_name, users.last_name),
+        photo_url = COALESCE(excluded.photo_url, users.photo_url),
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+_ADD_SPENT_STARS_SQL = """
+    INSERT INTO users (user_id, spent_stars)
+    VALUES (?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        spent_stars = users.spent_stars + excluded.spent_stars,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+_ADD_WINDOW_STARS_SQL = """
+    INSERT INTO leaderboard_windows (window_id, user_id, stars)
+    VALUES (?, ?, ?)
+    ON CONFLICT(window_id, user_id) DO UPDATE SET
+        stars = leaderboard_windows.stars + excluded.stars
+"""
+
+_DELETE_WINDOW_ROWS_SQL = """
+    DELETE FROM leaderboard_windows
+    WHERE window_id = ? AND user_id IN (
+        SELECT user_id FROM leaderboard_windows WHERE window_id = ? LIMIT ?
+    )
+"""
+
+# Rows per DELETE when pruning a window, so each statement holds the write
+# lock only briefly.
+_WINDOW_PRUNE_CHUNK = 5000
+
+_RECORD_PAYMENT_SQL = """
+    INSERT OR IGNORE INTO payment_ledger (charge_id, user_id, amount, payer_id)
+    VALUES (?, ?, ?, ?)
+"""
+
+# Applied to every connection, writer and readers alike.
+_TUNING_PRAGMAS = (
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size={DB_CACHE_SIZE}",
+    f"PRAGMA mmap_size={DB_MMAP_SIZE}",
+)
+
+_LEADERBOARD_COLUMNS = "user_id, username, first_name, last_name, photo_url, spent_stars"
+
+
+def _profile_fingerprint(user: dict) -> tuple:
+    return (
+        user.get("username"),
+        user.get("first_name"),
+        user.get("last_name"),
+        user.get("photo_url"),
+    )
+
+
+def _coalesce_profile(newer: tuple, older: tuple | None) -> tuple:
+    if older is None:
+        return newer
+    return tuple(new if new is not None else old for new, old in zip(newer, older))
+
+
+def _prune_stale_windows(conn: sqlite3.Connection) -> int:
+    # Only the current day, week and season are ever read; rows of earlier
+    # windows are dead weight in the table and its ranking index.
+    current = current_window_ids()
+    stale = [
+        row[0]
+        for row in conn.execute("SELECT DISTINCT window_id FROM leaderboard_windows")
+        if row[0] not in current
+    ]
+    removed = 0
+    for stale_window in stale:
+        while True:
+            deleted = conn.execute(_DELETE_WINDOW_ROWS_SQL, (stale_window, stale_window, _WINDOW_PRUNE_CHUNK)).rowcount
+            removed += deleted
+            if deleted < _WINDOW_PRUNE_CHUNK:
+                break
+    return removed
+
+
+def encode_leaderboard_cursor(spent_stars: int, user_id: int) -> str:
+    raw = f"{spent_stars}:{user_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_leaderboard_cursor(cursor: str) -> tuple[int, int] | None:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        spent_stars_raw, user_id_raw = raw.split(":")
+        return int(spent_stars_raw), int(user_id_raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def next_leaderboard_cursor(leaderboard: list[dict], limit: int) -> str | None:
+    if not leaderboard or len(leaderboard) < limit:
+        return None
+
+    last = leaderboard[-1]
+    return encode_leaderboard_cursor(last["spentStars"], last["userId"])
+
 
 class Database:
-    def __init__(self, path: Path) -> None:
+    def __init__(
+        self,
+        path: Path,
+        profile_cache_size: int = PROFILE_CACHE_SIZE,
+        *,
+        write_behind: bool = DB_WRITE_BEHIND,
+        flush_interval_ms: int = DB_WRITE_BEHIND_FLUSH_MS,
+        flush_max_ops: int = DB_WRITE_BEHIND_MAX_OPS,
+        strict_star_writes: bool = DB_STRICT_STAR_WRITES,
+        read_pool_size: int = DB_READ_POOL_SIZE,
+        leaderboard_cache_size: int = LEADERBOARD_CACHE_SIZE,
+        rank_index_enabled: bool = RANK_INDEX_ENABLED,
+        shared: bool = DB_SHARED,
+        sync_interval_ms: int = DB_SYNC_INTERVAL_MS,
+        maintenance: bool = DB_MAINTENANCE_ENABLED,
+        backup_dir: Path = DB_BACKUP_DIR,
+        backup_interval: float = DB_BACKUP_INTERVAL_SECONDS,
+        shard: tuple[int, int] | None = None,
+    ) -> None:
         self.path = path
-        self._lock = asyncio.Lock()
-        self._conn: sqlite3.Connection | None = None
-        self._conn_init_lock = threading.Lock()
-
-    def _connect(self) -> sqlite3.Connection:
-        if self._conn is not None:
-            return self._conn
+        # (shard index, shard count) when this file is one shard of a
+        # ShardedStorage; recorded on first init and checked on every later one.
+        self.shard = shard
+        # In shared mode several processes write the same file. data_version
+        # mirrors a counter in sync_state that every write transaction bumps,
+        # and a poller reloads the in-process caches when another process moved it.
+        self.shared = shared
+        self._sync_interval = max(1, sync_interval_ms) / 1000
+        self._sync_task: asyncio.Task | None = None
+        # Last committed sync_state version the executor thread has seen, and
+        # the version the open write transaction has bumped it to; both are
+        # only touched there.
+        self._synced_version = 0
+        self._pending_version: int | None = None
+        self.cache_reloads = 0
+        self.read_pool_size = max(0, read_pool_size)
+        self._read_pool: ReadConnectionPool | None = None
+        self.data_version = 0
+        self.top_leaderboard = TopLeaderboard(leaderboard_cache_size)
+        # The rank index is rebuilt from a full scan, too costly to redo on every
+        # cross-process change, so shared mode ranks with SQL instead.
+        self.rank_index = RankIndex(enabled=rank_index_enabled and not shared)
+        self.leaderboard_flights = SingleFlight()
+        self._executor = DbExecutor(
+            self._connect,
+            max_batch=DB_EXECUTOR_MAX_BATCH,
+            on_commit=self._commit_version,
+            on_rollback=self._discard_version,
+        )
+        self._maintenance: DbMaintenance | None = None
+        if maintenance:
+            self._maintenance = DbMaintenance(
+                path,
+                lambda: self._executor.is_idle(DB_MAINTENANCE_IDLE_MS / 1000),
+                pragmas=_TUNING_PRAGMAS,
+                checkpoint_interval=DB_CHECKPOINT_INTERVAL_SECONDS,
+                truncate_pages=DB_CHECKPOINT_TRUNCATE_PAGES,
+                optimize_interval=DB_OPTIMIZE_INTERVAL_SECONDS,
+                analyze_interval=DB_ANALYZE_INTERVAL_SECONDS,
+                prune=_prune_stale_windows,
+                prune_interval=DB_WINDOW_PRUNE_INTERVAL_SECONDS,
+            )
+        self._backup = DbBackup(
+            path,
+            backup_dir,
+            latency_totals=self._executor.latency_totals,
+            pragmas=_TUNING_PRAGMAS,
+            interval=backup_interval,
+            retention=DB_BACKUP_RETENTION,
+            pages_per_step=DB_BACKUP_PAGES_PER_STEP,
+            step_pause_ms=DB_BACKUP_STEP_PAUSE_MS,
+            verify=DB_BACKUP_VERIFY,
+        )
+        self._profile_cache: OrderedDict[int, tuple] = OrderedDict()
+        self._profile_cache_size = max(0, profile_cache_size)
+        self.profile_writes = 0
+        self.profile_writes_skipped = 0
 
-        with self._conn_init_lock:
-            if self._conn is not None:
-                return self._conn
+        self.write_behind = write_behind
+        self.strict_star_writes = strict_star_writes
+        self._flush_interval = max(1, flush_interval_ms) / 1000
+        self._flush_max_ops = max(1, flush_max_ops)
+        self._pending_profiles: dict[int, tuple] = {}
+        self._pending_stars: dict[int, int] = {}
+        self._pending_strict_stars: dict[int, int] = {}
+        self._pending_ops = 0
+        self._flush_waiters: list[asyncio.Future] = []
+        self._flush_wakeup = asyncio.Event()
+        self._flusher_task: asyncio.Task | None = None
+        self._closing = False
+        self.flushes = 0
+        self.flushed_ops = 0
 
-            conn = sqlite3.connect(self.path, check_same_thread=False)
-            conn.row_factory = sqlite3.Row
-            conn.execute("PRAGMA journal_mode=WAL")
-            conn.execute("PRAGMA synchronous=NORMAL")
-            conn.execute("PRAGMA temp_store=MEMORY")
-            self._conn = conn
+    def _connect(self) -> sqlite3.Connection:
+        # Runs on the executor thread. Transactions are managed there
+        # explicitly, so the connection stays in autocommit mode.
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        for pragma in _TUNING_PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(f"PRAGMA wal_autocheckpoint={DB_WAL_AUTOCHECKPOINT}")
+        return conn
 
-        return self._conn
+    async def _write(self, fn: Callable[..., Any], *args: Any) -> tuple[Any, int | None, list[tuple] | None]:
+        return await self._executor.run(self._write_sync, fn, args, write=True)
 
-    def _commit(self) -> None:
-        self._connect().commit()
+    def _write_sync(self, conn: sqlite3.Connection, fn: Callable[..., Any], args: tuple) -> tuple[Any, int | None, list[tuple] | None]:
+        result = fn(conn, *args)
+        if not self.shared:
+            return result, None, None
+        version, reloaded = self._bump_version_sync(conn)
+        return result, version, reloaded
 
     async def close(self) -> None:
-        async with self._lock:
-            await asyncio.to_thread(self._close_sync)
+        self._closing = True
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            await asyncio.gather(self._sync_task, return_exceptions=True)
+            self._sync_task = None
+        if self._flusher_task is not None:
+            self._flush_wakeup.set()
+            await self._flusher_task
+            self._flusher_task = None
+        await self._backup.stop()
+        await self.flush()
+        if self._maintenance is not None:
+            await self._maintenance.stop()
 
-    def _close_sync(self) -> None:
-        conn = self._conn
-        if conn is not None:
-            conn.close()
-            self._conn = None
+        if self._read_pool is not None:
+            await asyncio.to_thread(self._read_pool.close)
+            self._read_pool = None
+
+        await self._executor.close()
+        self._profile_cache.clear()
 
     async def init(self) -> None:
-        await asyncio.to_thread(self._init_sync)
+        self._executor.start()
+        await self._executor.run(self._init_sync, write=True)
+        if self.read_pool_size and self._read_pool is None:
+            self._read_pool = ReadConnectionPool(self.path, self.read_pool_size, _TUNING_PRAGMAS)
+        if self.top_leaderboard.enabled:
+            rows = await self._read(self._load_top_sync, self.top_leaderboard.capacity)
+            self.top_leaderboard.load(rows)
+            logger.info("leaderboard_cache_loaded", extra=self.top_leaderboard.stats())
+        if self.rank_index.enabled:
+            self.rank_index.load(await self._read(self._load_ranks_sync))
+            logger.info("rank_index_loaded", extra={"users_count": len(self.rank_index)})
+        if self.write_behind and self._flusher_task is None:
+            self._closing = False
+            self._flusher_task = asyncio.create_task(self._run_flusher())
+        if self.shared and self._sync_task is None:
+            self.data_version, _ = await self._executor.run(self._sync_sync)
+            self._sync_task = asyncio.create_task(self._run_sync())
+        elif not self.shared:
+            # This counter lives only in memory. Starting it at the clock keeps
+            # a restarted process from reusing versions, and so ETags, that an
+            # earlier process already handed out for other content.
+            self.data_version = time.time_ns()
+        if self._maintenance is not None:
+            self._maintenance.start()
+        self._backup.start()
 
-    def _init_sync(self) -> None:
-        self.path.parent.mkdir(parents=True, exist_ok=True)
-        conn = self._connect()
+    def _sync_sync(self, conn: sqlite3.Connection) -> tuple[int, list[tuple] | None]:
+        version = conn.execute("SELECT version FROM sync_state WHERE id = 1").fetchone()[0]
+        if version == self._synced_version:
+            return version, None
+        self._synced_version = version
+        if not self.top_leaderboard.enabled:
+            return version, []
+        return version, self._load_top_sync(conn, self.top_leaderboard.capacity)
+
+    def _bump_version_sync(self, conn: sqlite3.Connection) -> tuple[int, list[tuple] | None]:
+        version = conn.execute(
+            "UPDATE sync_state SET version = version + 1 WHERE id = 1 RETURNING version"
+        ).fetchone()[0]
+        base = self._synced_version if self._pending_version is None else self._pending_version
+        expected, self._pending_version = base + 1, version
+        if version == expected or not self.top_leaderboard.enabled:
+            return version, None
+        # Another process committed since our last sync, so patching the cache
+        # with our rows alone would miss theirs.
+        return version, self._load_top_sync(conn, self.top_leaderboard.capacity)
+
+    def _commit_version(self) -> None:
+        # Only a committed bump may make the next one look "expected"; a failed
+        # COMMIT must not hide a write from another process.
+        if self._pending_version is not None:
+            self._synced_version = self._pending_version
+            self._pending_version = None
+
+    def _discard_version(self) -> None:
+        self._pending_version = None
+
+    async def _run_sync(self) -> None:
+        while True:
+            await asyncio.sleep(self._sync_interval)
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("db_sync_failed")
+
+    async def sync(self) -> None:
+        version, rows = await self._executor.run(self._sync_sync)
+        if rows is None:
+            return
+        if self.top_leaderboard.enabled:
+            self.top_leaderboard.load(rows)
+        self.data_version = version
+        self.cache_reloads += 1
+
+    def _load_top_sync(self, conn: sqlite3.Connection, limit: int) -> list[tuple]:
+        rows = conn.execute(
+            f"""
+            SELECT {_LEADERBOARD_COLUMNS}
+            FROM users
+            ORDER BY spent_stars DESC, user_id ASC
+            LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def _load_ranks_sync(self, conn: sqlite3.Connection) -> list[tuple[int, int]]:
+        return conn.execute("SELECT user_id, spent_stars FROM users").fetchall()
+
+    def _apply_row(self, row: tuple) -> None:
+        self.top_leaderboard.apply(row)
+        self.rank_index.update(row[0], row[5])
+
+    def _apply_rows(self, rows: list[tuple], version: int | None = None, reloaded: list[tuple] | None = None) -> None:
+        if reloaded is not None:
+            self.top_leaderboard.load(reloaded)
+            self.cache_reloads += 1
+        else:
+            for row in rows:
+                self._apply_row(row)
+
+        if version is not None:
+            self.data_version = version
+        else:
+            self.data_version += 1
+
+    def _init_sync(self, conn: sqlite3.Connection) -> None:
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -70,28 +425,123 @@ class Database:
             ON users (spent_stars DESC, user_id ASC)
             """
         )
-        self._commit()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leaderboard_windows (
+                window_id TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                stars INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (window_id, user_id)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_leaderboard_windows_ranking
+            ON leaderboard_windows (window_id, stars DESC, user_id ASC)
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sync_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute("INSERT OR IGNORE INTO sync_state (id, version) VALUES (1, 0)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS payment_ledger (
+                charge_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                payer_id INTEGER,
+                applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        if self.shard is not None:
+            self._check_shard_layout_sync(conn, *self.shard)
+
+    def _check_shard_layout_sync(self, conn: sqlite3.Connection, index: int, count: int) -> None:
+        # Users are routed by user_id % count, so opening a shard under another
+        # count would give users a second row and split their ledger.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS shard_layout (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                shard_index INTEGER NOT NULL,
+                shard_count INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO shard_layout (id, shard_index, shard_count) VALUES (1, ?, ?)",
+            (index, count),
+        )
+        stored = tuple(conn.execute("SELECT shard_index, shard_count FROM shard_layout WHERE id = 1").fetchone())
+        if stored != (index, count):
+            raise RuntimeError(
+                f"{self.path} is shard {stored[0]} of {stored[1]}, but DB_SHARDS={count} opens it as shard {index}. "
+                "Changing the shard count re-routes users; migrate the data instead."
+            )
+
+    def _merge_profile(self, user_id: int, fingerprint: tuple) -> tuple[tuple, bool]:
+        # Mirrors the COALESCE in _UPSERT_USER_SQL: missing fields keep the stored value.
+        cached = self._profile_cache.get(user_id)
+        if cached is None:
+            return fingerprint, False
+
+        merged = _coalesce_profile(fingerprint, cached)
+        if merged != cached:
+            return merged, False
+
+        self._profile_cache.move_to_end(user_id)
+        return merged, True
+
+    def _remember_profile(self, user_id: int, fingerprint: tuple) -> None:
+        if self._profile_cache_size == 0:
+            return
+
+        self._profile_cache[user_id] = fingerprint
+        self._profile_cache.move_to_end(user_id)
+        while len(self._profile_cache) > self._profile_cache_size:
+            self._profile_cache.popitem(last=False)
+
+    def profile_cache_stats(self) -> dict:
+        return {
+            "size": len(self._profile_cache),
+            "writes": self.profile_writes,
+            "writes_skipped": self.profile_writes_skipped,
+        }
 
     async def upsert_user(self, user: dict) -> None:
-        if not isinstance(user.get("id"), int):
+        user_id = user.get("id")
+        if not isinstance(user_id, int):
             return
 
-        async with self._lock:
-            await asyncio.to_thread(self._upsert_user_sync, user)
+        fingerprint, unchanged = self._merge_profile(user_id, _profile_fingerprint(user))
+        if unchanged:
+            self.profile_writes_skipped += 1
+            return
 
-    def _upsert_user_sync(self, user: dict) -> None:
-        conn = self._connect()
-        conn.execute(
-            """
-            INSERT INTO users (user_id, username, first_name, last_name, photo_url)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                username = COALESCE(excluded.username, users.username),
-                first_name = COALESCE(excluded.first_name, users.first_name),
-                last_name = COALESCE(excluded.last_name, users.last_name),
-                photo_url = COALESCE(excluded.photo_url, users.photo_url),
-                updated_at = CURRENT_TIMESTAMP
-            """,
+        if self.write_behind:
+            self._pending_profiles[user_id] = _coalesce_profile(
+                _profile_fingerprint(user),
+                self._pending_profiles.get(user_id),
+            )
+            self._queue_op()
+        else:
+            row, version, reloaded = await self._write(self._upsert_user_sync, user)
+            self._apply_rows([row], version, reloaded)
+
+        self.profile_writes += 1
+        self._remember_profile(user_id, fingerprint)
+
+    def _upsert_user_sync(self, conn: sqlite3.Connection, user: dict) -> tuple:
+        row = conn.execute(
+            _UPSERT_USER_SQL + f" RETURNING {_LEADERBOARD_COLUMNS}",
             (
                 user["id"],
                 user.get("username"),
@@ -99,55 +549,385 @@ class Database:
                 user.get("last_name"),
                 user.get("photo_url"),
             ),
-        )
-        self._commit()
+        ).fetchone()
+        return tuple(row)
 
     async def add_spent_stars(self, user_id: int, amount: int) -> None:
         if amount <= 0:
             logger.warning("add_spent_stars_skipped", extra={"user_id": user_id, "amount": amount, "reason": "non_positive_amount"})
             return
 
+        if self.write_behind:
+            await self._queue_spent_stars(user_id, amount)
+            return
+
         try:
-            async with self._lock:
-                await asyncio.to_thread(self._add_spent_stars_sync, user_id, amount)
+            row, version, reloaded = await self._write(self._add_spent_stars_sync, user_id, amount)
+            self._apply_rows([row], version, reloaded)
         except Exception:
             logger.exception("add_spent_stars_failed", extra={"user_id": user_id, "amount": amount})
             raise
 
-    def _add_spent_stars_sync(self, user_id: int, amount: int) -> None:
-        conn = self._connect()
+    def _add_spent_stars_sync(self, conn: sqlite3.Connection, user_id: int, amount: int) -> tuple:
         cursor = conn.execute(
-            """
-            INSERT INTO users (user_id, spent_stars)
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                spent_stars = users.spent_stars + excluded.spent_stars,
-                updated_at = CURRENT_TIMESTAMP
-            RETURNING spent_stars
-            """,
+            _ADD_SPENT_STARS_SQL + f" RETURNING {_LEADERBOARD_COLUMNS}",
             (user_id, amount),
         )
         row = cursor.fetchone()
-        self._commit()
+        conn.executemany(
+            _ADD_WINDOW_STARS_SQL,
+            [(current_window, user_id, amount) for current_window in current_window_ids()],
+        )
 
         logger.info(
             "add_spent_stars_succeeded",
             extra={
                 "user_id": user_id,
                 "amount_added": amount,
-                "current_spent_stars": row["spent_stars"] if row else None,
+                "current_spent_stars": row["spent_stars"],
+            },
+        )
+        return tuple(row)
+
+    async def apply_payments(self, payments: list[dict]) -> int:
+        # Credits a batch of outbox entries in one transaction. The ledger row
+        # and the credit commit together, so a replayed charge_id is a no-op.
+        if not payments:
+            return 0
+
+        (applied, rows), version, reloaded = await self._write(self._apply_payments_sync, payments)
+        self._apply_rows(rows, version, reloaded)
+
+        for payment in payments:
+            payer = payment.get("payer")
+            if payer and isinstance(payer.get("id"), int):
+                fingerprint, _ = self._merge_profile(payer["id"], _profile_fingerprint(payer))
+                self._remember_profile(payer["id"], fingerprint)
+        return applied
+
+    def _apply_payments_sync(self, conn: sqlite3.Connection, payments: list[dict]) -> tuple[int, list[tuple]]:
+        applied = 0
+        profiles: dict[int, tuple] = {}
+        stars: dict[int, int] = {}
+        window_stars: dict[tuple[str, int], int] = {}
+        for payment in payments:
+            payer = payment.get("payer") or {}
+            payer_id = payer.get("id")
+            cursor = conn.execute(
+                _RECORD_PAYMENT_SQL,
+                (payment["charge_id"], payment["user_id"], payment["amount"], payer_id),
+            )
+            if cursor.rowcount != 1:
+                continue
+            applied += 1
+            if isinstance(payer_id, int):
+                profiles[payer_id] = _coalesce_profile(_profile_fingerprint(payer), profiles.get(payer_id))
+            stars[payment["user_id"]] = stars.get(payment["user_id"], 0) + payment["amount"]
+            for payment_window in payment_window_ids(payment):
+                key = (payment_window, payment["user_id"])
+                window_stars[key] = window_stars.get(key, 0) + payment["amount"]
+
+        if profiles:
+            conn.executemany(
+                _UPSERT_USER_SQL,
+                [(user_id, *fingerprint) for user_id, fingerprint in profiles.items()],
+            )
+        if stars:
+            conn.executemany(_ADD_SPENT_STARS_SQL, list(stars.items()))
+            conn.executemany(
+                _ADD_WINDOW_STARS_SQL,
+                [(payment_window, user_id, amount) for (payment_window, user_id), amount in window_stars.items()],
+            )
+        rows = []
+        if applied:
+            rows = self._select_users_sync(conn, list(profiles.keys() | stars.keys()))
+
+        return applied, rows
+
+    async def _queue_spent_stars(self, user_id: int, amount: int) -> None:
+        if not self.strict_star_writes:
+            self._pending_stars[user_id] = self._pending_stars.get(user_id, 0) + amount
+            self._queue_op()
+            logger.info("add_spent_stars_queued", extra={"user_id": user_id, "amount": amount})
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending_strict_stars[user_id] = self._pending_strict_stars.get(user_id, 0) + amount
+        self._flush_waiters.append(waiter)
+        self._queue_op()
+
+        try:
+            await waiter
+        except Exception:
+            logger.exception("add_spent_stars_failed", extra={"user_id": user_id, "amount": amount})
+            raise
+
+        logger.info("add_spent_stars_succeeded", extra={"user_id": user_id, "amount_added": amount})
+
+    def _queue_op(self) -> None:
+        self._pending_ops += 1
+        if self._pending_ops >= self._flush_max_ops:
+            self._flush_wakeup.set()
+
+    async def _run_flusher(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending_ops:
+            return
+
+        profiles = self._pending_profiles
+        relaxed_stars = self._pending_stars
+        strict_stars = self._pending_strict_stars
+        waiters = self._flush_waiters
+        ops = self._pending_ops
+        self._pending_profiles = {}
+        self._pending_stars = {}
+        self._pending_strict_stars = {}
+        self._flush_waiters = []
+        self._pending_ops = 0
+
+        stars = dict(relaxed_stars)
+        for user_id, amount in strict_stars.items():
+            stars[user_id] = stars.get(user_id, 0) + amount
+
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        try:
+            rows, version, reloaded = await self._write(self._flush_sync, profiles, stars)
+            self._apply_rows(rows, version, reloaded)
+        except Exception as exc:
+            logger.exception(
+                "write_behind_flush_failed",
+                extra={"profiles": len(profiles), "star_users": len(stars), "ops": ops},
+            )
+            # Strict callers are told about the failure and own the retry; everything
+            # else goes back into the queue without overriding newer profile data.
+            for user_id, fingerprint in profiles.items():
+                self._pending_profiles[user_id] = _coalesce_profile(
+                    self._pending_profiles.get(user_id, fingerprint),
+                    fingerprint,
+                )
+            for user_id, amount in relaxed_stars.items():
+                self._pending_stars[user_id] = self._pending_stars.get(user_id, 0) + amount
+            self._pending_ops += len(profiles) + len(relaxed_stars)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(exc)
+            return
+
+        self.flushes += 1
+        self.flushed_ops += ops
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+        logger.info(
+            "write_behind_flushed",
+            extra={
+                "profiles": len(profiles),
+                "star_users": len(stars),
+                "ops": ops,
+                "duration_ms": round((loop.time() - started_at) * 1000, 3),
             },
         )
 
-    async def get_leaderboard(self, limit: int = 100, offset: int = 0) -> list[dict]:
+    def _flush_sync(self, conn: sqlite3.Connection, profiles: dict[int, tuple], stars: dict[int, int]) -> list[tuple]:
+        if profiles:
+            conn.executemany(
+                _UPSERT_USER_SQL,
+                [(user_id, *fingerprint) for user_id, fingerprint in profiles.items()],
+            )
+        if stars:
+            conn.executemany(_ADD_SPENT_STARS_SQL, list(stars.items()))
+            conn.executemany(
+                _ADD_WINDOW_STARS_SQL,
+                [
+                    (current_window, user_id, amount)
+                    for current_window in current_window_ids()
+                    for user_id, amount in stars.items()
+                ],
+            )
+        rows = []
+        if self.top_leaderboard.enabled or self.rank_index.enabled:
+            rows = self._select_users_sync(conn, list(profiles.keys() | stars.keys()))
+        return rows
+
+    def _select_users_sync(self, conn: sqlite3.Connection, user_ids: list[int]) -> list[tuple]:
+        rows = []
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start : start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows.extend(
+                tuple(row)
+                for row in conn.execute(
+                    f"SELECT {_LEADERBOARD_COLUMNS} FROM users WHERE user_id IN ({placeholders})",
+                    chunk,
+                )
+            )
+        return rows
+
+    async def get_leaderboard(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        after: tuple[int, int] | None = None,
+        window: str = ALL_TIME_WINDOW,
+    ) -> list[dict]:
         safe_limit = max(1, min(limit, 100))
         safe_offset = max(0, offset)
 
-        async with self._lock:
-            return await asyncio.to_thread(self._get_leaderboard_sync, safe_limit, safe_offset)
+        if window != ALL_TIME_WINDOW:
+            current_window = window_id(window)
+            return await self.leaderboard_flights.run(
+                (current_window, safe_limit, safe_offset, after),
+                lambda: self._read(self._get_window_leaderboard_sync, current_window, safe_limit, safe_offset, after),
+            )
 
-    def _get_leaderboard_sync(self, limit: int, offset: int) -> list[dict]:
-        conn = self._connect()
+        if after is not None:
+            cached = self.top_leaderboard.page_after(safe_limit, after)
+        else:
+            cached = self.top_leaderboard.page(safe_limit, safe_offset)
+        if cached is not None:
+            return cached
+
+        if after is not None:
+            return await self.leaderboard_flights.run(
+                (ALL_TIME_WINDOW, safe_limit, 0, after),
+                lambda: self._read(self._get_leaderboard_after_sync, safe_limit, after),
+            )
+        return await self.leaderboard_flights.run(
+            (ALL_TIME_WINDOW, safe_limit, safe_offset, None),
+            lambda: self._read(self._get_leaderboard_sync, safe_limit, safe_offset),
+        )
+
+    async def _read(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._read_pool is not None:
+            return await self._read_pool.run(fn, *args)
+
+        return await self._executor.run(fn, *args)
+
+    async def get_user_rank(self, user_id: int, neighbours: int = 1) -> dict | None:
+        neighbours = max(0, min(neighbours, 10))
+        if self.rank_index.ready:
+            rank = self.rank_index.rank(user_id)
+            if rank is None:
+                return None
+            spent_stars = self.rank_index.spent_stars(user_id)
+            total = len(self.rank_index)
+            ranked_ids = {
+                candidate: self.rank_index.select(candidate)
+                for candidate in range(max(1, rank - neighbours), min(total, rank + neighbours) + 1)
+                if candidate != rank
+            }
+            rows = await self._read(self._select_users_sync, list(ranked_ids.values()))
+            rows_by_id = {row[0]: row for row in rows}
+            entries = [
+                {**self._leaderboard_entry(rows_by_id[neighbour_id]), "rank": candidate}
+                for candidate, neighbour_id in ranked_ids.items()
+                if neighbour_id in rows_by_id
+            ]
+        else:
+            result = await self._read(self._get_user_rank_sync, user_id, neighbours)
+            if result is None:
+                return None
+            rank, spent_stars, total, entries = result
+
+        return {
+            "rank": rank,
+            "total": total,
+            "spentStars": spent_stars,
+            "neighbours": entries,
+        }
+
+    def _get_user_rank_sync(
+        self,
+        conn: sqlite3.Connection,
+        user_id: int,
+        neighbours: int,
+    ) -> tuple[int, int, int, list[dict]] | None:
+        row = conn.execute("SELECT spent_stars FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+
+        spent_stars = row["spent_stars"]
+        (above,) = conn.execute(
+            "SELECT COUNT(*) FROM users WHERE spent_stars > ? OR (spent_stars = ? AND user_id < ?)",
+            (spent_stars, spent_stars, user_id),
+        ).fetchone()
+        (total,) = conn.execute("SELECT COUNT(*) FROM users").fetchone()
+        rank = above + 1
+        first_rank = max(1, rank - neighbours)
+        window = self._get_leaderboard_sync(conn, rank + neighbours - first_rank + 1, first_rank - 1)
+        entries = [
+            {**entry, "rank": first_rank + position}
+            for position, entry in enumerate(window)
+            if entry["userId"] != user_id
+        ]
+        return rank, spent_stars, total, entries
+
+    async def count_ranked_before(self, spent_stars: int, user_id: int) -> tuple[int, int]:
+        # (users ranked ahead of (spent_stars, user_id), total users); the key
+        # need not exist here, which is what sharded ranking relies on.
+        if self.rank_index.ready:
+            # position() counts ties up to and including user_id, so stop one short.
+            return self.rank_index.position(spent_stars, user_id - 1), len(self.rank_index)
+        return await self._read(self._count_ranked_before_sync, spent_stars, user_id)
+
+    def _count_ranked_before_sync(self, conn: sqlite3.Connection, spent_stars: int, user_id: int) -> tuple[int, int]:
+        (above,) = conn.execute(
+            "SELECT COUNT(*) FROM users WHERE spent_stars > ? OR (spent_stars = ? AND user_id < ?)",
+            (spent_stars, spent_stars, user_id),
+        ).fetchone()
+        (total,) = conn.execute("SELECT COUNT(*) FROM users").fetchone()
+        return above, total
+
+    async def get_leaderboard_before(self, before: tuple[int, int], limit: int) -> list[dict]:
+        # The `limit` entries ranked just ahead of the key, best first.
+        return await self._read(self._get_leaderboard_before_sync, max(1, min(limit, 100)), before)
+
+    def _get_leaderboard_before_sync(self, conn: sqlite3.Connection, limit: int, before: tuple[int, int]) -> list[dict]:
+        spent_stars, user_id = before
+        rows = conn.execute(
+            f"""
+            SELECT {_LEADERBOARD_COLUMNS}
+            FROM users
+            WHERE spent_stars >= ? AND (spent_stars > ? OR user_id < ?)
+            ORDER BY spent_stars ASC, user_id DESC
+            LIMIT ?
+            """,
+            (spent_stars, spent_stars, user_id, limit),
+        ).fetchall()
+        return self._leaderboard_rows(rows[::-1])
+
+    def read_pool_stats(self) -> dict | None:
+        return self._read_pool.stats() if self._read_pool is not None else None
+
+    def executor_stats(self) -> dict:
+        return self._executor.stats()
+
+    def maintenance_stats(self) -> dict | None:
+        return self._maintenance.stats() if self._maintenance is not None else None
+
+    async def backup(self) -> dict:
+        # Takes a verified snapshot now; writes and reads keep running meanwhile.
+        return await self._backup.snapshot()
+
+    def backup_stats(self) -> dict:
+        return self._backup.stats()
+
+    async def run_maintenance(self) -> None:
+        # Checkpoint, optimize and analyze now, regardless of load or schedule.
+        if self._maintenance is not None:
+            await self._maintenance.run_once(force=True)
+
+    def _get_leaderboard_sync(self, conn: sqlite3.Connection, limit: int, offset: int) -> list[dict]:
         rows = conn.execute(
             """
             SELECT user_id, username, first_name, last_name, photo_url, spent_stars
@@ -159,15 +939,73 @@ class Database:
         ).fetchall()
 
         logger.info("get_leaderboard_result", extra={"records_count": len(rows), "limit": limit, "offset": offset})
+        return self._leaderboard_rows(rows)
 
-        return [
-            {
-                "userId": row["user_id"],
-                "username": row["username"],
-                "firstName": row["first_name"],
-                "lastName": row["last_name"],
-                "photoUrl": row["photo_url"],
-                "spentStars": row["spent_stars"],
-            }
-            for row in rows
-        ]
+    def _get_leaderboard_after_sync(self, conn: sqlite3.Connection, limit: int, after: tuple[int, int]) -> list[dict]:
+        spent_stars, user_id = after
+        # The leading range predicate lets SQLite seek idx_users_leaderboard directly
+        # to the cursor instead of walking and discarding the preceding rows.
+        rows = conn.execute(
+            """
+            SELECT user_id, username, first_name, last_name, photo_url, spent_stars
+            FROM users
+            WHERE spent_stars <= ? AND (spent_stars < ? OR user_id > ?)
+            ORDER BY spent_stars DESC, user_id ASC
+            LIMIT ?
+            """,
+            (spent_stars, spent_stars, user_id, limit),
+        ).fetchall()
+
+        logger.info("get_leaderboard_result", extra={"records_count": len(rows), "limit": limit, "after": after})
+        return self._leaderboard_rows(rows)
+
+    def _get_window_leaderboard_sync(
+        self,
+        conn: sqlite3.Connection,
+        current_window: str,
+        limit: int,
+        offset: int,
+        after: tuple[int, int] | None,
+    ) -> list[dict]:
+        # Same shape and index strategy as the all-time queries, but over the
+        # per-window rollup rows, so a window page costs the same as an all-time one.
+        cursor_filter = ""
+        params: list = [current_window]
+        if after is not None:
+            cursor_filter = "AND w.stars <= ? AND (w.stars < ? OR w.user_id > ?)"
+            params.extend((after[0], after[0], after[1]))
+            offset = 0
+        params.extend((limit, offset))
+
+        rows = conn.execute(
+            f"""
+            SELECT w.user_id, u.username, u.first_name, u.last_name, u.photo_url, w.stars AS spent_stars
+            FROM leaderboard_windows AS w
+            JOIN users AS u ON u.user_id = w.user_id
+            WHERE w.window_id = ? {cursor_filter}
+            ORDER BY w.stars DESC, w.user_id ASC
+            LIMIT ? OFFSET ?
+            """,
+            params,
+        ).fetchall()
+
+        logger.info(
+            "get_leaderboard_result",
+            extra={"records_count": len(rows), "limit": limit, "offset": offset, "window": current_window},
+        )
+        return self._leaderboard_rows(rows)
+
+    @staticmethod
+    def _leaderboard_entry(row: tuple) -> dict:
+        return {
+            "userId": row[0],
+            "username": row[1],
+            "firstName": row[2],
+            "lastName": row[3],
+            "photoUrl": row[4],
+            "spentStars": row[5],
+        }
+
+    @classmethod
+    def _leaderboard_rows(cls, rows: list[sqlite3.Row]) -> list[dict]:
+        return [cls._leaderboard_entry(row) for row in rows]
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from db_maintenance import long_reader
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackupAborted(Exception):
+    pass
+
+
+class DbBackup:
+    # Snapshots the database with the SQLite online backup API on a thread of
+    # its own, `pages_per_step` pages at a time with a pause between steps.
+    # The source connection holds one read transaction for the whole copy, so
+    # in WAL mode writers keep committing and the snapshot stays consistent
+    # instead of restarting whenever another connection writes. Each snapshot
+    # is written to a .partial file, checked with PRAGMA integrity_check and
+    # only then renamed into place; the oldest beyond `retention` are removed.
+    def __init__(
+        self,
+        path: Path,
+        backup_dir: Path,
+        *,
+        latency_totals: Callable[[], tuple[int, float]] | None = None,
+        pragmas: tuple[str, ...] = (),
+        interval: float = 0.0,
+        retention: int = 7,
+        pages_per_step: int = 256,
+        step_pause_ms: int = 5,
+        verify: bool = True,
+    ) -> None:
+        self.path = Path(path)
+        self.backup_dir = Path(backup_dir)
+        self._latency_totals = latency_totals
+        self._pragmas = pragmas
+        self.interval = interval
+        self.retention = max(1, retention)
+        self.pages_per_step = max(1, pages_per_step)
+        self.step_pause = max(0, step_pause_ms) / 1000
+        self.verify = verify
+        self._thread: ThreadPoolExecutor | None = None
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self._aborting = False
+        self.running = False
+        self.remaining_pages = 0
+        self.total_pages = 0
+        self.steps = 0
+        self.snapshots = 0
+        self.failures = 0
+        self.last_path: str | None = None
+        self.last_size_bytes = 0
+        self.last_duration_ms = 0.0
+        self.last_verify_ms = 0.0
+        self.last_live_avg_ms_before = 0.0
+        self.last_live_avg_ms_during = 0.0
+
+    def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._aborting = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # An in-flight copy is aborted at its next step rather than finished.
+        self._aborting = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.shutdown, wait=True)
+            self._thread = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.snapshot()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("db_backup_failed", extra={"path": str(self.path)})
+
+    def _snapshot_name(self) -> str:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        return f"{self.path.stem}-{stamp}{self.path.suffix}"
+
+    def snapshots_on_disk(self) -> list[Path]:
+        if not self.backup_dir.exists():
+            return []
+        pattern = f"{self.path.stem}-*{self.path.suffix}"
+        return sorted(path for path in self.backup_dir.glob(pattern) if path.is_file())
+
+    async def snapshot(self) -> dict:
+        async with self._lock:
+            if self._thread is None:
+                self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-backup")
+            loop = asyncio.get_running_loop()
+            before = self._latency_totals() if self._latency_totals else None
+            self._aborting = False
+            self.running = True
+            try:
+                report = await loop.run_in_executor(self._thread, self._snapshot_sync)
+            except Exception:
+                self.failures += 1
+                raise
+            finally:
+                self.running = False
+
+            if before is not None:
+                report.update(self._live_latency(before, self._latency_totals()))
+            self.snapshots += 1
+            self.last_path = report["path"]
+            self.last_size_bytes = report["size_bytes"]
+            self.last_duration_ms = report["duration_ms"]
+            self.last_verify_ms = report["verify_ms"]
+            report["removed"] = await loop.run_in_executor(self._thread, self._apply_retention_sync)
+            logger.info("db_backup_completed", extra=report)
+            return report
+
+    def _live_latency(self, before: tuple[int, float], after: tuple[int, float]) -> dict:
+        # Average latency of the operations that ran during the copy against
+        # the average up to its start: how much the backup cost live traffic.
+        operations_before, seconds_before = before
+        operations_during = after[0] - operations_before
+        avg_before = seconds_before / operations_before * 1000 if operations_before else 0.0
+        avg_during = (after[1] - seconds_before) / operations_during * 1000 if operations_during else 0.0
+        self.last_live_avg_ms_before = round(avg_before, 3)
+        self.last_live_avg_ms_during = round(avg_during, 3)
+        return {
+            "live_operations": operations_during,
+            "live_avg_ms_before": self.last_live_avg_ms_before,
+            "live_avg_ms_during": self.last_live_avg_ms_during,
+            "live_slowdown": round(avg_during / avg_before, 3) if avg_before and operations_during else None,
+        }
+
+    def _progress(self, status: int, remaining: int, total: int) -> None:
+        self.steps += 1
+        self.remaining_pages = remaining
+        self.total_pages = total
+        if self._aborting:
+            raise BackupAborted()
+
+    def _snapshot_sync(self) -> dict:
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        target = self.backup_dir / self._snapshot_name()
+        partial = target.with_name(target.name + ".partial")
+        started_at = time.perf_counter()
+        self.steps = 0
+
+        source = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        destination = sqlite3.connect(partial, check_same_thread=False)
+        try:
+            for pragma in self._pragmas:
+                source.execute(pragma)
+            # Pin one read snapshot for every step of the copy, registered so
+            # maintenance skips TRUNCATE checkpoints until it is released.
+            with long_reader(self.path):
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                source.backup(destination, pages=self.pages_per_step, progress=self._progress, sleep=self.step_pause)
+                source.execute("COMMIT")
+            # The copy keeps the WAL flag of its source; a standalone file reads better without it.
+            destination.execute("PRAGMA journal_mode=DELETE")
+        except BaseException:
+            destination.close()
+            source.close()
+            partial.unlink(missing_ok=True)
+            raise
+        source.close()
+        copied_at = time.perf_counter()
+
+        try:
+            if self.verify:
+                (result,) = destination.execute("PRAGMA integrity_check").fetchone()
+                if result != "ok":
+                    raise sqlite3.DatabaseError(f"backup integrity check failed: {result}")
+        except BaseException:
+            destination.close()
+            partial.unlink(missing_ok=True)
+            raise
+        destination.close()
+        verified_at = time.perf_counter()
+        os.replace(partial, target)
+
+        return {
+            "path": str(target),
+            "size_bytes": target.stat().st_size,
+            "pages": self.total_pages,
+            "steps": self.steps,
+            "duration_ms": round((copied_at - started_at) * 1000, 3),
+            "verify_ms": round((verified_at - copied_at) * 1000, 3) if self.verify else 0.0,
+        }
+
+    def _apply_retention_sync(self) -> list[str]:
+        removed = []
+        for stale in self.snapshots_on_disk()[: -self.retention]:
+            stale.unlink(missing_ok=True)
+            removed.append(str(stale))
+        return removed
+
+    def stats(self) -> dict:
+        total = self.total_pages
+        return {
+            "running": self.running,
+            "progress": round((total - self.remaining_pages) / total, 3) if total else 0.0,
+            "snapshots": self.snapshots,
+            "failures": self.failures,
+            "last_path": self.last_path,
+            "last_size_bytes": self.last_size_bytes,
+            "last_duration_ms": self.last_duration_ms,
+            "last_verify_ms": self.last_verify_ms,
+            "last_live_avg_ms_before": self.last_live_avg_ms_before,
+            "last_live_avg_ms_during": self.last_live_avg_ms_during,
+        }
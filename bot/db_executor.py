@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from metrics import DB_COMMIT, DB_EXECUTE, DB_QUEUE_WAIT
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Operation:
+    fn: Callable[..., Any]
+    args: tuple
+    write: bool
+    loop: asyncio.AbstractEventLoop
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+def _resolve(future: asyncio.Future, result: Any, error: BaseException | None) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class DbExecutor:
+    # One long-lived thread owns the writer connection and runs every operation
+    # sent to it, so callers skip the asyncio lock and the shared default pool.
+    # Each wakeup drains up to max_batch queued operations; consecutive writes
+    # share one transaction with a savepoint per operation, so a failing write
+    # rolls back alone and the rest commit together. Reads split the batch.
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        *,
+        max_batch: int = 64,
+        on_commit: Callable[[], None] | None = None,
+        on_rollback: Callable[[], None] | None = None,
+    ) -> None:
+        self._connect = connect
+        self.max_batch = max(1, max_batch)
+        # Called on the executor thread after each write transaction commits
+        # or is rolled back.
+        self._on_commit = on_commit
+        self._on_rollback = on_rollback
+        self._queue: queue.SimpleQueue[_Operation | None] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self.operations = 0
+        self.writes = 0
+        self.batches = 0
+        self.transactions = 0
+        self.failures = 0
+        self.max_batch_seen = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_execute_seconds = 0.0
+        self.max_execute_seconds = 0.0
+        self.last_write_at = 0.0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    async def close(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+        logger.info("db_executor_closed", extra=self.stats())
+
+    async def run(self, fn: Callable[..., Any], *args: Any, write: bool = False) -> Any:
+        loop = asyncio.get_running_loop()
+        operation = _Operation(fn=fn, args=args, write=write, loop=loop, future=loop.create_future())
+        self._queue.put(operation)
+        return await operation.future
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def latency_totals(self) -> tuple[int, float]:
+        return self.operations, self.total_wait_seconds + self.total_execute_seconds
+
+    def is_idle(self, seconds: float) -> bool:
+        return self._queue.empty() and time.monotonic() - self.last_write_at >= seconds
+
+    def _run(self) -> None:
+        try:
+            conn = self._connect()
+        except Exception as exc:
+            # Without a connection every operation fails instead of waiting forever.
+            logger.exception("db_executor_connect_failed")
+            while (operation := self._queue.get()) is not None:
+                self._fail([operation], exc)
+            return
+
+        try:
+            stopping = False
+            while not stopping:
+                operation = self._queue.get()
+                if operation is None:
+                    break
+                batch = [operation]
+                while len(batch) < self.max_batch:
+                    try:
+                        operation = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if operation is None:
+                        stopping = True
+                        break
+                    batch.append(operation)
+                try:
+                    self._execute(conn, batch)
+                except Exception as exc:
+                    # The thread must outlive any batch, or every later call hangs.
+                    logger.exception("db_executor_batch_failed", extra={"operations": len(batch)})
+                    self._rollback(conn)
+                    self._fail(batch, exc)
+        finally:
+            conn.close()
+
+    def _fail(self, batch: list[_Operation], error: BaseException) -> None:
+        for operation in batch:
+            self.failures += 1
+            operation.loop.call_soon_threadsafe(_resolve, operation.future, None, error)
+
+    def _rollback(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                logger.exception("db_executor_rollback_failed")
+        if self._on_rollback is not None:
+            self._on_rollback()
+
+    def _start(self, operation: _Operation) -> float:
+        started_at = time.perf_counter()
+        wait = started_at - operation.enqueued_at
+        self.total_wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        DB_QUEUE_WAIT.observe(wait)
+        return started_at
+
+    def _finish(self, started_at: float) -> None:
+        execute = time.perf_counter() - started_at
+        self.total_execute_seconds += execute
+        self.max_execute_seconds = max(self.max_execute_seconds, execute)
+        DB_EXECUTE.observe(execute)
+        self.operations += 1
+
+    def _resolve_all(self, outcomes: list[tuple[_Operation, Any, BaseException | None]]) -> None:
+        for operation, result, error in outcomes:
+            if error is not None:
+                self.failures += 1
+            operation.loop.call_soon_threadsafe(_resolve, operation.future, result, error)
+
+    def _execute(self, conn: sqlite3.Connection, batch: list[_Operation]) -> None:
+        self.batches += 1
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        # A read never runs inside the open write transaction: it would see
+        # uncommitted rows and keep its result even if the COMMIT failed. The
+        # writes queued ahead of a read are committed first.
+        writes: list[_Operation] = []
+        for operation in batch:
+            if operation.write:
+                writes.append(operation)
+                continue
+            if writes:
+                self._execute_writes(conn, writes)
+                writes = []
+            self._execute_read(conn, operation)
+        if writes:
+            self._execute_writes(conn, writes)
+
+    def _execute_read(self, conn: sqlite3.Connection, operation: _Operation) -> None:
+        started_at = self._start(operation)
+        result = None
+        error = None
+        try:
+            result = operation.fn(conn, *operation.args)
+        except Exception as exc:
+            error = exc
+        self._finish(started_at)
+        self._resolve_all([(operation, result, error)])
+
+    def _execute_writes(self, conn: sqlite3.Connection, writes: list[_Operation]) -> None:
+        outcomes: list[tuple[_Operation, Any, BaseException | None]] = []
+        in_transaction = False
+        # Set when SQLite dropped the whole transaction (IOERR, FULL, NOMEM):
+        # the writes already in it are gone and the rest of the batch fails.
+        aborted: BaseException | None = None
+
+        for operation in writes:
+            if aborted is not None:
+                outcomes.append((operation, None, aborted))
+                continue
+
+            started_at = self._start(operation)
+            result = None
+            error = None
+            try:
+                if not in_transaction:
+                    conn.execute("BEGIN IMMEDIATE")
+                    in_transaction = True
+                conn.execute("SAVEPOINT operation")
+            except Exception as exc:
+                error = exc
+            else:
+                try:
+                    result = operation.fn(conn, *operation.args)
+                except Exception as exc:
+                    error = exc
+                aborted = self._end_savepoint(conn, error)
+                if aborted is not None:
+                    in_transaction = False
+                    error = error or aborted
+            self.writes += 1
+            self._finish(started_at)
+            outcomes.append((operation, result, error))
+
+        if aborted is not None:
+            logger.error("db_executor_transaction_aborted", extra={"operations": len(writes), "error": str(aborted)})
+            self._rollback(conn)
+            outcomes = [(operation, None, error or aborted) for operation, _, error in outcomes]
+        elif in_transaction:
+            self.last_write_at = time.monotonic()
+            try:
+                commit_started_at = time.perf_counter()
+                conn.execute("COMMIT")
+                DB_COMMIT.observe(time.perf_counter() - commit_started_at)
+                self.transactions += 1
+            except Exception as exc:
+                logger.exception("db_executor_commit_failed", extra={"operations": len(writes)})
+                self._rollback(conn)
+                outcomes = [(operation, None, exc) for operation, _, _ in outcomes]
+            else:
+                if self._on_commit is not None:
+                    self._on_commit()
+
+        self._resolve_all(outcomes)
+
+    @staticmethod
+    def _end_savepoint(conn: sqlite3.Connection, error: BaseException | None) -> BaseException | None:
+        # Returns an error when the outer transaction is no longer there.
+        if not conn.in_transaction:
+            return error or sqlite3.OperationalError("transaction was rolled back")
+        try:
+            if error is not None:
+                conn.execute("ROLLBACK TO operation")
+            conn.execute("RELEASE operation")
+        except sqlite3.Error as exc:
+            return exc
+        return None
+
+    def stats(self) -> dict:
+        operations = self.operations
+        return {
+            "queue_depth": self._queue.qsize(),
+            "operations": operations,
+            "writes": self.writes,
+            "batches": self.batches,
+            "transactions": self.transactions,
+            "failures": self.failures,
+            "max_batch": self.max_batch_seen,
+            "avg_queue_wait_ms": round(self.total_wait_seconds / operations * 1000, 3) if operations else 0.0,
+            "max_queue_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            "avg_execute_ms": round(self.total_execute_seconds / operations * 1000, 3) if operations else 0.0,
+            "max_execute_ms": round(self.max_execute_seconds * 1000, 3),
+        }
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+
+logger = logging.getLogger(__name__)
+
+# Long-lived readers (exports, backups) per database file in this process.
+# They pin a snapshot, so a TRUNCATE checkpoint could only wait for them.
+_long_readers: dict[str, int] = {}
+_long_readers_lock = threading.Lock()
+
+
+def _reader_key(path: Path) -> str:
+    return str(Path(path).resolve())
+
+
+@contextmanager
+def long_reader(path: Path) -> Iterator[None]:
+    key = _reader_key(path)
+    with _long_readers_lock:
+        _long_readers[key] = _long_readers.get(key, 0) + 1
+    try:
+        yield
+    finally:
+        with _long_readers_lock:
+            _long_readers[key] -= 1
+            if not _long_readers[key]:
+                del _long_readers[key]
+
+
+def has_long_readers(path: Path) -> bool:
+    return _reader_key(path) in _long_readers
+
+
+class DbMaintenance:
+    # Checkpoints the WAL, runs PRAGMA optimize and ANALYZE on its own
+    # connection and thread, so no user request commits at the moment an
+    # automatic checkpoint kicks in. PASSIVE checkpoints never wait on other
+    # connections and run every interval; TRUNCATE, optimize and ANALYZE take
+    # locks, so they only run once `is_idle` reports no recent writes.
+    # TRUNCATE also needs the last PASSIVE pass to have copied every frame
+    # and no export or backup in progress, and runs with busy_timeout=0: it
+    # holds the write lock while it waits, so it gives up instead of waiting.
+    # `prune`, when given, deletes rows nothing reads any more and returns how
+    # many; it also waits for an idle moment and runs every prune_interval.
+    def __init__(
+        self,
+        path: Path,
+        is_idle: Callable[[], bool],
+        *,
+        pragmas: tuple[str, ...] = (),
+        checkpoint_interval: float = 10.0,
+        truncate_pages: int = 4000,
+        optimize_interval: float = 3600.0,
+        analyze_interval: float = 86400.0,
+        prune: Callable[[sqlite3.Connection], int] | None = None,
+        prune_interval: float = 3600.0,
+    ) -> None:
+        self.path = path
+        self._is_idle = is_idle
+        self._pragmas = pragmas
+        self.checkpoint_interval = max(0.01, checkpoint_interval)
+        self.truncate_pages = max(0, truncate_pages)
+        self.optimize_interval = optimize_interval
+        self.analyze_interval = analyze_interval
+        self._prune = prune
+        self.prune_interval = prune_interval
+        self._conn: sqlite3.Connection | None = None
+        self._thread: ThreadPoolExecutor | None = None
+        self._task: asyncio.Task | None = None
+        self._next_optimize = 0.0
+        self._next_analyze = 0.0
+        self._next_prune = 0.0
+        self.checkpoints = 0
+        self.truncates = 0
+        self.busy_checkpoints = 0
+        self.optimizes = 0
+        self.analyzes = 0
+        self.prunes = 0
+        self.pruned_rows = 0
+        self.failures = 0
+        self.last_checkpoint_ms = 0.0
+        self.max_checkpoint_ms = 0.0
+        self.wal_pages = 0
+        self.skipped_truncates = 0
+        self._last_frames: tuple[int, int] = (0, 0)
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        now = time.monotonic()
+        self._next_optimize = now + self.optimize_interval
+        self._next_analyze = now + self.analyze_interval
+        self._next_prune = now + self.prune_interval
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            await self._call(self._close_sync)
+            self._thread.shutdown(wait=True)
+            self._thread = None
+
+    async def _call(self, fn: Callable, *args) -> Any:
+        if self._thread is None:
+            self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-maintenance")
+        return await asyncio.get_running_loop().run_in_executor(self._thread, fn, *args)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            for pragma in self._pragmas:
+                self._conn.execute(pragma)
+        return self._conn
+
+    def _close_sync(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.run_once()
+            except Exception:
+                self.failures += 1
+                logger.exception("db_maintenance_failed", extra={"path": str(self.path)})
+
+    async def run_once(self, force: bool = False) -> None:
+        idle = force or self._is_idle()
+        now = time.monotonic()
+        # Pruning, optimize and ANALYZE all write, so they go before the
+        # checkpoint that would otherwise leave their frames in the WAL.
+        if self._prune is not None and idle and (force or now >= self._next_prune):
+            await self._call(self._prune_sync)
+            self._next_prune = now + self.prune_interval
+        if idle and (force or now >= self._next_optimize):
+            await self._call(self._timed_sync, "optimize", "PRAGMA optimize")
+            self.optimizes += 1
+            self._next_optimize = now + self.optimize_interval
+        if idle and (force or now >= self._next_analyze):
+            await self._call(self._timed_sync, "analyze", "ANALYZE")
+            self.analyzes += 1
+            self._next_analyze = now + self.analyze_interval
+
+        wal_pages, complete = await self._call(self._checkpoint_sync, "PASSIVE")
+        if idle and (force or wal_pages >= self.truncate_pages):
+            if complete and not has_long_readers(self.path):
+                await self._call(self._checkpoint_sync, "TRUNCATE")
+            else:
+                self.skipped_truncates += 1
+
+    def _checkpoint_sync(self, mode: str) -> tuple[int, bool]:
+        conn = self._connection()
+        started_at = time.perf_counter()
+        if mode == "TRUNCATE":
+            busy_timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+            conn.execute("PRAGMA busy_timeout=0")
+            try:
+                busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            finally:
+                conn.execute(f"PRAGMA busy_timeout={busy_timeout}")
+        else:
+            busy, log_pages, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        duration_ms = round((time.perf_counter() - started_at) * 1000, 3)
+
+        self.checkpoints += 1
+        self.last_checkpoint_ms = duration_ms
+        self.max_checkpoint_ms = max(self.max_checkpoint_ms, duration_ms)
+        self.wal_pages = max(0, log_pages)
+        if busy:
+            self.busy_checkpoints += 1
+        if mode == "TRUNCATE" and not busy:
+            self.truncates += 1
+        # An idle WAL reports the same frames on every pass; log only progress.
+        if busy or (log_pages, checkpointed) != self._last_frames:
+            self._last_frames = (log_pages, checkpointed)
+            logger.info(
+                "db_checkpoint",
+                extra={
+                    "mode": mode,
+                    "busy": bool(busy),
+                    "wal_pages": log_pages,
+                    "checkpointed_pages": checkpointed,
+                    "duration_ms": duration_ms,
+                },
+            )
+        return self.wal_pages, not busy and checkpointed == log_pages
+
+    def _prune_sync(self) -> None:
+        started_at = time.perf_counter()
+        removed = self._prune(self._connection())
+        self.prunes += 1
+        self.pruned_rows += removed
+        if removed:
+            logger.info(
+                "db_prune",
+                extra={"rows": removed, "duration_ms": round((time.perf_counter() - started_at) * 1000, 3)},
+            )
+
+    def _timed_sync(self, name: str, statement: str) -> None:
+        started_at = time.perf_counter()
+        self._connection().execute(statement)
+        logger.info(f"db_{name}", extra={"duration_ms": round((time.perf_counter() - started_at) * 1000, 3)})
+
+    def stats(self) -> dict:
+        return {
+            "checkpoints": self.checkpoints,
+            "truncates": self.truncates,
+            "busy_checkpoints": self.busy_checkpoints,
+            "skipped_truncates": self.skipped_truncates,
+            "optimizes": self.optimizes,
+            "analyzes": self.analyzes,
+            "prunes": self.prunes,
+            "pruned_rows": self.pruned_rows,
+            "failures": self.failures,
+            "wal_pages": self.wal_pages,
+            "last_checkpoint_ms": self.last_checkpoint_ms,
+            "max_checkpoint_ms": self.max_checkpoint_ms,
+        }
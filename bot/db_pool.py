@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+from metrics import DB_READ_POOL_WAIT
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReadConnectionPool:
+    # Each worker thread owns exactly one query_only connection, so reads never
+    # share a connection and never wait on the writer's lock.
+    def __init__(self, path: Path, size: int, pragmas: tuple[str, ...] = ()) -> None:
+        self.path = path
+        self.size = max(1, size)
+        self._pragmas = pragmas
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="db-read")
+        self.reads = 0
+        self.in_flight = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        for pragma in self._pragmas:
+            conn.execute(pragma)
+        self._local.conn = conn
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def _run_sync(self, submitted_at: float, fn: Callable[..., Any], args: tuple) -> Any:
+        wait = time.perf_counter() - submitted_at
+        self.total_wait_seconds += wait
+        if wait > self.max_wait_seconds:
+            self.max_wait_seconds = wait
+        DB_READ_POOL_WAIT.observe(wait)
+        return fn(self._connection(), *args)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        self.reads += 1
+        self.in_flight += 1
+        try:
+            return await loop.run_in_executor(self._executor, self._run_sync, time.perf_counter(), fn, args)
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "reads": self.reads,
+            "in_flight": self.in_flight,
+            "avg_wait_ms": round(self.total_wait_seconds / self.reads * 1000, 3) if self.reads else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+        }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        logger.info("read_pool_closed", extra=self.stats())
@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import csv
+import heapq
+import io
+import json
+import sqlite3
+import sys
+from itertools import count, islice
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Iterator
+
+from config import DB_PATH, DB_SHARDS, EXPORT_CHUNK_ROWS
+from db_maintenance import long_reader
+from sharded_storage import shard_paths
+
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_KINDS = ("leaderboard", "users")
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+_LEADERBOARD_FIELDS = ("rank", "userId", "username", "firstName", "lastName", "photoUrl", "spentStars")
+_USER_FIELDS = ("user_id", "username", "first_name", "last_name", "photo_url", "spent_stars", "updated_at")
+
+# Each query is read through one cursor per file in index order, so SQLite
+# hands rows over as the index is walked and nothing is sorted in memory.
+_QUERIES = {
+    "leaderboard": """
+        SELECT user_id, username, first_name, last_name, photo_url, spent_stars
+        FROM users INDEXED BY idx_users_leaderboard
+        ORDER BY spent_stars DESC, user_id ASC
+    """,
+    "users": f"SELECT {', '.join(_USER_FIELDS)} FROM users ORDER BY user_id ASC",
+}
+_MERGE_KEYS = {
+    "leaderboard": lambda row: (-row[5], row[0]),
+    "users": lambda row: row[0],
+}
+
+
+def storage_paths(storage) -> list[Path] | None:
+    # SQLite files behind a Database or ShardedStorage; None for in-memory storage.
+    shards = getattr(storage, "shards", None)
+    if shards is not None:
+        return [shard.path for shard in shards]
+    path = getattr(storage, "path", None)
+    return [path] if path is not None else None
+
+
+def _file_rows(path: Path, query: str, chunk_rows: int) -> Iterator[tuple]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    try:
+        with long_reader(path):
+            cursor = conn.execute(query)
+            while rows := cursor.fetchmany(chunk_rows):
+                yield from rows
+    finally:
+        conn.close()
+
+
+def _records(kind: str, rows: Iterable[tuple]) -> Iterator[tuple]:
+    if kind == "users":
+        yield from rows
+        return
+    for rank, row in zip(count(1), rows):
+        yield (rank, *row)
+
+
+def _encode(fmt: str, fields: tuple[str, ...], records: list[tuple], header: bool) -> bytes:
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps(dict(zip(fields, record)), ensure_ascii=False, separators=(",", ":")) + "\n"
+            for record in records
+        ).encode()
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(fields)
+    writer.writerows(records)
+    return buffer.getvalue().encode()
+
+
+def iter_export_chunks(
+    paths: list[Path],
+    kind: str = "leaderboard",
+    fmt: str = "ndjson",
+    chunk_rows: int = EXPORT_CHUNK_ROWS,
+) -> Iterator[bytes]:
+    # Yields encoded chunks of at most chunk_rows records. Several files
+    # (shards) are k-way merged on the fly, so memory stays at a chunk per
+    # file whatever the table size.
+    if kind not in EXPORT_KINDS or fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unsupported export: {kind}/{fmt}")
+
+    chunk_rows = max(1, chunk_rows)
+    fields = _USER_FIELDS if kind == "users" else _LEADERBOARD_FIELDS
+    sources = [_file_rows(path, _QUERIES[kind], chunk_rows) for path in paths]
+    rows = sources[0] if len(sources) == 1 else heapq.merge(*sources, key=_MERGE_KEYS[kind])
+    records = _records(kind, rows)
+
+    header = fmt == "csv"
+    try:
+        while batch := list(islice(records, chunk_rows)):
+            yield _encode(fmt, fields, batch, header)
+            header = False
+        if header:
+            yield _encode(fmt, fields, [], header)
+    finally:
+        for source in sources:
+            source.close()
+
+
+async def aiter_export_chunks(
+    paths: list[Path],
+    kind: str = "leaderboard",
+    fmt: str = "ndjson",
+    chunk_rows: int = EXPORT_CHUNK_ROWS,
+) -> AsyncIterator[bytes]:
+    # Every chunk is read and encoded on a worker thread; the generator is
+    # closed there as well when the client goes away mid-stream.
+    chunks = iter_export_chunks(paths, kind, fmt, chunk_rows)
+    try:
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+    finally:
+        await asyncio.to_thread(chunks.close)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stream the leaderboard or the users table as NDJSON or CSV")
+    parser.add_argument("--kind", choices=EXPORT_KINDS, default="leaderboard")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--shards", type=int, default=DB_SHARDS)
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS)
+    parser.add_argument("--output", default="-", help="file path, or - for stdout")
+    args = parser.parse_args()
+
+    paths = shard_paths(args.db, args.shards) if args.shards > 1 else [args.db]
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in iter_export_chunks(paths, args.kind, args.format, args.chunk_rows):
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
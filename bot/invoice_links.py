@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable
+
+from singleflight import SingleFlight
+
+
+logger = logging.getLogger(__name__)
+
+
+class InvoiceLinkCache:
+    # build_invoice_payload(amount, user_id) is deterministic, so a link created
+    # once can be handed out again until it ages out. Misses for the same key are
+    # coalesced so a double tap still produces a single Bot API call.
+    def __init__(self, ttl_seconds: int = 3600, max_size: int = 10000) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max(0, max_size)
+        self.flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.prewarmed = 0
+        self._entries: OrderedDict[tuple[int, int], tuple[str, float]] = OrderedDict()
+        self._prewarm_tasks: set[asyncio.Task] = set()
+
+    def get(self, amount: int, user_id: int) -> str | None:
+        key = (amount, user_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        link, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return link
+
+    def put(self, amount: int, user_id: int, link: str) -> None:
+        if self.max_size == 0 or self.ttl_seconds <= 0:
+            return
+
+        key = (amount, user_id)
+        self._entries[key] = (link, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, amount: int, user_id: int) -> None:
+        self._entries.pop((amount, user_id), None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_or_create(self, amount: int, user_id: int, create: Callable[[], Awaitable[str]]) -> str:
+        link = self.get(amount, user_id)
+        if link is not None:
+            self.hits += 1
+            return link
+
+        self.misses += 1
+        return await self.flights.run((amount, user_id), lambda: self._create(amount, user_id, create))
+
+    async def _create(self, amount: int, user_id: int, create: Callable[[], Awaitable[str]]) -> str:
+        link = await create()
+        self.put(amount, user_id, link)
+        return link
+
+    def prewarm(
+        self,
+        user_id: int,
+        amounts: Iterable[int],
+        create_for_amount: Callable[[int], Awaitable[str]],
+    ) -> None:
+        for amount in amounts:
+            if self.get(amount, user_id) is not None or (amount, user_id) in self.flights:
+                continue
+
+            task = asyncio.create_task(self._prewarm_one(amount, user_id, create_for_amount))
+            self._prewarm_tasks.add(task)
+            task.add_done_callback(self._prewarm_tasks.discard)
+
+    async def _prewarm_one(
+        self,
+        amount: int,
+        user_id: int,
+        create_for_amount: Callable[[int], Awaitable[str]],
+    ) -> None:
+        try:
+            await self.flights.run((amount, user_id), lambda: self._create(amount, user_id, lambda: create_for_amount(amount)))
+        except Exception:
+            logger.warning("invoice_link_prewarm_failed", extra={"user_id": user_id, "amount": amount}, exc_info=True)
+            return
+        self.prewarmed += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "prewarmed": self.prewarmed,
+            "coalesced": self.flights.coalesced,
+        }
@@ -0,0 +1,118 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Iterable, Sequence
+
+
+# Rows are (user_id, username, first_name, last_name, photo_url, spent_stars),
+# the same column order the leaderboard queries select.
+LeaderboardRow = Sequence
+
+
+class TopLeaderboard:
+    # Holds the exact top `capacity` users in leaderboard order. Stars only ever
+    # grow, so a user outside the cache can only enter it by overtaking the tail,
+    # which keeps the cached prefix exact under incremental updates.
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(0, capacity)
+        self.version = 0
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+        self._keys: list[tuple[int, int]] = []
+        self._entries: dict[int, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def load(self, rows: Iterable[LeaderboardRow]) -> None:
+        keys = []
+        entries = {}
+        for row in rows:
+            entry = tuple(row)
+            keys.append((-entry[5], entry[0]))
+            entries[entry[0]] = entry
+
+        keys.sort()
+        self._keys = keys[: self.capacity]
+        self._entries = {user_id: entries[user_id] for _, user_id in self._keys}
+        self.complete = len(keys) < self.capacity
+        self.version += 1
+
+    def apply(self, row: LeaderboardRow) -> None:
+        if not self.enabled:
+            return
+
+        entry = tuple(row)
+        user_id = entry[0]
+        key = (-entry[5], user_id)
+        current = self._entries.get(user_id)
+        if current is not None:
+            if current == entry:
+                return
+            old_key = (-current[5], user_id)
+            if old_key != key:
+                del self._keys[bisect_left(self._keys, old_key)]
+                insort(self._keys, key)
+            self._entries[user_id] = entry
+            self.version += 1
+            return
+
+        if len(self._keys) >= self.capacity:
+            # Whether the row is dropped or evicts the tail, some user now
+            # ranks past the cached prefix, so deeper pages must go to SQL.
+            self.complete = False
+            if key >= self._keys[-1]:
+                return
+            _, evicted_user_id = self._keys.pop()
+            del self._entries[evicted_user_id]
+
+        insort(self._keys, key)
+        self._entries[user_id] = entry
+        self.version += 1
+
+    def page(self, limit: int, offset: int) -> list[dict] | None:
+        if not self.enabled or (offset + limit > len(self._keys) and not self.complete):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self._render(self._keys[offset : offset + limit])
+
+    def page_after(self, limit: int, after: tuple[int, int]) -> list[dict] | None:
+        spent_stars, user_id = after
+        start = bisect_right(self._keys, (-spent_stars, user_id))
+        if not self.enabled or (start + limit > len(self._keys) and not self.complete):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self._render(self._keys[start : start + limit])
+
+    def _render(self, keys: list[tuple[int, int]]) -> list[dict]:
+        result = []
+        for _, user_id in keys:
+            entry = self._entries[user_id]
+            result.append(
+                {
+                    "userId": entry[0],
+                    "username": entry[1],
+                    "firstName": entry[2],
+                    "lastName": entry[3],
+                    "photoUrl": entry[4],
+                    "spentStars": entry[5],
+                }
+            )
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._keys),
+            "capacity": self.capacity,
+            "complete": self.complete,
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
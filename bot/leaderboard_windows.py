@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+from config import LEADERBOARD_SEASON_ID
+
+
+ALL_TIME_WINDOW = "all"
+LEADERBOARD_WINDOWS = ("day", "week", "season")
+
+
+def window_id(window: str, moment: datetime | None = None) -> str:
+    moment = (moment or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    if window == "day":
+        return f"day:{moment:%Y-%m-%d}"
+    if window == "week":
+        year, week, _ = moment.isocalendar()
+        return f"week:{year}-W{week:02d}"
+    if window == "season":
+        if LEADERBOARD_SEASON_ID:
+            return f"season:{LEADERBOARD_SEASON_ID}"
+        return f"season:{moment.year}-Q{(moment.month - 1) // 3 + 1}"
+    raise ValueError(f"unknown leaderboard window: {window}")
+
+
+def current_window_ids(moment: datetime | None = None) -> list[str]:
+    moment = moment or datetime.now(timezone.utc)
+    return [window_id(window, moment) for window in LEADERBOARD_WINDOWS]
+
+
+def payment_window_ids(payment: dict) -> list[str]:
+    # The windows current when the payment was made, so a credit replayed from
+    # the outbox after midnight still counts for the day it was paid.
+    paid_at = payment.get("paid_at")
+    if paid_at is None:
+        return current_window_ids()
+    return current_window_ids(datetime.fromtimestamp(paid_at, timezone.utc))
+
+
+def is_valid_window(window: str) -> bool:
+    return window == ALL_TIME_WINDOW or window in LEADERBOARD_WINDOWS
@@ -0,0 +1,128 @@
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_ALWAYS_KEEP, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_RATE_LIMITS, LOG_SAMPLE_RATES
+from outbound import TokenBucket
+
+
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class EventSampler(logging.Filter):
+    # Thins out chatty per-request events by name (the message passed to
+    # logger.info). Warnings and above, and events matching one of the
+    # always-keep prefixes, pass untouched; the rest are first sampled and
+    # then capped at a per-second rate. Filters run on whichever thread logs,
+    # so the buckets and drop counts are only touched under a lock.
+    def __init__(
+        self,
+        sample_rates: dict[str, float],
+        rate_limits: dict[str, float],
+        always_keep: tuple[str, ...] = (),
+    ) -> None:
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.always_keep = always_keep
+        self._buckets = {event: TokenBucket(rate, rate) for event, rate in rate_limits.items() if rate > 0}
+        self.dropped: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        event = record.msg if isinstance(record.msg, str) else str(record.msg)
+        if event.startswith(self.always_keep):
+            return True
+
+        rate = self.sample_rates.get(event)
+        keep = rate is None or random.random() < rate
+        bucket = self._buckets.get(event)
+        if keep and bucket is None:
+            return True
+        with self._lock:
+            if keep:
+                now = time.monotonic()
+                keep = bucket.delay(now) == 0
+                if keep:
+                    bucket.consume(now)
+            if not keep:
+                self.dropped[event] = self.dropped.get(event, 0) + 1
+        return keep
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    # Hands records to the listener thread and returns. Formatting happens
+    # there too; when the queue is full the record is counted and dropped
+    # instead of making the caller wait.
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.overflowed = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.overflowed += 1
+
+
+def setup_logging(
+    level: str = LOG_LEVEL,
+    *,
+    stream=None,
+    queue_size: int = LOG_QUEUE_SIZE,
+    sample_rates: dict[str, float] = LOG_SAMPLE_RATES,
+    rate_limits: dict[str, float] = LOG_RATE_LIMITS,
+    always_keep: tuple[str, ...] = LOG_ALWAYS_KEEP,
+) -> QueueListener:
+    # Replaces the root handlers with a queue feeding a single listener
+    # thread that formats JSON lines and writes them. Call listener.stop()
+    # on shutdown to flush what is still queued.
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(EventSampler(sample_rates, rate_limits, always_keep))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,88 +1,307 @@
 import asyncio
+import hmac
 import logging
+import os
+import time
 
 from aiohttp import web
-from aiogram import Bot, Dispatcher, F, types
-from aiogram.filters import CommandStart
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import LabeledPrice
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from bot_handlers import register_bot_handlers
 from config import (
+    ADMIN_TOKEN,
     ALLOWED_PRICES,
     API_HOST,
     API_PORT,
     BOT_TOKEN,
-    DB_PATH,
+    INIT_DATA_CACHE_SIZE,
+    INIT_DATA_CACHE_TTL_SECONDS,
     INIT_DATA_MAX_AGE_SECONDS,
-    MINI_APP_BUTTON,
-    MINI_APP_URL,
+    INVOICE_LINK_CACHE_SIZE,
+    INVOICE_LINK_CACHE_TTL_SECONDS,
+    INVOICE_PREWARM_AMOUNTS,
+    LEADERBOARD_RESPONSE_CACHE_SIZE,
+    METRICS_ENABLED,
+    METRICS_PORT,
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_MAX_ATTEMPTS,
+    OUTBOUND_PER_CHAT_RATE,
+    OUTBOUND_WORKERS,
+    PAYMENT_OUTBOX_BATCH_SIZE,
+    PAYMENT_OUTBOX_FLUSH_MS,
+    PAYMENT_OUTBOX_FSYNC,
+    PAYMENT_OUTBOX_PATH,
+    TELEGRAM_API_BASE_URL,
+    UPDATE_OTHER_WORKERS,
+    UPDATE_PAYMENT_WORKERS,
+    UPDATE_PRE_CHECKOUT_WORKERS,
+    UPDATE_QUEUE_SIZE,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
     validate_config,
 )
-from database import Database
-from payments import build_invoice_payload, parse_invoice_payload
-from security import extract_user_from_init_data, verify_telegram_init_data
+from database import decode_leaderboard_cursor, next_leaderboard_cursor
+from export import CONTENT_TYPES, EXPORT_FORMATS, EXPORT_KINDS, aiter_export_chunks, storage_paths
+from invoice_links import InvoiceLinkCache
+from leaderboard_windows import ALL_TIME_WINDOW, is_valid_window, window_id
+from log_setup import setup_logging
+from metrics import (
+    INIT_DATA_VERIFY,
+    REGISTRY,
+    REQUEST_SECONDS,
+    TELEGRAM_CREATE_INVOICE_LINK,
+    register_component_metrics,
+    reject,
+)
+from outbound import Lane, OutboundRateLimited, OutboundScheduler, send_outbound
+from payment_outbox import PaymentOutbox
+from payments import build_invoice_payload
+from response_cache import ResponseCache, etag_matches, leaderboard_cache_key
+from security import InitDataCache, verify_init_data_user
+from sharded_storage import LeaderboardOffsetTooDeep
+from storage import Storage, create_storage
+from update_scheduler import OTHER, PRE_CHECKOUT, SUCCESSFUL_PAYMENT, UpdateScheduler, poll_updates
+from webhook import WebhookIngress
 
 validate_config()
 
 logger = logging.getLogger(__name__)
 
+init_data_cache = InitDataCache(max_size=INIT_DATA_CACHE_SIZE, ttl_seconds=INIT_DATA_CACHE_TTL_SECONDS)
+leaderboard_responses = ResponseCache(max_entries=LEADERBOARD_RESPONSE_CACHE_SIZE)
+invoice_links = InvoiceLinkCache(ttl_seconds=INVOICE_LINK_CACHE_TTL_SECONDS, max_size=INVOICE_LINK_CACHE_SIZE)
+
+
+async def create_stars_invoice(bot: Bot, amount: int, user_id: int) -> str:
+    started_at = time.perf_counter()
+    try:
+        return await bot.create_invoice_link(
+            title="Random Gift",
+            description=f"Покупка подарка за {amount} звезд.",
+            payload=build_invoice_payload(amount, user_id),
+            provider_token="",
+            currency="XTR",
+            prices=[LabeledPrice(label=f"{amount} Stars", amount=amount)],
+        )
+    finally:
+        TELEGRAM_CREATE_INVOICE_LINK.observe(time.perf_counter() - started_at)
+
+
+def _reject(reason: str, status: int, headers: dict | None = None) -> web.Response:
+    # The error key doubles as the rejection reason in metrics.
+    reject(reason)
+    return web.json_response({"error": reason}, status=status, headers=headers)
+
 
 def _parse_user_from_init_data(init_data: str) -> dict | None:
-    parsed = verify_telegram_init_data(init_data, BOT_TOKEN, INIT_DATA_MAX_AGE_SECONDS)
-    if not parsed:
+    started_at = time.perf_counter()
+    verified = verify_init_data_user(init_data, BOT_TOKEN, INIT_DATA_MAX_AGE_SECONDS, init_data_cache)
+    INIT_DATA_VERIFY.observe(time.perf_counter() - started_at)
+    if not verified:
         return None
 
-    return extract_user_from_init_data(parsed)
+    _, user = verified
+    return user
 
 
 async def handle_invoice(request: web.Request) -> web.Response:
     bot: Bot = request.app["bot"]
-    db: Database = request.app["db"]
+    db: Storage = request.app["db"]
+    outbound: OutboundScheduler | None = request.app.get("outbound")
 
     init_data = request.headers.get("X-Telegram-Init-Data", "")
     user = _parse_user_from_init_data(init_data)
     if not user:
-        return web.json_response({"error": "invalid_init_data"}, status=401)
+        return _reject("invalid_init_data", 401)
 
     amount_raw = request.query.get("amount", "0")
     try:
         amount = int(amount_raw)
     except ValueError:
-        return web.json_response({"error": "invalid_amount"}, status=400)
+        return _reject("invalid_amount", 400)
 
     if amount not in ALLOWED_PRICES:
-        return web.json_response({"error": "unsupported_amount"}, status=400)
+        return _reject("unsupported_amount", 400)
 
     await db.upsert_user(user)
 
-    payload = build_invoice_payload(amount, int(user["id"]))
-    invoice_link = await bot.create_invoice_link(
-        title="Random Gift",
-        description=f"Покупка подарка за {amount} звезд.",
-        payload=payload,
-        provider_token="",
-        currency="XTR",
-        prices=[LabeledPrice(label=f"{amount} Stars", amount=amount)],
-    )
+    user_id = int(user["id"])
+    try:
+        invoice_link = await invoice_links.get_or_create(
+            amount,
+            user_id,
+            lambda: send_outbound(outbound, lambda: create_stars_invoice(bot, amount, user_id), lane=Lane.INVOICE),
+        )
+    except OutboundRateLimited as exc:
+        logger.warning("invoice_creation_rate_limited", extra={"user_id": user_id, "amount": amount})
+        return _reject("rate_limited", 503, {"Retry-After": str(int(exc.retry_after) or 1)})
+    except Exception:
+        logger.exception("invoice_creation_failed", extra={"user_id": user_id, "amount": amount})
+        return _reject("invoice_creation_failed", 500)
 
     return web.json_response({"invoice_link": invoice_link})
 
 
 async def handle_leaderboard(request: web.Request) -> web.Response:
-    db: Database = request.app["db"]
+    db: Storage = request.app["db"]
+
+    init_data = request.headers.get("X-Telegram-Init-Data", "")
+    user = _parse_user_from_init_data(init_data)
+    if not user:
+        return _reject("invalid_init_data", 401)
+
+    try:
+        limit = max(1, min(int(request.query.get("limit", "100")), 100))
+        offset = max(0, int(request.query.get("offset", "0")))
+    except ValueError:
+        return _reject("invalid_pagination", 400)
+
+    window = request.query.get("window", ALL_TIME_WINDOW)
+    if not is_valid_window(window):
+        return _reject("invalid_window", 400)
+
+    after = None
+    next_cursor = request.query.get("next")
+    if next_cursor:
+        after = decode_leaderboard_cursor(next_cursor)
+        if after is None:
+            return _reject("invalid_cursor", 400)
+
+    await db.upsert_user(user)
+    if INVOICE_PREWARM_AMOUNTS and offset == 0 and not next_cursor:
+        bot: Bot = request.app["bot"]
+        outbound: OutboundScheduler | None = request.app.get("outbound")
+        user_id = int(user["id"])
+        invoice_links.prewarm(
+            user_id,
+            INVOICE_PREWARM_AMOUNTS,
+            lambda amount: send_outbound(outbound, lambda: create_stars_invoice(bot, amount, user_id), lane=Lane.CHAT),
+        )
+
+    window_key = window if window == ALL_TIME_WINDOW else window_id(window)
+    cache_key = leaderboard_cache_key(window_key, limit, offset, next_cursor)
+    version = db.data_version
+    etag = leaderboard_responses.etag(cache_key, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        leaderboard_responses.not_modified += 1
+        return web.Response(status=304, headers=headers)
+
+    cached = leaderboard_responses.get(cache_key, version)
+    if cached is None:
+        try:
+            leaderboard = await db.get_leaderboard(limit=limit, offset=offset, after=after, window=window)
+        except LeaderboardOffsetTooDeep:
+            return _reject("offset_too_deep", 400)
+        leaderboard_response = leaderboard if isinstance(leaderboard, list) else []
+        cached = leaderboard_responses.put(
+            cache_key,
+            version,
+            {
+                "leaderboard": leaderboard_response,
+                "window": window,
+                "pagination": {
+                    "limit": limit,
+                    "offset": offset,
+                    "next": next_leaderboard_cursor(leaderboard_response, limit),
+                },
+            },
+        )
+
+    body, encoding = cached.negotiate(request.headers.get("Accept-Encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+async def handle_leaderboard_me(request: web.Request) -> web.Response:
+    db: Storage = request.app["db"]
 
     init_data = request.headers.get("X-Telegram-Init-Data", "")
     user = _parse_user_from_init_data(init_data)
     if not user:
-        return web.json_response({"error": "invalid_init_data"}, status=401)
+        return _reject("invalid_init_data", 401)
+
+    try:
+        neighbours = max(0, min(int(request.query.get("neighbours", "1")), 10))
+    except ValueError:
+        return _reject("invalid_neighbours", 400)
 
     await db.upsert_user(user)
-    leaderboard = await db.get_leaderboard()
-    leaderboard_response = leaderboard if isinstance(leaderboard, list) else []
-    return web.json_response({"leaderboard": leaderboard_response})
+    rank = await db.get_user_rank(int(user["id"]), neighbours=neighbours)
+    if rank is None:
+        return web.json_response({"error": "user_not_ranked"}, status=404)
+
+    return web.json_response(rank)
+
+
+def _admin_authorized(request: web.Request) -> bool:
+    if not ADMIN_TOKEN:
+        return False
+    provided = request.headers.get("Authorization", "").removeprefix("Bearer ").encode()
+    return hmac.compare_digest(provided, ADMIN_TOKEN.encode())
 
 
-async def run_api_server(bot: Bot, db: Database) -> None:
+async def handle_admin_export(request: web.Request) -> web.StreamResponse:
+    db: Storage = request.app["db"]
+    if not _admin_authorized(request):
+        return _reject("forbidden", 403)
+
+    kind = request.query.get("kind", "leaderboard")
+    fmt = request.query.get("format", "ndjson")
+    if kind not in EXPORT_KINDS or fmt not in EXPORT_FORMATS:
+        return _reject("invalid_export", 400)
+
+    paths = storage_paths(db)
+    if paths is None:
+        return _reject("export_unsupported", 501)
+
+    # Queued write-behind updates would otherwise be missing from the file.
+    await db.flush()
+    response = web.StreamResponse(
+        headers={
+            "Content-Type": CONTENT_TYPES[fmt],
+            "Content-Disposition": f'attachment; filename="{kind}.{fmt}"',
+        }
+    )
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    chunks = 0
+    async for chunk in aiter_export_chunks(paths, kind, fmt):
+        await response.write(chunk)
+        chunks += 1
+    await response.write_eof()
+    logger.info("admin_export_completed", extra={"kind": kind, "format": fmt, "chunks": chunks})
+    return response
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    if ADMIN_TOKEN and not _admin_authorized(request):
+        return _reject("forbidden", 403)
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def run_api_server(
+    bot: Bot,
+    db: Storage,
+    outbound: OutboundScheduler | None = None,
+    webhook: WebhookIngress | None = None,
+    *,
+    outbox: PaymentOutbox | None = None,
+    serve_api: bool = True,
+    serve_metrics: bool = True,
+    port: int = API_PORT,
+    reuse_port: bool = False,
+) -> web.AppRunner:
     @web.middleware
     async def cors_middleware(request: web.Request, handler):
         if request.method == "OPTIONS":
@@ -91,86 +310,181 @@ async def run_api_server(bot: Bot, db: Database) -> None:
             response = await handler(request)
         response.headers["Access-Control-Allow-Origin"] = "*"
         response.headers["Access-Control-Allow-Methods"] = "GET, OPTIONS"
-        response.headers["Access-Control-Allow-Headers"] = "Content-Type, X-Telegram-Init-Data"
+        response.headers["Access-Control-Allow-Headers"] = "Content-Type, X-Telegram-Init-Data, If-None-Match"
+        response.headers["Access-Control-Expose-Headers"] = "ETag"
         return response
 
-    app = web.Application(middlewares=[cors_middleware])
+    @web.middleware
+    async def timing_middleware(request: web.Request, handler):
+        started_at = time.perf_counter()
+        try:
+            return await handler(request)
+        finally:
+            resource = request.match_info.route.resource
+            route = resource.canonical if resource is not None else "unmatched"
+            REQUEST_SECONDS.labels(route).observe(time.perf_counter() - started_at)
+
+    app = web.Application(middlewares=[timing_middleware, cors_middleware] if METRICS_ENABLED else [cors_middleware])
     app["bot"] = bot
     app["db"] = db
-    app.router.add_get("/api/invoice", handle_invoice)
-    app.router.add_options("/api/invoice", handle_invoice)
-    app.router.add_get("/api/leaderboard", handle_leaderboard)
-    app.router.add_options("/api/leaderboard", handle_leaderboard)
+    app["outbound"] = outbound
+    if serve_api:
+        app.router.add_get("/api/invoice", handle_invoice)
+        app.router.add_options("/api/invoice", handle_invoice)
+        app.router.add_get("/api/leaderboard", handle_leaderboard)
+        app.router.add_options("/api/leaderboard", handle_leaderboard)
+        app.router.add_get("/api/leaderboard/me", handle_leaderboard_me)
+        app.router.add_options("/api/leaderboard/me", handle_leaderboard_me)
+        if ADMIN_TOKEN:
+            app.router.add_get("/api/admin/export", handle_admin_export)
+    if webhook is not None:
+        app.router.add_post(WEBHOOK_PATH, webhook.handle)
+    if METRICS_ENABLED and serve_metrics:
+        register_component_metrics(
+            db,
+            {"init_data": init_data_cache, "leaderboard_response": leaderboard_responses, "invoice_link": invoice_links},
+            outbound,
+            outbox,
+        )
+        app.router.add_get("/metrics", handle_metrics)
 
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, API_HOST, API_PORT)
+    site = web.TCPSite(runner, API_HOST, port, reuse_port=reuse_port)
     await site.start()
+    return runner
+
+
+def build_bot() -> Bot:
+    if TELEGRAM_API_BASE_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE_URL))
+        return Bot(BOT_TOKEN, session=session)
+    return Bot(BOT_TOKEN)
 
 
-def build_start_keyboard() -> types.InlineKeyboardMarkup:
-    builder = InlineKeyboardBuilder()
-    builder.button(text=MINI_APP_BUTTON, web_app=types.WebAppInfo(url=MINI_APP_URL))
-    builder.adjust(1)
-    return builder.as_markup()
+def build_outbound(processes: int = 1) -> OutboundScheduler:
+    # Flood limits apply per bot token, so each process gets an equal share.
+    return OutboundScheduler(
+        global_rate=OUTBOUND_GLOBAL_RATE / processes,
+        per_chat_rate=OUTBOUND_PER_CHAT_RATE,
+        workers=OUTBOUND_WORKERS,
+        max_attempts=OUTBOUND_MAX_ATTEMPTS,
+    )
+
+
+async def run_metrics_server(
+    bot: Bot,
+    db: Storage,
+    outbound: OutboundScheduler | None,
+    *,
+    outbox: PaymentOutbox | None = None,
+    port: int,
+    process: str,
+) -> web.AppRunner | None:
+    # In multi-process mode every process exposes its own registry on its own
+    # port, so a scrape never lands on a random SO_REUSEPORT worker.
+    if not METRICS_ENABLED:
+        return None
+    REGISTRY.const_labels = {"process": process}
+    return await run_api_server(bot, db, outbound, outbox=outbox, serve_api=False, port=port)
 
 
-async def main() -> None:
-    bot = Bot(BOT_TOKEN)
+async def run_api_worker(processes: int, index: int = 0) -> None:
+    bot = build_bot()
+    # Snapshots, checkpoints and ANALYZE are run by the process that owns the
+    # bot; workers judging idleness by their own executor would contend on the file.
+    db = create_storage(backup_interval=0, maintenance=False)
+    await db.init()
+    outbound = build_outbound(processes)
+    await outbound.start()
+
+    runner = await run_api_server(bot, db, outbound, serve_metrics=False, reuse_port=True)
+    metrics_runner = await run_metrics_server(bot, db, outbound, port=METRICS_PORT + 1 + index, process=f"api-{index}")
+    logger.info("api_worker_started", extra={"pid": os.getpid(), "port": API_PORT, "worker": index})
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await runner.cleanup()
+        await outbound.stop()
+        await db.close()
+        await bot.session.close()
+
+
+async def main(api_workers: int = 1) -> None:
+    # With api_workers > 1 the API is served by separate worker processes
+    # (see supervisor.py) and this process only handles updates; a webhook
+    # then listens on WEBHOOK_PORT instead of sharing the API port.
+    bot = build_bot()
     dp = Dispatcher()
-    db = Database(DB_PATH)
+    db = create_storage()
     await db.init()
 
-    api_task = asyncio.create_task(run_api_server(bot, db))
+    processes = api_workers + 1 if api_workers > 1 else 1
+    outbound = build_outbound(processes)
+    await outbound.start()
 
-    @dp.message(CommandStart())
-    async def handle_start(message: types.Message) -> None:
-        text = (
-            "Привет! 🎁\n"
-            "Жми на кнопку ниже, чтобы открыть мини-приложение и забрать подарки."
-        )
-        await message.answer(text, reply_markup=build_start_keyboard())
-
-    @dp.pre_checkout_query()
-    async def handle_pre_checkout(pre_checkout_query: types.PreCheckoutQuery) -> None:
-        payload = parse_invoice_payload(pre_checkout_query.invoice_payload)
-        if not payload:
-            await pre_checkout_query.answer(ok=False, error_message="Некорректные данные платежа.")
-            return
-
-        if pre_checkout_query.currency != "XTR":
-            await pre_checkout_query.answer(ok=False, error_message="Неверная валюта.")
-            return
-
-        if payload["amount"] not in ALLOWED_PRICES:
-            await pre_checkout_query.answer(ok=False, error_message="Некорректная сумма.")
-            return
-
-        if pre_checkout_query.total_amount != payload["amount"]:
-            await pre_checkout_query.answer(ok=False, error_message="Несовпадение суммы.")
-            return
-
-        if pre_checkout_query.from_user.id != payload["user_id"]:
-            await pre_checkout_query.answer(ok=False, error_message="Платеж от другого пользователя.")
-            return
-
-        await pre_checkout_query.answer(ok=True)
-
-    @dp.message(F.successful_payment)
-    async def handle_successful_payment(message: types.Message) -> None:
-        payload = parse_invoice_payload(message.successful_payment.invoice_payload)
-        if payload:
-            await db.add_spent_stars(payload["user_id"], payload["amount"])
-            logger.info(
-                "payment_recorded",
-                extra={"user_id": payload["user_id"], "amount": payload["amount"]},
+    outbox = PaymentOutbox(
+        PAYMENT_OUTBOX_PATH,
+        db,
+        batch_size=PAYMENT_OUTBOX_BATCH_SIZE,
+        flush_interval_ms=PAYMENT_OUTBOX_FLUSH_MS,
+        fsync=PAYMENT_OUTBOX_FSYNC,
+    )
+    await outbox.start()
+
+    register_bot_handlers(dp, db, outbound, outbox)
+    updates = UpdateScheduler(
+        dp,
+        bot,
+        queue_size=UPDATE_QUEUE_SIZE,
+        workers={
+            PRE_CHECKOUT: UPDATE_PRE_CHECKOUT_WORKERS,
+            SUCCESSFUL_PAYMENT: UPDATE_PAYMENT_WORKERS,
+            OTHER: UPDATE_OTHER_WORKERS,
+        },
+    )
+    await updates.start()
+    webhook = WebhookIngress(updates, WEBHOOK_SECRET) if WEBHOOK_URL else None
+
+    runner = None
+    metrics_runner = None
+    if api_workers <= 1:
+        runner = await run_api_server(bot, db, outbound, webhook, outbox=outbox)
+    else:
+        if webhook is not None:
+            runner = await run_api_server(
+                bot, db, outbound, webhook, outbox=outbox, serve_api=False, serve_metrics=False, port=WEBHOOK_PORT
             )
+        metrics_runner = await run_metrics_server(bot, db, outbound, outbox=outbox, port=METRICS_PORT, process="poller")
 
-        await message.answer("Оплата прошла успешно! 🎉")
-
-    await dp.start_polling(bot)
-    api_task.cancel()
+    try:
+        if webhook is not None:
+            await bot.set_webhook(
+                WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info("webhook_mode_enabled", extra={"url": WEBHOOK_URL, "path": WEBHOOK_PATH})
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook()
+            await poll_updates(bot, updates, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if runner is not None:
+            await runner.cleanup()
+        await updates.stop()
+        await outbox.stop()
+        await outbound.stop()
+        await db.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    listener = setup_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        listener.stop()
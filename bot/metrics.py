@@ -0,0 +1,264 @@
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Callable, Iterable
+
+
+# Latency buckets in seconds, from sub-millisecond cache hits up to the
+# Telegram round-trips and the 10s pre-checkout answer deadline.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Samples = Iterable[tuple[tuple[str, ...], float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], *extra: str) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    pairs.extend(label for label in extra if label)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _CounterChild:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self._buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        index = bisect_left(self._buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], object] = {}
+        self._children_lock = threading.Lock()
+
+    @abstractmethod
+    def _new_child(self) -> Any:
+        ...
+
+    @abstractmethod
+    def render(self, const: str = "") -> list[str]:
+        ...
+
+    def labels(self, *values: str):
+        # Call once and keep the child on hot paths; the lookup is a dict get.
+        child = self._children.get(values)
+        if child is None:
+            with self._children_lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def render(self, const: str = "") -> list[str]:
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, values, const)} {_number(child.value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def render(self, const: str = "") -> list[str]:
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, const, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values, const)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values, const)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    # Values read at scrape time from stats the components already keep, so
+    # the request path pays nothing for them.
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        kind: str,
+        labelnames: tuple[str, ...],
+        collect: Callable[[], Samples],
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self._collect = collect
+
+    def _new_child(self) -> Any:
+        raise TypeError(f"{self.name} is read at scrape time and has no children")
+
+    def render(self, const: str = "") -> list[str]:
+        lines = self.header()
+        for values, value in self._collect():
+            lines.append(f"{self.name}{_labels(self.labelnames, values, const)} {_number(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        # Added to every sample, e.g. {"process": "api-0"} when several
+        # processes each expose their own registry.
+        self.const_labels: dict[str, str] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        # Re-registering a name replaces it, so a second server setup in the
+        # same process points callbacks at its own objects.
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple[str, ...] = (), **kwargs) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, **kwargs))
+
+    def callback(
+        self,
+        name: str,
+        help_text: str,
+        kind: str,
+        collect: Callable[[], Samples],
+        labelnames: tuple[str, ...] = (),
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help_text, kind, labelnames, collect))
+
+    def render(self) -> str:
+        const = _labels(tuple(self.const_labels), tuple(self.const_labels.values()))[1:-1]
+        lines: list[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render(const))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "randomgift_stage_duration_seconds",
+    "Time spent in each hot-path stage.",
+    ("stage",),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "randomgift_http_request_duration_seconds",
+    "API request handling time by route.",
+    ("route",),
+)
+REJECTIONS = REGISTRY.counter(
+    "randomgift_rejections_total",
+    "Requests and updates turned away, by reason.",
+    ("reason",),
+)
+
+INIT_DATA_VERIFY = STAGE_SECONDS.labels("init_data_verify")
+DB_QUEUE_WAIT = STAGE_SECONDS.labels("db_queue_wait")
+DB_EXECUTE = STAGE_SECONDS.labels("db_execute")
+DB_COMMIT = STAGE_SECONDS.labels("db_commit")
+DB_READ_POOL_WAIT = STAGE_SECONDS.labels("db_read_pool_wait")
+TELEGRAM_CREATE_INVOICE_LINK = STAGE_SECONDS.labels("telegram_create_invoice_link")
+PRE_CHECKOUT_ANSWER = STAGE_SECONDS.labels("pre_checkout_answer")
+
+
+def reject(reason: str) -> None:
+    REJECTIONS.labels(reason).inc()
+
+
+def register_component_metrics(db: Any, caches: dict[str, Any], outbound: Any = None, outbox: Any = None) -> None:
+    # Everything here is read from the stats() the components already keep,
+    # at scrape time only. Both API servers call it with their own caches.
+    def cache_samples():
+        for name, cache in caches.items():
+            stats = cache.stats()
+            yield (name, "hit"), stats["hits"]
+            yield (name, "miss"), stats["misses"]
+            if hasattr(cache, "not_modified"):
+                yield (name, "not_modified"), cache.not_modified
+
+    def db_queue_depth():
+        shards = getattr(db, "shards", None) or [db]
+        depths = [shard.executor_stats()["queue_depth"] for shard in shards if hasattr(shard, "executor_stats")]
+        if depths:
+            yield (), sum(depths)
+
+    REGISTRY.callback(
+        "randomgift_cache_requests_total",
+        "Cache lookups by cache and result.",
+        "counter",
+        cache_samples,
+        ("cache", "result"),
+    )
+    REGISTRY.callback(
+        "randomgift_db_queue_depth",
+        "Operations waiting for the SQLite writer thread.",
+        "gauge",
+        db_queue_depth,
+    )
+    if outbound is not None:
+        REGISTRY.callback(
+            "randomgift_outbound_queue_depth",
+            "Telegram API calls waiting for a send slot.",
+            "gauge",
+            lambda: [((), outbound.stats()["queue_depth"])],
+        )
+    if outbox is not None:
+        REGISTRY.callback(
+            "randomgift_payment_outbox_pending",
+            "Payments journaled but not yet applied to the database.",
+            "gauge",
+            lambda: [((), outbox.stats()["pending"])],
+        )
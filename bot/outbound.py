@@ -0,0 +1,245 @@
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable
+
+from aiogram.exceptions import TelegramRetryAfter
+
+
+logger = logging.getLogger(__name__)
+
+
+class Lane(IntEnum):
+    PRE_CHECKOUT = 0
+    INVOICE = 1
+    PAYMENT_REPLY = 2
+    CHAT = 3
+
+
+class OutboundRateLimited(Exception):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"Bot API rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+
+@dataclass
+class _LaneStats:
+    queued: int = 0
+    completed: int = 0
+    failed: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+
+
+@dataclass(order=True)
+class _Job:
+    lane: Lane
+    seq: int
+    fn: Callable[[], Awaitable[Any]] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    chat_id: int | None = field(compare=False, default=None)
+    enqueued_at: float = field(compare=False, default=0.0)
+    attempts: int = field(compare=False, default=0)
+
+
+class OutboundScheduler:
+    # Every outbound Bot API call goes through one priority queue. Lanes are
+    # served strictly in order, so pre-checkout answers (10s deadline) jump ahead
+    # of chat replies. A global bucket and per-chat buckets keep us under
+    # Telegram's flood limits, and a 429 pauses all workers for retry_after.
+    def __init__(
+        self,
+        *,
+        global_rate: float = 30.0,
+        per_chat_rate: float = 1.0,
+        per_chat_burst: float = 3.0,
+        workers: int = 4,
+        max_attempts: int = 3,
+        max_retry_after: float = 30.0,
+    ) -> None:
+        self._global = TokenBucket(global_rate, global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        self._chats: dict[int, TokenBucket] = {}
+        self._queue: asyncio.PriorityQueue[_Job] = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._workers_count = max(1, workers)
+        self._workers: list[asyncio.Task] = []
+        self._deferred: set[asyncio.TimerHandle] = set()
+        self._paused_until = 0.0
+        self.max_attempts = max(1, max_attempts)
+        self.max_retry_after = max_retry_after
+        self.retries = 0
+        self.rate_limited = 0
+        self._lanes = {lane: _LaneStats() for lane in Lane}
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+
+    async def stop(self) -> None:
+        for handle in self._deferred:
+            handle.cancel()
+        self._deferred.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[Any]],
+        *,
+        lane: Lane = Lane.CHAT,
+        chat_id: int | None = None,
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        job = _Job(
+            lane=lane,
+            seq=next(self._seq),
+            fn=fn,
+            future=loop.create_future(),
+            chat_id=chat_id,
+            enqueued_at=loop.time(),
+        )
+        self._lanes[lane].queued += 1
+        self._queue.put_nowait(job)
+        return await job.future
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats.clear()
+            bucket = TokenBucket(self._per_chat_rate, self._per_chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _defer(self, job: _Job, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+
+        def requeue() -> None:
+            self._deferred.discard(handle)
+            self._queue.put_nowait(job)
+
+        handle = loop.call_later(delay, requeue)
+        self._deferred.add(handle)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if job.future.done():
+                self._lanes[job.lane].queued -= 1
+                continue
+
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self._global.delay(now))
+            if wait > 0:
+                self._queue.put_nowait(job)
+                await asyncio.sleep(wait)
+                continue
+
+            if job.chat_id is not None:
+                chat_bucket = self._chat_bucket(job.chat_id)
+                chat_wait = chat_bucket.delay(now)
+                if chat_wait > 0:
+                    self._defer(job, chat_wait)
+                    continue
+                chat_bucket.consume(now)
+            self._global.consume(now)
+
+            await self._execute(job)
+
+    async def _execute(self, job: _Job) -> None:
+        job.attempts += 1
+        stats = self._lanes[job.lane]
+        try:
+            result = await job.fn()
+        except TelegramRetryAfter as exc:
+            self.rate_limited += 1
+            retry_after = float(exc.retry_after)
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            logger.warning(
+                "outbound_rate_limited",
+                extra={"lane": job.lane.name, "retry_after": retry_after, "attempt": job.attempts},
+            )
+            if job.attempts < self.max_attempts and retry_after <= self.max_retry_after:
+                self.retries += 1
+                self._defer(job, retry_after)
+                return
+            self._finish(job, stats, error=OutboundRateLimited(retry_after))
+        except Exception as exc:
+            self._finish(job, stats, error=exc)
+        else:
+            self._finish(job, stats, result=result)
+
+    def _finish(self, job: _Job, stats: _LaneStats, *, result: Any = None, error: Exception | None = None) -> None:
+        latency = asyncio.get_running_loop().time() - job.enqueued_at
+        stats.queued -= 1
+        stats.total_latency += latency
+        stats.max_latency = max(stats.max_latency, latency)
+        if error is not None:
+            stats.failed += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+
+        stats.completed += 1
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def stats(self) -> dict:
+        lanes = {}
+        for lane, stats in self._lanes.items():
+            finished = stats.completed + stats.failed
+            lanes[lane.name.lower()] = {
+                "queued": stats.queued,
+                "completed": stats.completed,
+                "failed": stats.failed,
+                "avg_latency_ms": round(stats.total_latency / finished * 1000, 3) if finished else 0.0,
+                "max_latency_ms": round(stats.max_latency * 1000, 3),
+            }
+        return {
+            "queue_depth": self._queue.qsize(),
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "lanes": lanes,
+        }
+
+
+async def send_outbound(
+    outbound: OutboundScheduler | None,
+    fn: Callable[[], Awaitable[Any]],
+    *,
+    lane: Lane,
+    chat_id: int | None = None,
+) -> Any:
+    if outbound is None:
+        return await fn()
+    return await outbound.call(fn, lane=lane, chat_id=chat_id)
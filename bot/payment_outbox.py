@@ -0,0 +1,277 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from storage import Storage
+
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentOutbox:
+    # successful_payment handlers append one JSON line per charge and return;
+    # crediting happens in a background consumer that hands batches to
+    # Storage.apply_payments. The file is only trimmed after a batch commits,
+    # and the payment_ledger primary key on charge_id makes replays after a
+    # crash (or a redelivered update) credit nothing twice. All file I/O runs
+    # on one journal thread: appends queued while it is busy are written and
+    # fsynced together (group commit) and each caller awaits its ack. An entry
+    # only becomes pending, and so drainable, once its line is acknowledged.
+    # Compaction works from the journal thread's own record of what the file
+    # holds, so a line written just before it is never dropped.
+    def __init__(
+        self,
+        path: Path,
+        db: Storage,
+        *,
+        batch_size: int = 100,
+        flush_interval_ms: int = 50,
+        fsync: bool = True,
+    ) -> None:
+        self.path = Path(path)
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self._flush_interval = max(1, flush_interval_ms) / 1000
+        self.fsync = fsync
+        self._pending: list[dict] = []
+        self._pending_ids: set[str] = set()
+        # Entries in the file by charge_id; only the journal thread touches it
+        # once started.
+        self._journaled: dict[str, dict] = {}
+        self._file = None
+        self._jobs: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: threading.Thread | None = None
+        self._drain_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._consumer_task: asyncio.Task | None = None
+        self._closing = False
+        self.appended = 0
+        self.applied = 0
+        self.duplicates = 0
+        self.replayed = 0
+        self.batches = 0
+        self.failures = 0
+        self.journal_writes = 0
+
+    async def start(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        for entry in self._read_entries():
+            if entry["charge_id"] not in self._pending_ids:
+                self._pending.append(entry)
+                self._pending_ids.add(entry["charge_id"])
+                self._journaled[entry["charge_id"]] = entry
+        self.replayed = len(self._pending)
+        if self.replayed:
+            logger.info("payment_outbox_replay", extra={"entries": self.replayed})
+
+        self._writer = threading.Thread(target=self._journal_loop, name="payment-journal", daemon=True)
+        self._writer.start()
+        # Rewriting drops any torn trailing line before new entries are appended.
+        await self._compact()
+        await self.drain()
+        self._closing = False
+        self._consumer_task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._closing = True
+        if self._consumer_task is not None:
+            self._wakeup.set()
+            await self._consumer_task
+            self._consumer_task = None
+        await self.drain()
+        if self._writer is not None:
+            self._jobs.put(None)
+            await asyncio.to_thread(self._writer.join)
+            self._writer = None
+
+    def _read_entries(self) -> list[dict]:
+        if not self.path.exists():
+            return []
+
+        entries = []
+        with open(self.path, encoding="utf-8") as outbox_file:
+            for line in outbox_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-write was never acknowledged.
+                    logger.warning("payment_outbox_line_invalid", extra={"line": line[:200]})
+                    continue
+                entries.append(entry)
+        return entries
+
+    def _submit(self, kind: str, payload) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._jobs.put((kind, payload, loop, future))
+        return future
+
+    def _journal_loop(self) -> None:
+        while (job := self._jobs.get()) is not None:
+            jobs = [job]
+            # Everything queued meanwhile shares the next flush and fsync.
+            while jobs[-1][0] == "line":
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._jobs.put(None)
+                    break
+                jobs.append(job)
+
+            lines = [job for job in jobs if job[0] == "line"]
+            error = None
+            try:
+                if lines:
+                    self._file.write("".join(_line(entry) for _, entry, _, _ in lines))
+                    self._file.flush()
+                    if self.fsync:
+                        os.fsync(self._file.fileno())
+                    self.journal_writes += 1
+                    for _, entry, _, _ in lines:
+                        self._journaled[entry["charge_id"]] = entry
+                if jobs[-1][0] == "compact":
+                    self._compact_sync(jobs[-1][1])
+            except Exception as exc:
+                error = exc
+            for _, _, loop, future in jobs:
+                loop.call_soon_threadsafe(_resolve, future, error)
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def append(
+        self,
+        charge_id: str,
+        user_id: int,
+        amount: int,
+        payer: dict | None = None,
+        paid_at: int | None = None,
+    ) -> bool:
+        if charge_id in self._pending_ids:
+            self.duplicates += 1
+            logger.info("payment_outbox_duplicate", extra={"charge_id": charge_id})
+            return False
+
+        # paid_at picks the leaderboard windows, so a line replayed after a
+        # restart still credits the day and week it was paid in.
+        entry = {
+            "charge_id": charge_id,
+            "user_id": user_id,
+            "amount": amount,
+            "payer": payer,
+            "paid_at": paid_at if paid_at is not None else int(time.time()),
+        }
+        # The id is taken now so a redelivery racing this write is a
+        # duplicate; drain sees the entry only after the ack.
+        self._pending_ids.add(charge_id)
+        try:
+            await self._submit("line", entry)
+        except Exception:
+            self._pending_ids.discard(charge_id)
+            raise
+        self._pending.append(entry)
+        self.appended += 1
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.drain()
+
+    async def drain(self) -> None:
+        # The consumer, stop() and callers may drain at once; a second drain
+        # must not trim entries the first has not applied yet.
+        async with self._drain_lock:
+            await self._drain()
+
+    async def _drain(self) -> None:
+        drained: set[str] = set()
+        while self._pending:
+            batch = self._pending[: self.batch_size]
+            loop = asyncio.get_running_loop()
+            started_at = loop.time()
+            try:
+                applied = await self.db.apply_payments(batch)
+            except Exception:
+                self.failures += 1
+                logger.exception("payment_outbox_apply_failed", extra={"entries": len(batch)})
+                break
+
+            del self._pending[: len(batch)]
+            for entry in batch:
+                self._pending_ids.discard(entry["charge_id"])
+            self.batches += 1
+            self.applied += applied
+            self.duplicates += len(batch) - applied
+            drained.update(entry["charge_id"] for entry in batch)
+            logger.info(
+                "payment_outbox_applied",
+                extra={
+                    "entries": len(batch),
+                    "applied": applied,
+                    "duration_ms": round((loop.time() - started_at) * 1000, 3),
+                },
+            )
+
+        if drained and self._writer is not None:
+            await self._compact(drained)
+
+    async def _compact(self, applied: set[str] = frozenset()) -> None:
+        await self._submit("compact", applied)
+
+    def _compact_sync(self, applied: set[str]) -> None:
+        # Rewrites the file without the applied entries. Every line written
+        # before this job is in _journaled already, acknowledged or not. The
+        # rename is atomic, so a crash leaves either the old or the new file.
+        for charge_id in applied:
+            self._journaled.pop(charge_id, None)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as tmp_file:
+            for entry in self._journaled.values():
+                tmp_file.write(_line(entry))
+            tmp_file.flush()
+            if self.fsync:
+                os.fsync(tmp_file.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "appended": self.appended,
+            "applied": self.applied,
+            "duplicates": self.duplicates,
+            "replayed": self.replayed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "journal_writes": self.journal_writes,
+        }
+
+
+def _line(entry: dict) -> str:
+    return json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _resolve(future: asyncio.Future, error: BaseException | None) -> None:
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(None)
@@ -0,0 +1,212 @@
+import random
+from collections import deque
+from typing import Iterable, Iterator
+
+
+class _Node:
+    __slots__ = ("key", "priority", "size", "left", "right")
+
+    def __init__(self, key: tuple[int, int], priority: float) -> None:
+        self.key = key
+        self.priority = priority
+        self.size = 1
+        self.left: _Node | None = None
+        self.right: _Node | None = None
+
+
+def _size(node: _Node | None) -> int:
+    return node.size if node is not None else 0
+
+
+def _split(node: _Node | None, key: tuple[int, int]) -> tuple[_Node | None, _Node | None]:
+    # (keys < key, keys >= key)
+    if node is None:
+        return None, None
+    if node.key < key:
+        node.right, right = _split(node.right, key)
+        node.size = 1 + _size(node.left) + _size(node.right)
+        return node, right
+    left, node.left = _split(node.left, key)
+    node.size = 1 + _size(node.left) + _size(node.right)
+    return left, node
+
+
+def _merge(left: _Node | None, right: _Node | None) -> _Node | None:
+    # Every key in `left` sorts before every key in `right`.
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.size = 1 + _size(left.left) + _size(left.right)
+        return left
+    right.left = _merge(left, right.left)
+    right.size = 1 + _size(right.left) + _size(right.right)
+    return right
+
+
+def _build(keys: list[tuple[int, int]], lo: int, hi: int) -> _Node | None:
+    if lo >= hi:
+        return None
+    mid = (lo + hi) // 2
+    node = _Node(keys[mid], 0.0)
+    node.left = _build(keys, lo, mid)
+    node.right = _build(keys, mid + 1, hi)
+    node.size = hi - lo
+    return node
+
+
+class RankIndex:
+    # Order-statistic index over (spent_stars DESC, user_id ASC): a treap keyed
+    # by (-spent_stars, user_id) with subtree sizes. Ties are ordinary keys, so
+    # a new star total or the crowded 0-star bucket costs the same expected
+    # O(log n) per update, rank and select as any other key.
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.ready = False
+        self._stars: dict[int, int] = {}
+        self._root: _Node | None = None
+
+    def __len__(self) -> int:
+        return len(self._stars)
+
+    def load(self, pairs: Iterable[tuple[int, int]]) -> None:
+        self._stars = dict(pairs)
+        keys = sorted((-spent_stars, user_id) for user_id, spent_stars in self._stars.items())
+        self._root = _build(keys, 0, len(keys))
+
+        # Hand out priorities in breadth-first order so every parent outranks
+        # its children and the balanced tree is a valid treap.
+        priorities = sorted((random.random() for _ in keys), reverse=True)
+        queue = deque([self._root] if self._root is not None else [])
+        for priority in priorities:
+            node = queue.popleft()
+            node.priority = priority
+            if node.left is not None:
+                queue.append(node.left)
+            if node.right is not None:
+                queue.append(node.right)
+        self.ready = True
+
+    def _insert(self, key: tuple[int, int]) -> None:
+        node = _Node(key, random.random())
+        parent = None
+        current = self._root
+        while current is not None and current.priority > node.priority:
+            current.size += 1
+            parent = current
+            current = current.right if current.key < key else current.left
+
+        node.left, node.right = _split(current, key)
+        node.size = 1 + _size(node.left) + _size(node.right)
+        self._replace_child(parent, key, node)
+
+    def _remove(self, key: tuple[int, int]) -> None:
+        parent = None
+        current = self._root
+        while current.key != key:
+            current.size -= 1
+            parent = current
+            current = current.right if current.key < key else current.left
+        self._replace_child(parent, key, _merge(current.left, current.right))
+
+    def _replace_child(self, parent: _Node | None, key: tuple[int, int], node: _Node | None) -> None:
+        if parent is None:
+            self._root = node
+        elif parent.key < key:
+            parent.right = node
+        else:
+            parent.left = node
+
+    def _count_before(self, key: tuple[int, int], inclusive: bool) -> int:
+        count = 0
+        node = self._root
+        while node is not None:
+            if node.key < key or (inclusive and node.key == key):
+                count += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return count
+
+    def _iter_from(self, index: int) -> Iterator[tuple[int, int]]:
+        # In-order keys from the 0-based `index` on, one O(log n) descent and
+        # then amortized O(1) per key.
+        stack: list[_Node] = []
+        node = self._root
+        while node is not None:
+            left = _size(node.left)
+            if index < left:
+                stack.append(node)
+                node = node.left
+            elif index == left:
+                stack.append(node)
+                break
+            else:
+                index -= left + 1
+                node = node.right
+
+        while stack:
+            node = stack.pop()
+            yield node.key
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def update(self, user_id: int, spent_stars: int) -> None:
+        if not self.ready:
+            return
+
+        previous = self._stars.get(user_id)
+        if previous == spent_stars:
+            return
+
+        if previous is not None:
+            self._remove((-previous, user_id))
+        self._stars[user_id] = spent_stars
+        self._insert((-spent_stars, user_id))
+
+    def spent_stars(self, user_id: int) -> int | None:
+        return self._stars.get(user_id)
+
+    def rank(self, user_id: int) -> int | None:
+        spent_stars = self._stars.get(user_id)
+        if spent_stars is None:
+            return None
+        return self._count_before((-spent_stars, user_id), inclusive=False) + 1
+
+    def position(self, spent_stars: int, user_id: int) -> int:
+        # Number of entries ordered at or before (spent_stars, user_id), which
+        # need not be present; a keyset cursor resumes at position() + 1.
+        return self._count_before((-spent_stars, user_id), inclusive=True)
+
+    def select(self, rank: int) -> int | None:
+        if rank < 1 or rank > len(self._stars):
+            return None
+
+        index = rank - 1
+        node = self._root
+        while True:
+            left = _size(node.left)
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node.key[1]
+            else:
+                index -= left + 1
+                node = node.right
+
+    def page(self, rank: int, count: int) -> list[tuple[int, int]]:
+        # (user_id, spent_stars) for `count` consecutive ranks from `rank`,
+        # walking the tree in order instead of selecting every rank separately.
+        if rank < 1 or rank > len(self._stars) or count < 1:
+            return []
+
+        entries: list[tuple[int, int]] = []
+        for negative_stars, user_id in self._iter_from(rank - 1):
+            entries.append((user_id, -negative_stars))
+            if len(entries) == count:
+                break
+        return entries
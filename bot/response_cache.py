@@ -0,0 +1,110 @@
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+MIN_COMPRESSIBLE_BYTES = 512
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    etag: str
+    body: bytes
+    gzip_body: bytes | None
+    brotli_body: bytes | None
+
+    def negotiate(self, accept_encoding: str | None) -> tuple[bytes, str | None]:
+        accepted = _parse_accept_encoding(accept_encoding)
+        if self.brotli_body is not None and "br" in accepted:
+            return self.brotli_body, "br"
+        if self.gzip_body is not None and "gzip" in accepted:
+            return self.gzip_body, "gzip"
+        return self.body, None
+
+
+def _parse_accept_encoding(accept_encoding: str | None) -> set[str]:
+    if not accept_encoding:
+        return set()
+
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in {"q=0", "q=0.0", "q=0.00", "q=0.000"}:
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+
+    candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates or etag.removeprefix("W/") in candidates
+
+
+class ResponseCache:
+    # Encoded JSON bodies keyed by (request key, data version). The ETag is a pure
+    # function of the key and version, so conditional requests can be answered
+    # with 304 before anything is read or serialized.
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max(0, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._entries: OrderedDict[tuple[Hashable, int], CachedResponse] = OrderedDict()
+
+    def etag(self, key: Hashable, version: int) -> str:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest()
+        return f'W/"{version}-{digest}"'
+
+    def get(self, key: Hashable, version: int) -> CachedResponse | None:
+        cached = self._entries.get((key, version))
+        if cached is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end((key, version))
+        self.hits += 1
+        return cached
+
+    def put(self, key: Hashable, version: int, payload: dict) -> CachedResponse:
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+        gzip_body = None
+        brotli_body = None
+        if len(body) >= MIN_COMPRESSIBLE_BYTES:
+            gzip_body = gzip.compress(body, compresslevel=6, mtime=0)
+            if brotli is not None:
+                brotli_body = brotli.compress(body, quality=5)
+
+        cached = CachedResponse(
+            etag=self.etag(key, version),
+            body=body,
+            gzip_body=gzip_body,
+            brotli_body=brotli_body,
+        )
+        if self.max_entries:
+            self._entries[(key, version)] = cached
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return cached
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+
+def leaderboard_cache_key(window_key: str, limit: int, offset: int, cursor: str | None) -> tuple:
+    return ("leaderboard", window_key, limit, offset if cursor is None else 0, cursor)
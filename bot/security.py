@@ -1,10 +1,19 @@
 import hashlib
 import hmac
 import json
+import threading
 import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
 from urllib.parse import parse_qsl
 
 
+@lru_cache(maxsize=8)
+def _derive_secret_key(bot_token: str) -> bytes:
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
 def verify_telegram_init_data(init_data: str, bot_token: str, max_age_seconds: int) -> dict | None:
     data = dict(parse_qsl(init_data, keep_blank_values=True))
     received_hash = data.pop("hash", None)
@@ -25,9 +34,9 @@ def verify_telegram_init_data(init_data: str, bot_token: str, max_age_seconds: i
         return None
 
     data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(data.items()))
-    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    secret_key = _derive_secret_key(bot_token)
     calculated_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
-    if calculated_hash != received_hash:
+    if not hmac.compare_digest(calculated_hash, received_hash):
         return None
 
     return data
@@ -47,3 +56,95 @@ def extract_user_from_init_data(parsed_init_data: dict) -> dict | None:
         return None
 
     return user
+
+
+@dataclass(frozen=True)
+class _VerifiedInitData:
+    data: dict
+    user: dict
+    auth_date: int
+    expires_at: float
+
+
+# Only successful verifications are cached, and an entry never outlives the
+# auth_date age boundary that verify_telegram_init_data enforces.
+class InitDataCache:
+    def __init__(self, max_size: int = 4096, ttl_seconds: int = 600) -> None:
+        self.max_size = max(0, max_size)
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, str], _VerifiedInitData] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, init_data: str, bot_token: str, max_age_seconds: int) -> tuple[dict, dict] | None:
+        key = (bot_token, init_data)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if now >= entry.expires_at or entry.auth_date < int(now) - max_age_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return dict(entry.data), dict(entry.user)
+
+    def put(self, init_data: str, bot_token: str, max_age_seconds: int, data: dict, user: dict) -> None:
+        if self.max_size == 0:
+            return
+
+        auth_date = int(data["auth_date"])
+        now = time.time()
+        expires_at = min(now + self.ttl_seconds, auth_date + max_age_seconds + 1)
+        entry = _VerifiedInitData(data=dict(data), user=dict(user), auth_date=auth_date, expires_at=expires_at)
+        key = (bot_token, init_data)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def verify_init_data_user(
+    init_data: str,
+    bot_token: str,
+    max_age_seconds: int,
+    cache: InitDataCache | None = None,
+) -> tuple[dict, dict | None] | None:
+    if not init_data:
+        return None
+
+    if cache is not None:
+        cached = cache.get(init_data, bot_token, max_age_seconds)
+        if cached is not None:
+            return cached
+
+    parsed = verify_telegram_init_data(init_data, bot_token, max_age_seconds)
+    if not parsed:
+        return None
+
+    user = extract_user_from_init_data(parsed)
+    if not user:
+        return parsed, None
+
+    if cache is not None:
+        cache.put(init_data, bot_token, max_age_seconds, parsed, user)
+
+    return parsed, user
@@ -0,0 +1,190 @@
+import asyncio
+import heapq
+import logging
+import sqlite3
+from itertools import islice
+from pathlib import Path
+
+from config import LEADERBOARD_SHARDED_MAX_OFFSET
+from database import Database
+from leaderboard_windows import ALL_TIME_WINDOW
+
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = 100
+
+
+def _rank_key(entry: dict) -> tuple[int, int]:
+    return -entry["spentStars"], entry["userId"]
+
+
+def shard_paths(path: Path, shards: int) -> list[Path]:
+    return [path.with_name(f"{path.stem}.shard{index}{path.suffix}") for index in range(shards)]
+
+
+class LeaderboardOffsetTooDeep(ValueError):
+    # An offset page has to walk every shard up to offset + limit rows, so
+    # deep pages are refused and clients page on with the `next` cursor.
+    pass
+
+
+def _has_unsharded_data(path: Path) -> bool:
+    if not path.exists():
+        return False
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return any(
+            conn.execute(f"SELECT EXISTS (SELECT 1 FROM {table})").fetchone()[0]
+            for table in ("users", "payment_ledger")
+            if table in tables
+        )
+    finally:
+        conn.close()
+
+
+class ShardedStorage:
+    # Spreads users over K SQLite files by user_id, each with its own writer
+    # thread, WAL and lock, so writes for different users no longer queue
+    # behind one another. A payment's ledger row lives in the credited user's
+    # shard, which keeps the ledger insert and the credit in one transaction.
+    # Leaderboards k-way merge the per-shard pages, which every shard serves
+    # from idx_users_leaderboard (or its cached top) in the global order.
+    def __init__(
+        self,
+        path: Path,
+        shards: int,
+        *,
+        max_offset: int = LEADERBOARD_SHARDED_MAX_OFFSET,
+        **database_options,
+    ) -> None:
+        self.path = path
+        self.max_offset = max(0, max_offset)
+        count = max(1, shards)
+        self.shards = [
+            Database(shard_path, shard=(index, count), **database_options)
+            for index, shard_path in enumerate(shard_paths(path, count))
+        ]
+
+    @property
+    def data_version(self) -> int:
+        return sum(shard.data_version for shard in self.shards)
+
+    def shard_for(self, user_id: int) -> Database:
+        return self.shards[user_id % len(self.shards)]
+
+    async def init(self) -> None:
+        if await asyncio.to_thread(_has_unsharded_data, self.path):
+            raise RuntimeError(
+                f"{self.path} already holds users or payments, which sharded storage would ignore. "
+                "Migrate them into the shard files or unset DB_SHARDS."
+            )
+        results = await asyncio.gather(*(shard.init() for shard in self.shards), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await asyncio.gather(*(shard.close() for shard in self.shards), return_exceptions=True)
+            raise errors[0]
+        logger.info("sharded_storage_initialized", extra={"shards": len(self.shards), "path": str(self.path)})
+
+    async def close(self) -> None:
+        await asyncio.gather(*(shard.close() for shard in self.shards))
+
+    async def flush(self) -> None:
+        await asyncio.gather(*(shard.flush() for shard in self.shards))
+
+    async def upsert_user(self, user: dict) -> None:
+        user_id = user.get("id")
+        if not isinstance(user_id, int):
+            return
+        await self.shard_for(user_id).upsert_user(user)
+
+    async def add_spent_stars(self, user_id: int, amount: int) -> None:
+        await self.shard_for(user_id).add_spent_stars(user_id, amount)
+
+    async def apply_payments(self, payments: list[dict]) -> int:
+        batches: dict[int, list[dict]] = {}
+        payers: dict[int, dict] = {}
+        for payment in payments:
+            index = payment["user_id"] % len(self.shards)
+            payer = payment.get("payer") or {}
+            payer_id = payer.get("id")
+            if isinstance(payer_id, int) and payer_id % len(self.shards) != index:
+                # The payer's profile belongs to another shard; writing it here
+                # would give that user a second row.
+                payers[payer_id] = payer
+                payment = {**payment, "payer": None}
+            batches.setdefault(index, []).append(payment)
+
+        applied = await asyncio.gather(*(self.shards[index].apply_payments(batch) for index, batch in batches.items()))
+        for payer in payers.values():
+            await self.upsert_user(payer)
+        return sum(applied)
+
+    async def _shard_entries(self, shard: Database, count: int, window: str, after: tuple[int, int] | None) -> list[dict]:
+        # A shard's first `count` entries after the cursor, fetched in keyset
+        # pages because a single call returns at most _PAGE_SIZE rows.
+        entries: list[dict] = []
+        while len(entries) < count:
+            size = min(_PAGE_SIZE, count - len(entries))
+            page = await shard.get_leaderboard(limit=size, after=after, window=window)
+            entries.extend(page)
+            if len(page) < size:
+                break
+            after = (page[-1]["spentStars"], page[-1]["userId"])
+        return entries
+
+    async def get_leaderboard(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        after: tuple[int, int] | None = None,
+        window: str = ALL_TIME_WINDOW,
+    ) -> list[dict]:
+        safe_limit = max(1, min(limit, 100))
+        safe_offset = 0 if after is not None else max(0, offset)
+        if safe_offset > self.max_offset:
+            raise LeaderboardOffsetTooDeep(f"offset {safe_offset} exceeds {self.max_offset} with sharded storage")
+        needed = safe_offset + safe_limit
+        pages = await asyncio.gather(*(self._shard_entries(shard, needed, window, after) for shard in self.shards))
+        return list(islice(heapq.merge(*pages, key=_rank_key), safe_offset, needed))
+
+    async def get_user_rank(self, user_id: int, neighbours: int = 1) -> dict | None:
+        neighbours = max(0, min(neighbours, 10))
+        own = await self.shard_for(user_id).get_user_rank(user_id, neighbours=0)
+        if own is None:
+            return None
+
+        key = (own["spentStars"], user_id)
+        counts = await asyncio.gather(*(shard.count_ranked_before(*key) for shard in self.shards))
+        rank = sum(above for above, _ in counts) + 1
+        total = sum(shard_total for _, shard_total in counts)
+
+        entries: list[dict] = []
+        if neighbours:
+            before, after = await asyncio.gather(
+                asyncio.gather(*(shard.get_leaderboard_before(key, neighbours) for shard in self.shards)),
+                asyncio.gather(*(shard.get_leaderboard(limit=neighbours, after=key) for shard in self.shards)),
+            )
+            ahead = list(heapq.merge(*before, key=_rank_key))[-neighbours:]
+            behind = list(heapq.merge(*after, key=_rank_key))[:neighbours]
+            entries = [
+                {**entry, "rank": rank - len(ahead) + position} for position, entry in enumerate(ahead)
+            ] + [{**entry, "rank": rank + 1 + position} for position, entry in enumerate(behind)]
+
+        return {
+            "rank": rank,
+            "total": total,
+            "spentStars": own["spentStars"],
+            "neighbours": entries,
+        }
+
+    async def backup(self) -> list[dict]:
+        # One shard at a time, so only one copy competes with live traffic.
+        return [await shard.backup() for shard in self.shards]
+
+    def stats(self) -> dict:
+        return {
+            "shards": len(self.shards),
+            "executors": [shard.executor_stats() for shard in self.shards],
+        }
@@ -0,0 +1,205 @@
+import logging
+import time
+from pathlib import Path
+from typing import Protocol
+
+from config import DB_PATH, DB_SHARDS, STORAGE_BACKEND
+from database import Database, _coalesce_profile, _profile_fingerprint
+from leaderboard_windows import ALL_TIME_WINDOW, current_window_ids, payment_window_ids, window_id
+from rank_index import RankIndex
+from sharded_storage import ShardedStorage
+
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKENDS = ("sqlite", "memory")
+
+
+class Storage(Protocol):
+    # What the handlers, the API and the payment outbox need from a backend.
+    # data_version moves on every write and keys the leaderboard response cache.
+    data_version: int
+
+    async def init(self) -> None: ...
+
+    async def close(self) -> None: ...
+
+    async def flush(self) -> None: ...
+
+    async def upsert_user(self, user: dict) -> None: ...
+
+    async def add_spent_stars(self, user_id: int, amount: int) -> None: ...
+
+    async def apply_payments(self, payments: list[dict]) -> int: ...
+
+    async def get_leaderboard(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        after: tuple[int, int] | None = None,
+        window: str = ALL_TIME_WINDOW,
+    ) -> list[dict]: ...
+
+    async def get_user_rank(self, user_id: int, neighbours: int = 1) -> dict | None: ...
+
+
+class MemoryStorage:
+    # Everything lives in process memory: profiles as 4-tuples keyed by
+    # user_id, star totals inside a RankIndex per window (which already keeps
+    # them ordered) and the ledger as charge_id -> (user_id, amount, payer_id).
+    # Nothing survives a restart, so it is meant for tests and benchmarks.
+    def __init__(self) -> None:
+        # Seeded from the clock like Database's in-memory counter, so ETags from
+        # before a restart never match.
+        self.data_version = time.time_ns()
+        self._profiles: dict[int, tuple] = {}
+        self._ranks = self._new_index()
+        self._windows: dict[str, RankIndex] = {}
+        self._ledger: dict[str, tuple[int, int, int | None]] = {}
+
+    @staticmethod
+    def _new_index() -> RankIndex:
+        index = RankIndex()
+        index.load(())
+        return index
+
+    async def init(self) -> None:
+        logger.info("memory_storage_initialized")
+
+    async def close(self) -> None:
+        logger.info("memory_storage_closed", extra=self.stats())
+
+    async def flush(self) -> None:
+        return None
+
+    def _ensure_user(self, user_id: int) -> None:
+        if user_id not in self._profiles:
+            self._profiles[user_id] = (None, None, None, None)
+            self._ranks.update(user_id, 0)
+
+    def _merge_profile(self, user_id: int, fingerprint: tuple) -> bool:
+        # True when the user is new or the coalesced profile differs.
+        known = user_id in self._profiles
+        self._ensure_user(user_id)
+        merged = _coalesce_profile(fingerprint, self._profiles[user_id])
+        if known and merged == self._profiles[user_id]:
+            return False
+        self._profiles[user_id] = merged
+        return True
+
+    def _credit(self, user_id: int, amount: int, windows: list[str]) -> None:
+        self._ensure_user(user_id)
+        self._ranks.update(user_id, self._ranks.spent_stars(user_id) + amount)
+        current = current_window_ids()
+        for stale_window in [known for known in self._windows if known not in current]:
+            # Only current windows are ever read; the database equivalent is
+            # DbMaintenance's window prune.
+            del self._windows[stale_window]
+        for credited_window in windows:
+            if credited_window not in current:
+                continue
+            index = self._windows.get(credited_window)
+            if index is None:
+                index = self._windows[credited_window] = self._new_index()
+            index.update(user_id, (index.spent_stars(user_id) or 0) + amount)
+
+    async def upsert_user(self, user: dict) -> None:
+        user_id = user.get("id")
+        if not isinstance(user_id, int):
+            return
+        # Like Database.upsert_user, an unchanged profile is not a write, so
+        # the leaderboard handlers' per-request upsert keeps 304s possible.
+        if self._merge_profile(user_id, _profile_fingerprint(user)):
+            self.data_version += 1
+
+    async def add_spent_stars(self, user_id: int, amount: int) -> None:
+        if amount <= 0:
+            logger.warning("add_spent_stars_skipped", extra={"user_id": user_id, "amount": amount, "reason": "non_positive_amount"})
+            return
+        self._credit(user_id, amount, current_window_ids())
+        self.data_version += 1
+
+    async def apply_payments(self, payments: list[dict]) -> int:
+        applied = 0
+        for payment in payments:
+            if payment["charge_id"] in self._ledger:
+                continue
+            payer = payment.get("payer") or {}
+            payer_id = payer.get("id")
+            self._ledger[payment["charge_id"]] = (payment["user_id"], payment["amount"], payer_id)
+            if isinstance(payer_id, int):
+                self._merge_profile(payer_id, _profile_fingerprint(payer))
+            self._credit(payment["user_id"], payment["amount"], payment_window_ids(payment))
+            applied += 1
+
+        if applied:
+            self.data_version += 1
+        return applied
+
+    def _entry(self, user_id: int, spent_stars: int) -> dict:
+        return Database._leaderboard_entry((user_id, *self._profiles[user_id], spent_stars))
+
+    async def get_leaderboard(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        after: tuple[int, int] | None = None,
+        window: str = ALL_TIME_WINDOW,
+    ) -> list[dict]:
+        safe_limit = max(1, min(limit, 100))
+        safe_offset = max(0, offset)
+        if window == ALL_TIME_WINDOW:
+            index = self._ranks
+        else:
+            index = self._windows.get(window_id(window))
+            if index is None:
+                return []
+
+        if after is not None:
+            safe_offset = index.position(*after)
+
+        return [self._entry(user_id, spent_stars) for user_id, spent_stars in index.page(safe_offset + 1, safe_limit)]
+
+    async def get_user_rank(self, user_id: int, neighbours: int = 1) -> dict | None:
+        neighbours = max(0, min(neighbours, 10))
+        rank = self._ranks.rank(user_id)
+        if rank is None:
+            return None
+
+        total = len(self._ranks)
+        entries = []
+        for candidate in range(max(1, rank - neighbours), min(total, rank + neighbours) + 1):
+            if candidate == rank:
+                continue
+            neighbour_id = self._ranks.select(candidate)
+            entries.append({**self._entry(neighbour_id, self._ranks.spent_stars(neighbour_id)), "rank": candidate})
+
+        return {
+            "rank": rank,
+            "total": total,
+            "spentStars": self._ranks.spent_stars(user_id),
+            "neighbours": entries,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._profiles),
+            "payments": len(self._ledger),
+            "windows": len(self._windows),
+        }
+
+
+def create_storage(
+    backend: str = STORAGE_BACKEND,
+    path: Path = DB_PATH,
+    shards: int = DB_SHARDS,
+    **database_options,
+) -> Storage:
+    # database_options go to each SQLite Database and are ignored in memory.
+    if backend == "sqlite":
+        if shards > 1:
+            return ShardedStorage(path, shards, **database_options)
+        return Database(path, **database_options)
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"unknown storage backend: {backend}")
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import multiprocessing
+
+from config import API_PORT, API_WORKERS
+from log_setup import setup_logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _run_api_worker(processes: int, index: int) -> None:
+    listener = setup_logging()
+    import main
+
+    try:
+        asyncio.run(main.run_api_worker(processes, index))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.stop()
+
+
+class ApiWorkerPool:
+    # API_WORKERS processes bind API_PORT with SO_REUSEPORT and the kernel
+    # spreads connections between them. Workers that die are started again
+    # under the same index, which keeps their metrics port; the bot poller or
+    # webhook stays in the supervising process.
+    def __init__(self, workers: int, processes: int) -> None:
+        self.workers = workers
+        self.processes = processes
+        self.restarts = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._procs: list[multiprocessing.Process] = []
+
+    def _spawn(self, index: int) -> multiprocessing.Process:
+        proc = self._context.Process(target=_run_api_worker, args=(self.processes, index), daemon=True)
+        proc.start()
+        return proc
+
+    def start(self) -> None:
+        self._procs = [self._spawn(index) for index in range(self.workers)]
+        logger.info("api_workers_started", extra={"workers": self.workers, "port": API_PORT})
+
+    async def monitor(self, interval: float = 1.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for index, proc in enumerate(self._procs):
+                if proc.is_alive():
+                    continue
+                logger.warning("api_worker_exited", extra={"pid": proc.pid, "exitcode": proc.exitcode})
+                self._procs[index] = self._spawn(index)
+                self.restarts += 1
+
+    def stop(self, timeout: float = 5.0) -> None:
+        for proc in self._procs:
+            if proc.is_alive():
+                proc.terminate()
+        for proc in self._procs:
+            proc.join(timeout)
+        self._procs = []
+
+
+async def run_supervised(api_workers: int) -> None:
+    import main
+
+    pool = ApiWorkerPool(api_workers, processes=api_workers + 1)
+    pool.start()
+    monitor_task = asyncio.create_task(pool.monitor())
+    try:
+        await main.main(api_workers=api_workers)
+    finally:
+        monitor_task.cancel()
+        await asyncio.gather(monitor_task, return_exceptions=True)
+        pool.stop()
+
+
+def run() -> None:
+    listener = setup_logging()
+    try:
+        if API_WORKERS <= 1:
+            import main
+
+            asyncio.run(main.main())
+            return
+
+        asyncio.run(run_supervised(API_WORKERS))
+    finally:
+        listener.stop()
+
+
+if __name__ == "__main__":
+    run()
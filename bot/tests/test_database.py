@@ -0,0 +1,464 @@
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest.mock import patch
+
+from bot.database import (
+    Database,
+    decode_leaderboard_cursor,
+    encode_leaderboard_cursor,
+    next_leaderboard_cursor,
+)
+from bot.db_executor import DbExecutor
+from bot.export import iter_export_chunks
+from bot.leaderboard_windows import current_window_ids, window_id
+from bot.response_cache import ResponseCache, leaderboard_cache_key
+
+
+def _user(user_id: int, **fields) -> dict:
+    return {"id": user_id, "username": f"user{user_id}", "first_name": "Test", "last_name": None, **fields}
+
+
+class DatabaseTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db = Database(Path(self._tmp.name) / "app.db")
+        await self.db.init()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self._tmp.cleanup()
+
+    async def test_unchanged_profile_skips_write(self):
+        await self.db.upsert_user(_user(1, photo_url="https://example.com/a.png"))
+
+        with patch.object(self.db, "_upsert_user_sync") as upsert_sync:
+            await self.db.upsert_user(_user(1, photo_url="https://example.com/a.png"))
+            await self.db.upsert_user(_user(1, photo_url=None))
+
+        upsert_sync.assert_not_called()
+        self.assertEqual(self.db.profile_cache_stats()["writes_skipped"], 2)
+
+    async def test_changed_profile_is_written(self):
+        await self.db.upsert_user(_user(1))
+        await self.db.upsert_user(_user(1, username="renamed"))
+
+        leaderboard = await self.db.get_leaderboard()
+
+        self.assertEqual(leaderboard[0]["username"], "renamed")
+        self.assertEqual(self.db.profile_cache_stats()["writes"], 2)
+
+    async def test_etag_from_before_a_restart_does_not_match(self):
+        responses = ResponseCache()
+        key = leaderboard_cache_key("all", 10, 0, None)
+
+        # The same number of writes after the restart, but different content.
+        async def write_twice(db, stars):
+            await db.upsert_user(_user(1))
+            await db.add_spent_stars(1, stars)
+
+        await write_twice(self.db, 25)
+        old_etag = responses.etag(key, self.db.data_version)
+        await self.db.close()
+
+        self.db = Database(self.db.path)
+        await self.db.init()
+        await write_twice(self.db, 50)
+
+        self.assertNotEqual(responses.etag(key, self.db.data_version), old_etag)
+
+    async def test_cursor_pages_match_offset_pages(self):
+        for user_id, stars in [(1, 50), (2, 100), (3, 50), (4, 0), (5, 100)]:
+            await self.db.upsert_user(_user(user_id))
+            if stars:
+                await self.db.add_spent_stars(user_id, stars)
+
+        first_page = await self.db.get_leaderboard(limit=2)
+        cursor = next_leaderboard_cursor(first_page, 2)
+        second_page = await self.db.get_leaderboard(limit=2, after=decode_leaderboard_cursor(cursor))
+
+        self.assertEqual([row["userId"] for row in first_page], [2, 5])
+        self.assertEqual(second_page, await self.db.get_leaderboard(limit=2, offset=2))
+        self.assertEqual([row["userId"] for row in second_page], [1, 3])
+
+    async def test_reads_do_not_wait_for_writer_thread(self):
+        await self.db.add_spent_stars(1, 25)
+
+        reads_before = self.db.read_pool_stats()["reads"]
+        writer_busy = threading.Event()
+        blocked = asyncio.ensure_future(self.db._executor.run(lambda conn: writer_busy.wait(5), write=True))
+
+        try:
+            leaderboard = await asyncio.wait_for(self.db._read(self.db._get_leaderboard_sync, 10, 0), timeout=1)
+        finally:
+            writer_busy.set()
+            await blocked
+
+        self.assertEqual(leaderboard[0]["spentStars"], 25)
+        self.assertEqual(self.db.read_pool_stats()["reads"], reads_before + 1)
+
+    async def test_queued_writes_share_a_transaction_and_fail_alone(self):
+        writer_busy = threading.Event()
+        blocked = asyncio.ensure_future(self.db._executor.run(lambda conn: writer_busy.wait(5), write=True))
+        await asyncio.sleep(0.01)
+        stats_before = self.db.executor_stats()
+
+        writes = [asyncio.ensure_future(self.db.add_spent_stars(user_id, 10)) for user_id in range(1, 6)]
+        failing = asyncio.ensure_future(self.db._write(lambda conn: conn.execute("INSERT INTO missing VALUES (1)")))
+        await asyncio.sleep(0.01)
+        writer_busy.set()
+        await blocked
+        await asyncio.gather(*writes)
+        with self.assertRaises(sqlite3.OperationalError):
+            await failing
+
+        stats = self.db.executor_stats()
+        # One commit for the blocking write, one for the six queued behind it.
+        self.assertEqual(stats["transactions"] - stats_before["transactions"], 2)
+        self.assertGreaterEqual(stats["max_batch"], 6)
+        leaderboard = await self.db._read(self.db._get_leaderboard_sync, 10, 0)
+        self.assertEqual([row["spentStars"] for row in leaderboard], [10] * 5)
+
+    async def test_writer_survives_a_write_that_loses_the_transaction(self):
+        def lose_transaction(conn):
+            # What SQLite does on IOERR/FULL/NOMEM: the whole transaction is gone.
+            conn.execute("ROLLBACK")
+            raise sqlite3.OperationalError("disk I/O error")
+
+        writer_busy = threading.Event()
+        blocked = asyncio.ensure_future(self.db._executor.run(lambda conn: writer_busy.wait(5), write=True))
+        await asyncio.sleep(0.01)
+        earlier = asyncio.ensure_future(self.db.add_spent_stars(1, 10))
+        failing = asyncio.ensure_future(self.db._write(lose_transaction))
+        later = asyncio.ensure_future(self.db.add_spent_stars(2, 10))
+        await asyncio.sleep(0.01)
+        writer_busy.set()
+        await blocked
+
+        results = await asyncio.wait_for(asyncio.gather(earlier, failing, later, return_exceptions=True), 5)
+        self.assertTrue(all(isinstance(result, sqlite3.Error) for result in results))
+        await asyncio.wait_for(self.db.add_spent_stars(3, 10), 5)
+        leaderboard = await self.db._read(self.db._get_leaderboard_sync, 10, 0)
+        self.assertEqual([row["userId"] for row in leaderboard if row["spentStars"]], [3])
+
+    async def test_reads_run_outside_the_write_transaction(self):
+        class FailingCommit:
+            # Stands in for a connection whose COMMIT fails, e.g. on a full disk.
+            def __init__(self, conn):
+                self._conn = conn
+
+            @property
+            def in_transaction(self):
+                return self._conn.in_transaction
+
+            def execute(self, sql, *args):
+                if sql == "COMMIT":
+                    raise sqlite3.OperationalError("database or disk is full")
+                return self._conn.execute(sql, *args)
+
+            def close(self):
+                self._conn.close()
+
+        def connect():
+            conn = sqlite3.connect(Path(self._tmp.name) / "commit.db", isolation_level=None, check_same_thread=False)
+            conn.execute("CREATE TABLE t (x INTEGER)")
+            return FailingCommit(conn)
+
+        events = []
+        executor = DbExecutor(connect, on_commit=lambda: events.append("commit"), on_rollback=lambda: events.append("rollback"))
+        executor.start()
+        writer_busy = threading.Event()
+        blocked = asyncio.ensure_future(executor.run(lambda conn: writer_busy.wait(5)))
+        await asyncio.sleep(0.01)
+        write = asyncio.ensure_future(executor.run(lambda conn: conn.execute("INSERT INTO t VALUES (1)"), write=True))
+        read = asyncio.ensure_future(
+            executor.run(lambda conn: (conn.in_transaction, conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]))
+        )
+        await asyncio.sleep(0.01)
+        writer_busy.set()
+        await blocked
+        results = await asyncio.gather(write, read, return_exceptions=True)
+        await executor.close()
+
+        self.assertIsInstance(results[0], sqlite3.OperationalError)
+        self.assertEqual(results[1], (False, 0))
+        self.assertEqual(events, ["rollback"])
+
+    async def test_top_leaderboard_cache_matches_sql_ordering(self):
+        db = Database(Path(self._tmp.name) / "cached.db", leaderboard_cache_size=3)
+        await db.init()
+        operations = [(1, 0), (2, 25), (3, 0), (4, 50), (5, 25), (3, 100), (6, 0), (1, 25)]
+        for user_id, stars in operations:
+            await db.upsert_user(_user(user_id))
+            if stars:
+                await db.add_spent_stars(user_id, stars)
+
+        with patch.object(db, "_read", wraps=db._read) as read:
+            cached_page = await db.get_leaderboard(limit=3)
+        read.assert_not_called()
+
+        expected = await db._read(db._get_leaderboard_sync, 3, 0)
+        await db.close()
+
+        self.assertEqual(cached_page, expected)
+        self.assertEqual([row["userId"] for row in cached_page], [3, 4, 1])
+
+    async def test_top_leaderboard_cache_falls_back_once_users_outgrow_it(self):
+        db = Database(Path(self._tmp.name) / "grown.db", leaderboard_cache_size=3)
+        await db.init()
+        for user_id, stars in [(1, 10), (2, 20), (3, 30), (4, 5)]:
+            await db.upsert_user(_user(user_id))
+            await db.add_spent_stars(user_id, stars)
+
+        full_page = await db.get_leaderboard(limit=10)
+        past_cache = await db.get_leaderboard(limit=2, offset=3)
+        await db.close()
+
+        self.assertEqual([row["userId"] for row in full_page], [3, 2, 1, 4])
+        self.assertEqual([row["userId"] for row in past_cache], [4])
+
+    async def test_user_rank_matches_with_and_without_rank_index(self):
+        fallback = Database(Path(self._tmp.name) / "fallback.db", rank_index_enabled=False)
+        await fallback.init()
+        for db in (self.db, fallback):
+            for user_id, stars in [(1, 50), (2, 100), (3, 50), (4, 0), (5, 25)]:
+                await db.upsert_user(_user(user_id))
+                if stars:
+                    await db.add_spent_stars(user_id, stars)
+
+        indexed = await self.db.get_user_rank(3)
+        scanned = await fallback.get_user_rank(3)
+        await fallback.close()
+
+        self.assertEqual(indexed, scanned)
+        self.assertEqual((indexed["rank"], indexed["total"], indexed["spentStars"]), (3, 5, 50))
+        self.assertEqual([(entry["rank"], entry["userId"]) for entry in indexed["neighbours"]], [(2, 1), (4, 5)])
+        self.assertIsNone(await self.db.get_user_rank(999))
+
+    async def test_window_leaderboard_only_counts_stars_spent_in_window(self):
+        for user_id in (1, 2):
+            await self.db.upsert_user(_user(user_id))
+        with patch("bot.database.current_window_ids", return_value=["day:2026-10-15", "week:2026-W42"]):
+            await self.db.add_spent_stars(1, 100)
+        with patch("bot.database.current_window_ids", return_value=["day:2026-10-16", "week:2026-W42"]):
+            await self.db.add_spent_stars(2, 50)
+            await self.db.add_spent_stars(1, 25)
+
+        with patch("bot.database.window_id", side_effect=lambda window: {"day": "day:2026-10-16", "week": "week:2026-W42"}[window]):
+            day = await self.db.get_leaderboard(window="day")
+            week = await self.db.get_leaderboard(window="week")
+
+        self.assertEqual([(row["userId"], row["spentStars"]) for row in day], [(2, 50), (1, 25)])
+        self.assertEqual([(row["userId"], row["spentStars"]) for row in week], [(1, 125), (2, 50)])
+
+    async def test_maintenance_checkpoints_the_wal_off_the_request_path(self):
+        for user_id in range(1, 50):
+            await self.db.upsert_user(_user(user_id))
+            await self.db.add_spent_stars(user_id, 25)
+
+        wal_path = Path(str(self.db.path) + "-wal")
+        # Commits no longer checkpoint on their own, so the WAL keeps every frame.
+        self.assertGreater(wal_path.stat().st_size, 0)
+
+        await self.db.run_maintenance()
+
+        stats = self.db.maintenance_stats()
+        self.assertEqual((stats["truncates"], stats["optimizes"], stats["analyzes"]), (1, 1, 1))
+        self.assertEqual(wal_path.stat().st_size, 0)
+        with sqlite3.connect(self.db.path) as conn:
+            self.assertIsNotNone(conn.execute("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone())
+        self.assertEqual(len(await self.db.get_leaderboard(limit=100)), 49)
+
+    async def test_maintenance_prunes_expired_windows(self):
+        paid_at = int(time.time()) - 30 * 86400
+        await self.db.apply_payments([{"charge_id": "old", "user_id": 1, "amount": 100, "paid_at": paid_at}])
+        await self.db.add_spent_stars(2, 25)
+        current = set(current_window_ids())
+        with sqlite3.connect(self.db.path) as conn:
+            windows = {row[0] for row in conn.execute("SELECT window_id FROM leaderboard_windows")}
+        self.assertIn(window_id("day", datetime.fromtimestamp(paid_at, timezone.utc)), windows)
+
+        await self.db.run_maintenance()
+
+        with sqlite3.connect(self.db.path) as conn:
+            remaining = {row[0] for row in conn.execute("SELECT window_id FROM leaderboard_windows")}
+        self.assertEqual(remaining, current)
+        self.assertEqual(self.db.maintenance_stats()["pruned_rows"], len(windows - current))
+        self.assertEqual([row["userId"] for row in await self.db.get_leaderboard(window="day")], [2])
+
+    async def test_truncate_never_waits_on_a_pinned_reader(self):
+        await self.db.upsert_user(_user(1))
+        reader = sqlite3.connect(self.db.path)
+        reader.execute("BEGIN")
+        reader.execute("SELECT COUNT(*) FROM users").fetchone()
+        await self.db.add_spent_stars(1, 25)
+
+        try:
+            started_at = asyncio.get_running_loop().time()
+            await self.db.run_maintenance()
+            await self.db.add_spent_stars(1, 25)
+            elapsed = asyncio.get_running_loop().time() - started_at
+        finally:
+            reader.close()
+
+        stats = self.db.maintenance_stats()
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual((stats["truncates"], stats["skipped_truncates"]), (0, 1))
+
+        export = iter_export_chunks([self.db.path], "users", "ndjson", chunk_rows=1)
+        next(export)
+        await self.db.run_maintenance()
+        export.close()
+        self.assertEqual(self.db.maintenance_stats()["skipped_truncates"], 2)
+        await self.db.run_maintenance()
+        self.assertEqual(self.db.maintenance_stats()["truncates"], 1)
+
+    async def test_backup_holds_off_truncate_while_copying(self):
+        for user_id in range(1, 50):
+            await self.db.upsert_user(_user(user_id))
+        self.db._backup.backup_dir = Path(self._tmp.name) / "backups"
+        self.db._backup.pages_per_step = 1
+        copying = threading.Event()
+        resume = threading.Event()
+        progress = self.db._backup._progress
+
+        def pausing_progress(status, remaining, total):
+            progress(status, remaining, total)
+            copying.set()
+            resume.wait(5)
+
+        # A forced pass empties the WAL and schedules optimize and ANALYZE far
+        # ahead, so the next pass writes nothing and only the registered
+        # reader can hold TRUNCATE back.
+        await self.db.run_maintenance()
+        maintenance = self.db._maintenance
+        maintenance._is_idle = lambda: True
+        maintenance.truncate_pages = 0
+
+        self.db._backup._progress = pausing_progress
+        backup = asyncio.create_task(self.db.backup())
+        await asyncio.to_thread(copying.wait, 5)
+        await maintenance.run_once()
+        resume.set()
+        await backup
+
+        stats = self.db.maintenance_stats()
+        self.assertEqual((stats["truncates"], stats["skipped_truncates"]), (1, 1))
+
+    async def test_backup_snapshot_is_consistent_while_writes_continue(self):
+        for user_id in range(1, 201):
+            await self.db.upsert_user(_user(user_id))
+        self.db._backup.backup_dir = Path(self._tmp.name) / "backups"
+        self.db._backup.pages_per_step = 1
+        self.db._backup.retention = 2
+
+        async def keep_writing():
+            for user_id in range(201, 301):
+                await self.db.upsert_user(_user(user_id))
+                await asyncio.sleep(0)
+
+        writer = asyncio.create_task(keep_writing())
+        reports = [await self.db.backup() for _ in range(3)]
+        await writer
+
+        self.assertGreater(reports[0]["steps"], 1)
+        self.assertEqual(reports[2]["removed"], [reports[0]["path"]])
+        snapshots = self.db._backup.snapshots_on_disk()
+        self.assertEqual([str(path) for path in snapshots], [reports[1]["path"], reports[2]["path"]])
+        with sqlite3.connect(snapshots[-1]) as conn:
+            self.assertEqual(conn.execute("PRAGMA integrity_check").fetchone()[0], "ok")
+            (users,) = conn.execute("SELECT COUNT(*) FROM users").fetchone()
+        self.assertGreaterEqual(users, 200)
+        self.assertEqual(self.db.backup_stats()["snapshots"], 3)
+
+    def test_malformed_cursor_is_rejected(self):
+        self.assertIsNone(decode_leaderboard_cursor("not-a-cursor"))
+        self.assertEqual(decode_leaderboard_cursor(encode_leaderboard_cursor(25, 7)), (25, 7))
+
+
+class WriteBehindDatabaseTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self._tmp.name) / "app.db"
+
+    async def asyncTearDown(self):
+        self._tmp.cleanup()
+
+    async def test_queued_writes_are_coalesced_into_one_flush(self):
+        db = Database(self.path, write_behind=True, flush_interval_ms=60_000, strict_star_writes=False)
+        await db.init()
+
+        await db.upsert_user(_user(1))
+        await db.upsert_user(_user(1, username="renamed"))
+        for _ in range(3):
+            await db.add_spent_stars(1, 25)
+        await db.add_spent_stars(2, 50)
+
+        self.assertEqual(await db.get_leaderboard(), [])
+        await db.close()
+
+        reopened = Database(self.path)
+        await reopened.init()
+        leaderboard = await reopened.get_leaderboard()
+        await reopened.close()
+
+        self.assertEqual(db.flushes, 1)
+        self.assertEqual(
+            [(row["userId"], row["username"], row["spentStars"]) for row in leaderboard],
+            [(1, "renamed", 75), (2, None, 50)],
+        )
+
+    async def test_strict_star_write_waits_for_flush(self):
+        db = Database(self.path, write_behind=True, flush_interval_ms=10, strict_star_writes=True)
+        await db.init()
+
+        await db.add_spent_stars(7, 100)
+        leaderboard = await db.get_leaderboard()
+        await db.close()
+
+        self.assertEqual(leaderboard[0]["spentStars"], 100)
+
+
+class SharedDatabaseTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        path = Path(self._tmp.name) / "app.db"
+        # Two instances on one file stand in for two worker processes.
+        self.first = Database(path, shared=True, sync_interval_ms=60_000)
+        self.second = Database(path, shared=True, sync_interval_ms=60_000)
+        await self.first.init()
+        await self.second.init()
+
+    async def asyncTearDown(self):
+        await self.first.close()
+        await self.second.close()
+        self._tmp.cleanup()
+
+    async def test_sync_picks_up_writes_from_another_process(self):
+        await self.first.add_spent_stars(1, 50)
+        self.assertEqual(await self.second.get_leaderboard(), [])
+
+        await self.second.sync()
+
+        self.assertEqual(self.second.data_version, self.first.data_version)
+        self.assertEqual([row["userId"] for row in await self.second.get_leaderboard()], [1])
+        self.assertEqual((await self.second.get_user_rank(1))["rank"], 1)
+
+    async def test_local_write_after_foreign_write_reloads_cache(self):
+        await self.first.add_spent_stars(1, 50)
+        await self.second.add_spent_stars(2, 25)
+
+        leaderboard = await self.second.get_leaderboard()
+
+        self.assertEqual([(row["userId"], row["spentStars"]) for row in leaderboard], [(1, 50), (2, 25)])
+        self.assertEqual(self.second.data_version, 2)
+        self.assertEqual(self.second.cache_reloads, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
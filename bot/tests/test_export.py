@@ -0,0 +1,56 @@
+import csv
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from bot.export import aiter_export_chunks, iter_export_chunks, storage_paths
+from bot.storage import MemoryStorage, create_storage
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "username": f"user{user_id}", "first_name": "Test", "last_name": None}
+
+
+class ExportTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.single = create_storage("sqlite", Path(self._tmp.name) / "single" / "app.db")
+        self.sharded = create_storage("sqlite", Path(self._tmp.name) / "sharded" / "app.db", shards=3)
+        for storage in (self.single, self.sharded):
+            await storage.init()
+            for user_id in range(1, 26):
+                await storage.upsert_user(_user(user_id))
+                if user_id % 3:
+                    await storage.add_spent_stars(user_id, 25 * (user_id % 5 + 1))
+
+    async def asyncTearDown(self):
+        for storage in (self.single, self.sharded):
+            await storage.close()
+        self._tmp.cleanup()
+
+    async def test_ndjson_export_matches_paged_leaderboard_for_single_and_sharded(self):
+        expected = []
+        for offset in range(0, 25, 10):
+            expected.extend(await self.single.get_leaderboard(limit=10, offset=offset))
+
+        for storage in (self.single, self.sharded):
+            chunks = list(iter_export_chunks(storage_paths(storage), "leaderboard", "ndjson", chunk_rows=4))
+            records = [json.loads(line) for chunk in chunks for line in chunk.decode().splitlines()]
+
+            self.assertEqual(len(chunks), 7)
+            self.assertEqual([record["rank"] for record in records], list(range(1, 26)))
+            self.assertEqual([{k: v for k, v in record.items() if k != "rank"} for record in records], expected)
+
+    async def test_csv_users_export_streams_through_async_iterator(self):
+        body = b"".join([chunk async for chunk in aiter_export_chunks(storage_paths(self.sharded), "users", "csv", 10)])
+        rows = list(csv.reader(io.StringIO(body.decode())))
+
+        self.assertEqual(rows[0][:2], ["user_id", "username"])
+        self.assertEqual([int(row[0]) for row in rows[1:]], list(range(1, 26)))
+        self.assertIsNone(storage_paths(MemoryStorage()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import asyncio
+import gzip
+import json
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from bot.api import _create_invoice_response, app, handle_leaderboard, leaderboard_responses
+from bot.invoice_links import InvoiceLinkCache
+
+
+_LEADERBOARD = [
+    {
+        "userId": user_id,
+        "username": f"user{user_id}",
+        "firstName": "Test",
+        "lastName": None,
+        "photoUrl": None,
+        "spentStars": 1000 - user_id,
+    }
+    for user_id in range(1, 11)
+]
+
+
+class LeaderboardApiTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        app.state.db = AsyncMock()
+        app.state.db.data_version = 7
+        app.state.db.get_leaderboard = AsyncMock(return_value=_LEADERBOARD)
+        leaderboard_responses._entries.clear()
+        self._verify = patch("bot.api.verify_init_data_user", return_value=({}, {"id": 777}))
+        self._verify.start()
+
+    async def asyncTearDown(self):
+        self._verify.stop()
+
+    async def _get(self, **headers):
+        return await handle_leaderboard(
+            x_telegram_init_data="valid",
+            limit=10,
+            offset=0,
+            next_cursor=None,
+            window="all",
+            if_none_match=headers.get("if_none_match"),
+            accept_encoding=headers.get("accept_encoding"),
+        )
+
+    async def test_repeat_request_with_etag_returns_304_without_db_read(self):
+        first = await self._get(accept_encoding="gzip")
+        second = await self._get(if_none_match=first.headers["etag"])
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers["content-encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(first.body))["leaderboard"], _LEADERBOARD)
+        self.assertEqual(second.status_code, 304)
+        app.state.db.get_leaderboard.assert_awaited_once()
+
+    async def test_data_version_change_invalidates_cached_body(self):
+        first = await self._get()
+        app.state.db.data_version += 1
+        second = await self._get(if_none_match=first.headers["etag"])
+
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(first.headers["etag"], second.headers["etag"])
+        self.assertEqual(app.state.db.get_leaderboard.await_count, 2)
+
+    async def test_first_page_prewarms_invoice_links_on_the_chat_lane(self):
+        lanes = []
+
+        class RecordingOutbound:
+            async def call(self, fn, *, lane, chat_id=None):
+                lanes.append(lane)
+                return await fn()
+
+        app.state.bot = AsyncMock()
+        app.state.bot.create_invoice_link = AsyncMock(side_effect=lambda **kwargs: f"https://t.me/invoice/{kwargs['payload']}")
+        app.state.outbound = RecordingOutbound()
+        invoice_links = InvoiceLinkCache()
+        try:
+            with patch("bot.api.INVOICE_PREWARM_AMOUNTS", (25, 50)), patch("bot.api.invoice_links", invoice_links):
+                await self._get()
+                await asyncio.gather(*list(invoice_links._prewarm_tasks))
+                response = await _create_invoice_response(amount=50, init_data="valid", x_telegram_init_data=None)
+        finally:
+            app.state.outbound = None
+
+        self.assertEqual([lane.name for lane in lanes], ["CHAT", "CHAT"])
+        self.assertEqual(app.state.bot.create_invoice_link.await_count, 2)
+        self.assertEqual(response["invoice_link"], invoice_links.get(50, 777))
+        stats = invoice_links.stats()
+        self.assertEqual((stats["prewarmed"], stats["hits"], stats["misses"]), (2, 1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bot.bench.fake_bot_api import FakeBotApi
+from bot.bench.loadgen import BENCH_BOT_TOKEN, compare_reports, sign_init_data
+from bot.bot_handlers import register_bot_handlers
+from bot.security import verify_init_data_user
+from bot.update_scheduler import UpdateScheduler, poll_updates
+
+
+class SyntheticPaymentFlowTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._mini_app_url = patch("bot.bot_handlers.MINI_APP_URL", "https://example.com")
+        self._mini_app_url.start()
+        self.fake = FakeBotApi()
+        base_url = await self.fake.start()
+        self.bot = Bot(BENCH_BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+        self.db = AsyncMock()
+        dp = Dispatcher()
+        register_bot_handlers(dp, self.db)
+        self.updates = UpdateScheduler(dp, self.bot, queue_size=100)
+        await self.updates.start()
+        self.poller = asyncio.create_task(poll_updates(self.bot, self.updates, timeout=1))
+
+    async def asyncTearDown(self):
+        self.poller.cancel()
+        await asyncio.gather(self.poller, return_exceptions=True)
+        await self.updates.stop()
+        await self.bot.session.close()
+        await self.fake.stop()
+        self._mini_app_url.stop()
+
+    async def test_pushed_payments_complete_through_get_updates(self):
+        for user_id in (1, 2, 2):
+            self.fake.push_payment(user_id, 50)
+
+        for _ in range(100):
+            if self.fake.payments["completed"] == 3:
+                break
+            await asyncio.sleep(0.05)
+
+        self.assertEqual(self.fake.payments, {"pushed": 3, "approved": 3, "completed": 3})
+        self.assertEqual((len(self.fake.pre_checkout_latencies), len(self.fake.payment_latencies)), (3, 3))
+        self.assertEqual(self.db.add_spent_stars.await_count, 3)
+        self.assertEqual(self.fake.stats()["payments"]["completed"], 3)
+
+
+class LoadgenReportTest(unittest.TestCase):
+    def test_signed_init_data_passes_server_verification(self):
+        user = {"id": 1_000_001, "first_name": "Load1", "username": "load1"}
+        verified = verify_init_data_user(sign_init_data(BENCH_BOT_TOKEN, user), BENCH_BOT_TOKEN, 600)
+
+        self.assertEqual(verified[1], user)
+        self.assertIsNone(verify_init_data_user(sign_init_data("654321:OTHER", user), BENCH_BOT_TOKEN, 600))
+
+    def test_compare_flags_tail_latency_and_throughput_regressions(self):
+        def report(p99_ms, rps):
+            scenario = {"p50_ms": 5.0, "p95_ms": 8.0, "p99_ms": p99_ms, "rps": rps, "error_ratio": 0.0}
+            return {"meta": {}, "scenarios": {"leaderboard": scenario}}
+
+        self.assertEqual(compare_reports(report(10.0, 50.0), report(10.5, 49.0), 0.1)["regressions"], [])
+        regressions = compare_reports(report(10.0, 50.0), report(20.0, 40.0), 0.1)["regressions"]
+        self.assertEqual(regressions, ["leaderboard.p99_ms 10.0 -> 20.0", "leaderboard.rps 50.0 -> 40.0"])
+
+
+if __name__ == "__main__":
+    unittest.main()
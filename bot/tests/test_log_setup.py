@@ -0,0 +1,94 @@
+import io
+import json
+import logging
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+from bot.log_setup import EventSampler, setup_logging
+
+
+class _BlockingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.release.wait(5)
+        return super().write(text)
+
+
+class LogSetupTest(unittest.TestCase):
+    def setUp(self):
+        root = logging.getLogger()
+        self._saved = (list(root.handlers), root.level)
+
+    def tearDown(self):
+        root = logging.getLogger()
+        root.handlers[:] = self._saved[0]
+        root.setLevel(self._saved[1])
+
+    def test_records_are_written_as_json_by_the_listener_thread(self):
+        stream = _BlockingStream()
+        listener = setup_logging("INFO", stream=stream, sample_rates={}, rate_limits={})
+        logger = logging.getLogger("bot.test")
+
+        # The stream blocks, so returning here proves the caller never waits on I/O.
+        logger.info("invoice_request_received", extra={"user_id": 7, "amount": 25})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("invoice_creation_failed")
+        stream.release.set()
+        listener.stop()
+
+        first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual((first["event"], first["user_id"], first["amount"]), ("invoice_request_received", 7, 25))
+        self.assertEqual((second["level"], second["event"]), ("ERROR", "invoice_creation_failed"))
+        self.assertIn("ValueError: boom", second["exc_info"])
+
+    def test_sampler_thins_hot_events_but_keeps_warnings_and_payments(self):
+        sampler = EventSampler(
+            {"get_leaderboard_result": 0.0, "payment_outbox_applied": 0.0},
+            {"invoice_request_received": 2},
+            ("payment_",),
+        )
+
+        def record(event, level=logging.INFO):
+            return logging.makeLogRecord({"msg": event, "levelno": level})
+
+        self.assertFalse(sampler.filter(record("get_leaderboard_result")))
+        self.assertTrue(sampler.filter(record("get_leaderboard_result", logging.WARNING)))
+        self.assertTrue(sampler.filter(record("payment_outbox_applied")))
+        kept = [sampler.filter(record("invoice_request_received")) for _ in range(5)]
+        self.assertEqual(kept.count(True), 2)
+        self.assertEqual(sampler.dropped, {"get_leaderboard_result": 1, "invoice_request_received": 3})
+
+    def test_rate_limit_holds_across_logging_threads(self):
+        record = logging.makeLogRecord({"msg": "invoice_request_received", "levelno": logging.INFO})
+        switch_interval = sys.getswitchinterval()
+        # The clock stands still, so the bucket never refills past its burst.
+        with patch("time.monotonic", return_value=1000.0):
+            sampler = EventSampler({}, {"invoice_request_received": 50})
+            kept = []
+
+            def log_many():
+                kept.append(sum(sampler.filter(record) for _ in range(1000)))
+
+            threads = [threading.Thread(target=log_many) for _ in range(8)]
+            sys.setswitchinterval(1e-6)
+            try:
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            finally:
+                sys.setswitchinterval(switch_interval)
+
+        self.assertEqual(sum(kept), 50)
+        self.assertEqual(sampler.dropped, {"invoice_request_received": 8 * 1000 - 50})
+
+
+if __name__ == "__main__":
+    unittest.main()
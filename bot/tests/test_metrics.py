@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from bot.api import app
+from bot.database import Database
+from bot.db_executor import DB_COMMIT, DB_QUEUE_WAIT
+from bot.metrics import CallbackMetric, MetricsRegistry, _Metric
+
+
+class MetricsTest(unittest.IsolatedAsyncioTestCase):
+    def test_render_uses_prometheus_text_format(self):
+        registry = MetricsRegistry()
+        stages = registry.histogram("stage_seconds", "Stage time.", ("stage",), buckets=(0.01, 0.1))
+        rejections = registry.counter("rejections_total", "Rejections.", ("reason",))
+        registry.callback("queue_depth", "Queued.", "gauge", lambda: [((), 3)])
+
+        child = stages.labels("commit")
+        for seconds in (0.005, 0.05, 0.05, 2.0):
+            child.observe(seconds)
+        rejections.labels('bad "init" data').inc()
+        rejections.labels('bad "init" data').inc()
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE stage_seconds histogram", lines)
+        self.assertIn('stage_seconds_bucket{stage="commit",le="0.01"} 1', lines)
+        self.assertIn('stage_seconds_bucket{stage="commit",le="0.1"} 3', lines)
+        self.assertIn('stage_seconds_bucket{stage="commit",le="+Inf"} 4', lines)
+        self.assertIn('stage_seconds_sum{stage="commit"} 2.105', lines)
+        self.assertIn('stage_seconds_count{stage="commit"} 4', lines)
+        self.assertIn('rejections_total{reason="bad \\"init\\" data"} 2', lines)
+        self.assertIn("# TYPE queue_depth gauge", lines)
+        self.assertIn("queue_depth 3", lines)
+
+    def test_const_labels_tag_every_sample(self):
+        registry = MetricsRegistry()
+        registry.const_labels = {"process": "api-1"}
+        registry.histogram("stage_seconds", "Stage time.", ("stage",), buckets=(0.1,)).labels("commit").observe(0.05)
+        registry.callback("queue_depth", "Queued.", "gauge", lambda: [((), 3)])
+
+        lines = registry.render().splitlines()
+        self.assertIn('stage_seconds_bucket{stage="commit",process="api-1",le="0.1"} 1', lines)
+        self.assertIn('stage_seconds_count{stage="commit",process="api-1"} 1', lines)
+        self.assertIn('queue_depth{process="api-1"} 3', lines)
+
+    def test_metric_kinds_must_provide_children_and_rendering(self):
+        class Incomplete(_Metric):
+            kind = "gauge"
+
+        with self.assertRaises(TypeError):
+            Incomplete("incomplete", "Missing _new_child and render.")
+        with self.assertRaises(TypeError):
+            CallbackMetric("queue_depth", "Queued.", "gauge", (), lambda: []).labels()
+
+    def test_fastapi_server_serves_stage_and_rejection_metrics(self):
+        client = TestClient(app)
+        response = client.get("/api/leaderboard", headers={"X-Telegram-Init-Data": "forged"})
+        self.assertEqual(response.status_code, 401)
+
+        scrape = client.get("/metrics")
+        self.assertEqual(scrape.status_code, 200)
+        lines = scrape.text.splitlines()
+        self.assertTrue(any(line.startswith('randomgift_rejections_total{reason="invalid_init_data"') for line in lines))
+        self.assertTrue(
+            any(line.startswith('randomgift_stage_duration_seconds_count{stage="init_data_verify"') for line in lines)
+        )
+        self.assertTrue(
+            any(line.startswith('randomgift_http_request_duration_seconds_count{route="/api/leaderboard"') for line in lines)
+        )
+
+    async def test_database_writes_observe_queue_wait_and_commit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(Path(tmp) / "app.db")
+            await db.init()
+            waits, commits = sum(DB_QUEUE_WAIT.counts), sum(DB_COMMIT.counts)
+            try:
+                await db.upsert_user({"id": 1, "username": "user1", "first_name": "Test", "last_name": None})
+                await db.add_spent_stars(1, 25)
+            finally:
+                await db.close()
+
+        self.assertGreaterEqual(sum(DB_QUEUE_WAIT.counts) - waits, 2)
+        self.assertGreaterEqual(sum(DB_COMMIT.counts) - commits, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import unittest
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import LabeledPrice
+
+from bot.bench.fake_bot_api import FakeBotApi
+from bot.outbound import Lane, OutboundRateLimited, OutboundScheduler
+
+
+class OutboundSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.fake = FakeBotApi()
+        base_url = await self.fake.start()
+        self.bot = Bot(
+            "123456:TEST",
+            session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)),
+        )
+
+    async def asyncTearDown(self):
+        await self.bot.session.close()
+        await self.fake.stop()
+
+    def _create_invoice(self):
+        return self.bot.create_invoice_link(
+            title="Random Gift",
+            description="test",
+            payload="gift:25:1",
+            currency="XTR",
+            prices=[LabeledPrice(label="25 ⭐", amount=25)],
+        )
+
+    async def test_pre_checkout_lane_jumps_ahead_of_chat_replies(self):
+        scheduler = OutboundScheduler(workers=1)
+        order = []
+        gate = asyncio.Event()
+
+        async def blocker():
+            await gate.wait()
+
+        async def record(name):
+            order.append(name)
+
+        await scheduler.start()
+        try:
+            first = asyncio.create_task(scheduler.call(blocker, lane=Lane.CHAT))
+            await asyncio.sleep(0)
+            calls = [
+                asyncio.create_task(scheduler.call(lambda: record("chat"), lane=Lane.CHAT)),
+                asyncio.create_task(scheduler.call(lambda: record("reply"), lane=Lane.PAYMENT_REPLY)),
+                asyncio.create_task(scheduler.call(lambda: record("pre_checkout"), lane=Lane.PRE_CHECKOUT)),
+            ]
+            await asyncio.sleep(0.01)
+            gate.set()
+            await asyncio.gather(first, *calls)
+        finally:
+            await scheduler.stop()
+
+        self.assertEqual(order, ["pre_checkout", "reply", "chat"])
+        self.assertEqual(scheduler.stats()["lanes"]["pre_checkout"]["completed"], 1)
+
+    async def test_retry_after_is_honoured_against_fake_bot_api(self):
+        scheduler = OutboundScheduler()
+        self.fake.rate_limit_next(1, retry_after=1)
+
+        await scheduler.start()
+        try:
+            link = await scheduler.call(self._create_invoice, lane=Lane.INVOICE)
+        finally:
+            await scheduler.stop()
+
+        self.assertTrue(link.startswith("https://t.me/$fake_invoice_"))
+        self.assertEqual(self.fake.counts["createInvoiceLink"], 2)
+        first_call, second_call = self.fake.calls[0][2], self.fake.calls[1][2]
+        self.assertGreaterEqual(second_call - first_call, 0.9)
+        stats = scheduler.stats()
+        self.assertEqual(stats["retries"], 1)
+        self.assertEqual(stats["queue_depth"], 0)
+
+    async def test_gives_up_with_rate_limited_after_max_attempts(self):
+        scheduler = OutboundScheduler(max_attempts=1)
+        self.fake.rate_limit_next(1, retry_after=1)
+
+        await scheduler.start()
+        try:
+            with self.assertRaises(OutboundRateLimited) as ctx:
+                await scheduler.call(self._create_invoice, lane=Lane.INVOICE)
+        finally:
+            await scheduler.stop()
+
+        self.assertEqual(ctx.exception.retry_after, 1)
+        self.assertEqual(scheduler.stats()["lanes"]["invoice"]["failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,11 @@
+import asyncio
+from datetime import datetime, timezone
 import json
 import unittest
 from types import SimpleNamespace
 from unittest.mock import AsyncMock, patch
 
-from bot.api import _create_invoice_response, app, handle_invoice_post
+from bot.api import _create_invoice_response, app, handle_invoice_post, invoice_links
 from bot.bot_handlers import process_pre_checkout_query, process_successful_payment
 from bot.payments import build_invoice_payload
 
@@ -23,12 +25,10 @@ class PaymentContractsTest(unittest.IsolatedAsyncioTestCase):
         app.state.bot = AsyncMock()
         app.state.bot.create_invoice_link = AsyncMock(return_value="https://t.me/invoice/test-link")
         app.state.db = AsyncMock()
+        invoice_links.clear()
 
     async def test_invoice_endpoint_returns_invoice_link_for_valid_init_data_and_amount(self):
-        with (
-            patch("bot.api.verify_telegram_init_data", return_value={"user": '{"id": 777}'}),
-            patch("bot.api.extract_user_from_init_data", return_value={"id": 777}),
-        ):
+        with patch("bot.api.verify_init_data_user", return_value=({"user": '{"id": 777}'}, {"id": 777})):
             response = await _create_invoice_response(
                 amount=50,
                 init_data="valid_init_data",
@@ -39,6 +39,32 @@ class PaymentContractsTest(unittest.IsolatedAsyncioTestCase):
         app.state.bot.create_invoice_link.assert_awaited_once()
         app.state.db.upsert_user.assert_awaited_once_with({"id": 777})
 
+    async def test_concurrent_identical_invoice_requests_share_one_bot_api_call(self):
+        async def slow_invoice_link(**kwargs):
+            await asyncio.sleep(0.01)
+            return "https://t.me/invoice/shared-link"
+
+        app.state.bot.create_invoice_link = AsyncMock(side_effect=slow_invoice_link)
+        with patch("bot.api.verify_init_data_user", return_value=({"user": '{"id": 777}'}, {"id": 777})):
+            responses = await asyncio.gather(
+                *(
+                    _create_invoice_response(amount=50, init_data="valid_init_data", x_telegram_init_data=None)
+                    for _ in range(3)
+                )
+            )
+
+        self.assertEqual({response["invoice_link"] for response in responses}, {"https://t.me/invoice/shared-link"})
+        app.state.bot.create_invoice_link.assert_awaited_once()
+
+    async def test_repeat_invoice_request_reuses_cached_link(self):
+        with patch("bot.api.verify_init_data_user", return_value=({"user": '{"id": 777}'}, {"id": 777})):
+            first = await _create_invoice_response(amount=25, init_data="valid_init_data", x_telegram_init_data=None)
+            second = await _create_invoice_response(amount=25, init_data="valid_init_data", x_telegram_init_data=None)
+
+        self.assertEqual(first, second)
+        app.state.bot.create_invoice_link.assert_awaited_once()
+        self.assertEqual(invoice_links.stats()["hits"], 1)
+
     async def test_invoice_post_endpoint_rejects_invalid_amount_type(self):
         response = await handle_invoice_post(payload={"amount": "50"}, x_telegram_init_data="valid")
 
@@ -88,6 +114,36 @@ class PaymentContractsTest(unittest.IsolatedAsyncioTestCase):
         )
         db.add_spent_stars.assert_awaited_once_with(777, 50)
 
+    async def test_successful_payment_is_appended_to_outbox_when_configured(self):
+        db = AsyncMock()
+        outbox = SimpleNamespace(append=AsyncMock(return_value=True))
+        message = SimpleNamespace(
+            message_id=123,
+            date=datetime(2024, 3, 1, 23, 59, tzinfo=timezone.utc),
+            from_user=SimpleNamespace(
+                id=777,
+                username="tester",
+                first_name="Test",
+                last_name="User",
+            ),
+            successful_payment=SimpleNamespace(
+                invoice_payload=build_invoice_payload(50, 777),
+                telegram_payment_charge_id="charge-1",
+            ),
+        )
+
+        await process_successful_payment(message, db, outbox)
+
+        outbox.append.assert_awaited_once_with(
+            "charge-1",
+            777,
+            50,
+            {"id": 777, "username": "tester", "first_name": "Test", "last_name": "User", "photo_url": None},
+            paid_at=1709337540,
+        )
+        db.upsert_user.assert_not_awaited()
+        db.add_spent_stars.assert_not_awaited()
+
     async def test_successful_payment_ignores_invalid_payload(self):
         db = AsyncMock()
         message = SimpleNamespace(
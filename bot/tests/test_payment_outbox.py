@@ -0,0 +1,154 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from bot.database import Database
+from bot.payment_outbox import PaymentOutbox
+
+
+_PAYER = {"id": 777, "username": "tester", "first_name": "Test", "last_name": None, "photo_url": None}
+
+
+class PaymentOutboxTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.outbox_path = Path(self._tmp.name) / "app.outbox.jsonl"
+        self.db = Database(Path(self._tmp.name) / "app.db")
+        await self.db.init()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self._tmp.cleanup()
+
+    async def _spent_stars(self, user_id: int) -> int | None:
+        rank = await self.db.get_user_rank(user_id)
+        return rank["spentStars"] if rank else None
+
+    async def test_redelivered_charge_is_credited_once(self):
+        outbox = PaymentOutbox(self.outbox_path, self.db, fsync=False)
+        await outbox.start()
+
+        self.assertTrue(await outbox.append("charge-1", 777, 50, _PAYER))
+        self.assertFalse(await outbox.append("charge-1", 777, 50, _PAYER))
+        await outbox.drain()
+        self.assertTrue(await outbox.append("charge-1", 777, 50, _PAYER))
+        await outbox.stop()
+
+        self.assertEqual(await self._spent_stars(777), 50)
+        self.assertEqual(outbox.stats()["applied"], 1)
+        self.assertEqual(outbox.stats()["duplicates"], 2)
+        self.assertEqual(self.outbox_path.read_text(), "")
+
+    async def test_pending_entries_are_replayed_on_startup(self):
+        await self.db.apply_payments([{"charge_id": "charge-1", "user_id": 777, "amount": 50, "payer": _PAYER}])
+        lines = [
+            json.dumps({"charge_id": "charge-1", "user_id": 777, "amount": 50, "payer": _PAYER}),
+            json.dumps({"charge_id": "charge-2", "user_id": 777, "amount": 25, "payer": _PAYER}),
+            '{"charge_id": "charge-3", "user_',
+        ]
+        self.outbox_path.write_text("\n".join(lines))
+
+        outbox = PaymentOutbox(self.outbox_path, self.db, fsync=False)
+        await outbox.start()
+        await outbox.stop()
+
+        self.assertEqual(await self._spent_stars(777), 75)
+        self.assertEqual(outbox.stats()["replayed"], 2)
+        self.assertEqual(outbox.stats()["applied"], 1)
+
+    async def test_failed_batch_stays_pending(self):
+        outbox = PaymentOutbox(self.outbox_path, self.db, fsync=False)
+        await outbox.start()
+        await outbox.append("charge-1", 777, 50, _PAYER)
+
+        original = self.db.apply_payments
+
+        async def failing(payments):
+            raise RuntimeError("database is locked")
+
+        self.db.apply_payments = failing
+        await outbox.drain()
+        self.assertEqual(outbox.stats()["pending"], 1)
+        self.assertIn("charge-1", self.outbox_path.read_text())
+
+        self.db.apply_payments = original
+        await outbox.stop()
+        self.assertEqual(await self._spent_stars(777), 50)
+
+    async def test_concurrent_appends_share_a_journal_write(self):
+        outbox = PaymentOutbox(self.outbox_path, self.db, batch_size=1000, fsync=True)
+        await outbox.start()
+        results = await asyncio.gather(*(outbox.append(f"charge-{index}", 777, 25, _PAYER) for index in range(20)))
+
+        self.assertTrue(all(results))
+        self.assertEqual(len(self.outbox_path.read_text().splitlines()), 20)
+        self.assertLess(outbox.stats()["journal_writes"], 20)
+        await outbox.stop()
+        self.assertEqual(await self._spent_stars(777), 500)
+
+    async def test_entry_is_drained_only_after_its_line_is_acknowledged(self):
+        outbox = PaymentOutbox(self.outbox_path, self.db, flush_interval_ms=60_000, fsync=True)
+        await outbox.start()
+        await outbox.append("charge-1", 777, 50, _PAYER)
+
+        release = threading.Event()
+        real_fsync = os.fsync
+
+        def held_fsync(fd):
+            release.wait(5)
+            real_fsync(fd)
+
+        with patch("bot.payment_outbox.os.fsync", side_effect=held_fsync):
+            unacked = asyncio.ensure_future(outbox.append("charge-2", 777, 25, _PAYER))
+            await asyncio.sleep(0.05)
+            # charge-2's line is written but not yet fsynced; the drain's
+            # compaction queues behind it.
+            drain = asyncio.ensure_future(outbox.drain())
+            while not outbox.stats()["applied"]:
+                await asyncio.sleep(0.01)
+            self.assertEqual(await self._spent_stars(777), 50)
+            release.set()
+            self.assertTrue(await unacked)
+            await drain
+
+        self.assertEqual([json.loads(line)["charge_id"] for line in self.outbox_path.read_text().splitlines()], ["charge-2"])
+        await outbox.stop()
+        self.assertEqual(await self._spent_stars(777), 75)
+
+    async def test_concurrent_drains_apply_every_entry(self):
+        outbox = PaymentOutbox(self.outbox_path, self.db, batch_size=100, flush_interval_ms=60_000, fsync=False)
+        await outbox.start()
+        for index in range(2):
+            await outbox.append(f"charge-{index}", 777, 25, _PAYER)
+
+        original = self.db.apply_payments
+        first_call = asyncio.Event()
+
+        async def slow_first(payments):
+            if not first_call.is_set():
+                first_call.set()
+                await asyncio.sleep(0.05)
+            return await original(payments)
+
+        self.db.apply_payments = slow_first
+        slow_drain = asyncio.ensure_future(outbox.drain())
+        await first_call.wait()
+        # A second drain and new charges arrive while the first batch is applying.
+        await outbox.drain()
+        for index in range(2, 4):
+            await outbox.append(f"charge-{index}", 777, 25, _PAYER)
+        await slow_drain
+        self.db.apply_payments = original
+        await outbox.stop()
+
+        self.assertEqual(await self._spent_stars(777), 100)
+        self.assertEqual(outbox.stats()["pending"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
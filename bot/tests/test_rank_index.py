@@ -0,0 +1,43 @@
+import random
+import unittest
+
+from bot.rank_index import RankIndex
+
+
+class RankIndexTest(unittest.TestCase):
+    def test_matches_sorted_order_under_random_updates(self):
+        rng = random.Random(7)
+        stars = {user_id: 0 for user_id in range(200)}
+        index = RankIndex()
+        index.load(stars.items())
+
+        # Totals grow by arbitrary amounts, so nearly every credit reaches a
+        # star value the index has not seen before.
+        for _ in range(2000):
+            user_id = rng.randrange(300)
+            stars[user_id] = stars.get(user_id, 0) + rng.randint(1, 500)
+            index.update(user_id, stars[user_id])
+
+        ordered = sorted(stars.items(), key=lambda item: (-item[1], item[0]))
+        self.assertEqual(len(index), len(ordered))
+        self.assertEqual(index.page(1, len(ordered)), ordered)
+        self.assertEqual(index.page(5, 3), ordered[4:7])
+        for rank, (user_id, spent_stars) in enumerate(ordered, start=1):
+            self.assertEqual(index.rank(user_id), rank)
+            self.assertEqual(index.select(rank), user_id)
+            self.assertEqual(index.position(spent_stars, user_id), rank)
+            self.assertEqual(index.position(spent_stars, user_id - 1), rank - 1)
+
+    def test_out_of_range_lookups(self):
+        index = RankIndex()
+        index.load([(1, 10), (2, 0)])
+
+        self.assertIsNone(index.rank(3))
+        self.assertIsNone(index.select(0))
+        self.assertIsNone(index.select(3))
+        self.assertEqual(index.page(3, 10), [])
+        self.assertEqual(index.position(5, 0), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
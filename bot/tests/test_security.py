@@ -0,0 +1,69 @@
+import hashlib
+import hmac
+import json
+import time
+import unittest
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from bot.security import InitDataCache, verify_init_data_user
+
+
+BOT_TOKEN = "123456:TEST-TOKEN"
+
+
+def _sign_init_data(user: dict, auth_date: int, bot_token: str = BOT_TOKEN) -> str:
+    fields = {"auth_date": str(auth_date), "query_id": "AAE", "user": json.dumps(user)}
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+class InitDataCacheTest(unittest.TestCase):
+    def test_cached_verification_returns_parsed_data_and_user(self):
+        cache = InitDataCache(max_size=8, ttl_seconds=600)
+        init_data = _sign_init_data({"id": 777, "username": "tester"}, int(time.time()))
+
+        first = verify_init_data_user(init_data, BOT_TOKEN, 600, cache)
+        with patch("bot.security.verify_telegram_init_data") as verify:
+            second = verify_init_data_user(init_data, BOT_TOKEN, 600, cache)
+
+        verify.assert_not_called()
+        self.assertEqual(first, second)
+        self.assertEqual(second[1]["id"], 777)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_cached_entry_expires_on_auth_date_boundary(self):
+        cache = InitDataCache(max_size=8, ttl_seconds=3600)
+        auth_date = int(time.time())
+        init_data = _sign_init_data({"id": 777}, auth_date)
+
+        self.assertIsNotNone(verify_init_data_user(init_data, BOT_TOKEN, 600, cache))
+
+        with patch("bot.security.time.time", return_value=auth_date + 601):
+            self.assertIsNone(verify_init_data_user(init_data, BOT_TOKEN, 600, cache))
+
+        self.assertEqual(len(cache), 0)
+
+    def test_invalid_signature_is_not_cached(self):
+        cache = InitDataCache(max_size=8, ttl_seconds=600)
+        init_data = _sign_init_data({"id": 777}, int(time.time()), bot_token="other:TOKEN")
+
+        self.assertIsNone(verify_init_data_user(init_data, BOT_TOKEN, 600, cache))
+        self.assertEqual(len(cache), 0)
+
+    def test_cache_evicts_least_recently_used_entry(self):
+        cache = InitDataCache(max_size=2, ttl_seconds=600)
+        now = int(time.time())
+        blobs = [_sign_init_data({"id": user_id}, now) for user_id in (1, 2, 3)]
+
+        for blob in blobs:
+            verify_init_data_user(blob, BOT_TOKEN, 600, cache)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(blobs[0], BOT_TOKEN, 600))
+
+
+if __name__ == "__main__":
+    unittest.main()
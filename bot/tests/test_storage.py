@@ -0,0 +1,152 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from bot.storage import MemoryStorage, create_storage
+
+
+def _user(user_id: int, **fields) -> dict:
+    return {"id": user_id, "username": f"user{user_id}", "first_name": "Test", "last_name": None, **fields}
+
+
+def _payment(charge_id: str, user_id: int, amount: int, **fields) -> dict:
+    return {"charge_id": charge_id, "user_id": user_id, "amount": amount, "payer": _user(user_id), **fields}
+
+
+class StorageParityTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.sqlite = create_storage("sqlite", Path(self._tmp.name) / "app.db")
+        self.memory = create_storage("memory")
+        self.assertEqual(type(self.sqlite).__name__, "Database")
+        self.assertEqual(type(self.memory).__name__, MemoryStorage.__name__)
+        for storage in (self.sqlite, self.memory):
+            await storage.init()
+
+    async def asyncTearDown(self):
+        for storage in (self.sqlite, self.memory):
+            await storage.close()
+        self._tmp.cleanup()
+
+    async def _both(self, method: str, *args, **kwargs):
+        results = [await getattr(storage, method)(*args, **kwargs) for storage in (self.sqlite, self.memory)]
+        self.assertEqual(results[0], results[1], method)
+        return results[0]
+
+    async def test_same_workload_gives_same_results(self):
+        for user_id in range(1, 8):
+            await self._both("upsert_user", _user(user_id))
+        await self._both("upsert_user", _user(3, username=None, photo_url="https://example.com/3.png"))
+        await self._both("add_spent_stars", 2, 50)
+        await self._both("add_spent_stars", 5, 0)
+
+        payments = [_payment("c1", 4, 100), _payment("c2", 6, 50), _payment("c3", 9, 25)]
+        self.assertEqual(await self._both("apply_payments", payments), 3)
+        self.assertEqual(await self._both("apply_payments", payments + [_payment("c4", 6, 25)]), 1)
+
+        first_page = await self._both("get_leaderboard", limit=3)
+        self.assertEqual([entry["userId"] for entry in first_page], [4, 6, 2])
+        last = first_page[-1]
+        await self._both("get_leaderboard", limit=3, after=(last["spentStars"], last["userId"]))
+        await self._both("get_leaderboard", limit=2, offset=5)
+        await self._both("get_leaderboard", limit=10, window="week")
+        await self._both("get_leaderboard", limit=10, window="day")
+
+        rank = await self._both("get_user_rank", 3, neighbours=2)
+        self.assertEqual(rank["neighbours"][0]["photoUrl"], None)
+        await self._both("get_user_rank", 404)
+
+    async def test_replayed_payment_credits_the_window_it_was_paid_in(self):
+        # An outbox line written 30 days ago and only applied now.
+        old = _payment("c1", 1, 100, paid_at=int(time.time()) - 30 * 86400)
+        self.assertEqual(await self._both("apply_payments", [old, _payment("c2", 2, 25, paid_at=int(time.time()))]), 2)
+
+        all_time = await self._both("get_leaderboard", limit=10)
+        self.assertEqual([entry["userId"] for entry in all_time], [1, 2])
+        for window in ("day", "week"):
+            entries = await self._both("get_leaderboard", limit=10, window=window)
+            self.assertEqual([entry["userId"] for entry in entries], [2], window)
+
+    async def test_unchanged_profile_keeps_data_version(self):
+        for storage in (self.sqlite, self.memory):
+            await storage.upsert_user(_user(1))
+            version = storage.data_version
+            await storage.upsert_user(_user(1))
+            await storage.upsert_user(_user(1, username=None))
+            self.assertEqual(storage.data_version, version, type(storage).__name__)
+
+            await storage.upsert_user(_user(1, username="renamed"))
+            self.assertNotEqual(storage.data_version, version, type(storage).__name__)
+
+
+class ShardedStorageTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.single = create_storage("sqlite", Path(self._tmp.name) / "single" / "app.db")
+        self.sharded = create_storage("sqlite", Path(self._tmp.name) / "sharded" / "app.db", shards=3)
+        for storage in (self.single, self.sharded):
+            await storage.init()
+
+    async def asyncTearDown(self):
+        for storage in (self.single, self.sharded):
+            await storage.close()
+        self._tmp.cleanup()
+
+    async def _both(self, method: str, *args, **kwargs):
+        results = [await getattr(storage, method)(*args, **kwargs) for storage in (self.single, self.sharded)]
+        self.assertEqual(results[0], results[1], (method, args, kwargs))
+        return results[0]
+
+    async def test_merged_pages_and_ranks_match_single_file(self):
+        for user_id in range(1, 31):
+            await self._both("upsert_user", _user(user_id))
+        for user_id in range(1, 31, 2):
+            await self._both("add_spent_stars", user_id, 25 * (user_id % 4 + 1))
+
+        # Payer 8 lives in another shard than the credited user 7.
+        gift = {"charge_id": "gift", "user_id": 7, "amount": 100, "payer": _user(8, photo_url="https://example.com/8.png")}
+        self.assertEqual(await self._both("apply_payments", [gift, _payment("own", 12, 50)]), 2)
+        self.assertEqual(await self._both("apply_payments", [gift]), 0)
+
+        cursor = None
+        for offset in range(0, 30, 7):
+            page = await self._both("get_leaderboard", limit=7, offset=offset)
+            cursor_page = await self._both("get_leaderboard", limit=7, after=cursor)
+            self.assertEqual(page, cursor_page)
+            cursor = (page[-1]["spentStars"], page[-1]["userId"])
+        await self._both("get_leaderboard", limit=10, window="day")
+
+        for user_id in (1, 7, 8, 30):
+            await self._both("get_user_rank", user_id, neighbours=3)
+        shard_rows = [len(await shard.get_leaderboard(limit=100)) for shard in self.sharded.shards]
+        self.assertEqual(sum(shard_rows), 30)
+
+    async def test_deep_offset_is_refused(self):
+        self.sharded.max_offset = 10
+        await self.sharded.get_leaderboard(limit=5, offset=10)
+        with self.assertRaisesRegex(ValueError, "exceeds 10"):
+            await self.sharded.get_leaderboard(limit=5, offset=11)
+
+    async def test_refuses_a_changed_shard_count(self):
+        await self.sharded.upsert_user(_user(1))
+        await self.sharded.close()
+
+        resharded = create_storage("sqlite", Path(self._tmp.name) / "sharded" / "app.db", shards=2)
+        with self.assertRaisesRegex(RuntimeError, "shard 0 of 3"):
+            await resharded.init()
+
+        self.sharded = create_storage("sqlite", Path(self._tmp.name) / "sharded" / "app.db", shards=3)
+        await self.sharded.init()
+
+    async def test_refuses_to_shard_over_an_unsharded_database(self):
+        await self.single.upsert_user(_user(1))
+        await self.single.flush()
+
+        sharded = create_storage("sqlite", self.single.path, shards=2)
+        with self.assertRaisesRegex(RuntimeError, "already holds users"):
+            await sharded.init()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.types import Update
+
+from bot.bench.webhook_harness import pre_checkout_update, start_update, successful_payment_update
+from bot.update_scheduler import (
+    OTHER,
+    PRE_CHECKOUT,
+    SUCCESSFUL_PAYMENT,
+    UpdateScheduler,
+    classify_update,
+    poll_updates,
+)
+
+
+class UpdateSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.bot = Bot("123456:TEST")
+        self.dp = Dispatcher()
+        self.handled = []
+
+        @self.dp.pre_checkout_query()
+        async def on_pre_checkout(query: types.PreCheckoutQuery) -> None:
+            self.handled.append("pre_checkout")
+
+        @self.dp.message()
+        async def on_message(message: types.Message) -> None:
+            await asyncio.sleep(0.05)
+            self.handled.append("start")
+
+    async def asyncTearDown(self):
+        await self.bot.session.close()
+
+    def _update(self, data: dict) -> Update:
+        return Update.model_validate(data, context={"bot": self.bot})
+
+    def test_classifies_payment_updates(self):
+        self.assertEqual(classify_update(self._update(pre_checkout_update(1))), PRE_CHECKOUT)
+        self.assertEqual(classify_update(self._update(successful_payment_update(1))), SUCCESSFUL_PAYMENT)
+        self.assertEqual(classify_update(self._update(start_update(1))), OTHER)
+
+    async def test_pre_checkout_is_not_queued_behind_start_flood(self):
+        scheduler = UpdateScheduler(self.dp, self.bot, workers={OTHER: 1})
+        await scheduler.start()
+        try:
+            for user_id in range(5):
+                self.assertTrue(scheduler.submit(self._update(start_update(user_id))))
+            self.assertTrue(scheduler.submit(self._update(pre_checkout_update(99))))
+            await scheduler.join()
+        finally:
+            await scheduler.stop()
+
+        self.assertLess(self.handled.index("pre_checkout"), 2)
+        stats = scheduler.stats()
+        self.assertLess(stats[PRE_CHECKOUT]["max_queue_wait_ms"], stats[OTHER]["max_queue_wait_ms"])
+
+    async def test_full_queue_rejects_instead_of_buffering(self):
+        scheduler = UpdateScheduler(self.dp, self.bot, queue_size=1)
+
+        self.assertTrue(scheduler.submit(self._update(start_update(1))))
+        self.assertFalse(scheduler.submit(self._update(start_update(2))))
+        self.assertTrue(scheduler.submit(self._update(pre_checkout_update(3))))
+        self.assertEqual(scheduler.stats()[OTHER]["dropped"], 1)
+
+    async def test_payment_updates_are_never_shed(self):
+        scheduler = UpdateScheduler(self.dp, self.bot, queue_size=1)
+
+        for user_id in range(50):
+            self.assertTrue(scheduler.submit(self._update(pre_checkout_update(user_id))))
+            self.assertTrue(scheduler.submit(self._update(successful_payment_update(user_id))))
+
+        stats = scheduler.stats()
+        self.assertEqual((stats[PRE_CHECKOUT]["queue_depth"], stats[PRE_CHECKOUT]["dropped"]), (50, 0))
+        self.assertEqual((stats[SUCCESSFUL_PAYMENT]["queue_depth"], stats[SUCCESSFUL_PAYMENT]["dropped"]), (50, 0))
+
+    async def test_polling_keeps_fetching_while_other_queue_is_full(self):
+        # No workers run, so "other" fills after one update and stays full.
+        scheduler = UpdateScheduler(self.dp, self.bot, queue_size=1)
+        batches = [
+            [self._update(start_update(user_id)) for user_id in range(3)],
+            [self._update(pre_checkout_update(user_id)) for user_id in range(3)],
+        ]
+        offsets = []
+        fetched_all = asyncio.Event()
+
+        async def get_updates(offset=None, **kwargs):
+            offsets.append(offset)
+            if batches:
+                return batches.pop(0)
+            fetched_all.set()
+            await asyncio.Event().wait()
+
+        with patch.object(self.bot, "get_updates", get_updates):
+            poller = asyncio.create_task(poll_updates(self.bot, scheduler))
+            await asyncio.wait_for(fetched_all.wait(), 1)
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+
+        stats = scheduler.stats()
+        self.assertEqual(len(offsets), 3)
+        self.assertEqual((stats[OTHER]["queue_depth"], stats[OTHER]["dropped"]), (1, 2))
+        self.assertEqual(stats[PRE_CHECKOUT]["queue_depth"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
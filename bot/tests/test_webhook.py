@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bot.bench.fake_bot_api import FakeBotApi
+from bot.bench.webhook_harness import post_updates
+from bot.bot_handlers import register_bot_handlers
+from bot.update_scheduler import UpdateScheduler
+from bot.webhook import WebhookIngress
+
+
+class WebhookIngressTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._mini_app_url = patch("bot.bot_handlers.MINI_APP_URL", "https://example.com")
+        self._mini_app_url.start()
+        self.fake = FakeBotApi()
+        base_url = await self.fake.start()
+        self.bot = Bot("123456:TEST", session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+        self.db = AsyncMock()
+        dp = Dispatcher()
+        register_bot_handlers(dp, self.db)
+
+        self.updates = UpdateScheduler(dp, self.bot, queue_size=100)
+        await self.updates.start()
+        self.ingress = WebhookIngress(self.updates, "s3cret")
+        app = web.Application()
+        app.router.add_post("/telegram/webhook", self.ingress.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}/telegram/webhook"
+
+    async def asyncTearDown(self):
+        await self.updates.stop()
+        await self.runner.cleanup()
+        await self.bot.session.close()
+        await self.fake.stop()
+        self._mini_app_url.stop()
+
+    async def test_rejects_wrong_secret_token(self):
+        report = await post_updates(self.url, "wrong", count=3)
+
+        self.assertEqual(report["statuses"], {"403": 3})
+        self.assertEqual(self.ingress.stats()["rejected"], 3)
+        self.assertEqual(self.fake.counts, {})
+
+    async def test_acknowledges_and_dispatches_synthetic_updates(self):
+        report = await post_updates(self.url, "s3cret", count=9, concurrency=3)
+        await self.updates.join()
+
+        self.assertEqual(report["statuses"], {"200": 9})
+        self.assertEqual(self.fake.counts["answerPreCheckoutQuery"], 3)
+        self.assertEqual(self.fake.counts["sendMessage"], 6)
+        self.assertEqual(self.db.add_spent_stars.await_count, 3)
+        stats = self.ingress.stats()
+        self.assertEqual(stats["received"], 9)
+        processed = {name: update_class["processed"] for name, update_class in stats["updates"].items()}
+        self.assertEqual(processed, {"pre_checkout": 3, "successful_payment": 3, "other": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
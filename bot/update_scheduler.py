@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+
+logger = logging.getLogger(__name__)
+
+PRE_CHECKOUT = "pre_checkout"
+SUCCESSFUL_PAYMENT = "successful_payment"
+OTHER = "other"
+UPDATE_CLASSES = (PRE_CHECKOUT, SUCCESSFUL_PAYMENT, OTHER)
+
+
+def classify_update(update: Update) -> str:
+    if update.pre_checkout_query is not None:
+        return PRE_CHECKOUT
+    if update.message is not None and update.message.successful_payment is not None:
+        return SUCCESSFUL_PAYMENT
+    return OTHER
+
+
+@dataclass
+class _ClassStats:
+    submitted: int = 0
+    dropped: int = 0
+    processed: int = 0
+    failed: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    total_handle: float = 0.0
+
+
+class UpdateScheduler:
+    # Each update class gets its own queue and worker pool, so a flood of
+    # /start messages can only exhaust the "other" workers. Pre-checkout
+    # queries (10s answer deadline) and successful payments keep dedicated
+    # capacity and their queue latency is reported separately. "other" is
+    # bounded by queue_size and sheds when full. The payment queues are
+    # always unbounded: the getUpdates offset has already moved past a
+    # submitted update, so Telegram would never redeliver a shed payment.
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        *,
+        queue_size: int = 1000,
+        workers: dict[str, int] | None = None,
+    ) -> None:
+        self.dp = dp
+        self.bot = bot
+        workers = workers or {}
+        self._pool_sizes = {name: max(1, workers.get(name, 4)) for name in UPDATE_CLASSES}
+        self._queues: dict[str, asyncio.Queue[tuple[Update, float]]] = {
+            name: asyncio.Queue(maxsize=max(1, queue_size) if name == OTHER else 0)
+            for name in UPDATE_CLASSES
+        }
+        self._stats = {name: _ClassStats() for name in UPDATE_CLASSES}
+        self._workers: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        for name, size in self._pool_sizes.items():
+            self._workers.extend(asyncio.create_task(self._worker(name)) for _ in range(size))
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, update: Update) -> bool:
+        name = classify_update(update)
+        try:
+            self._queues[name].put_nowait((update, time.monotonic()))
+        except asyncio.QueueFull:
+            self._stats[name].dropped += 1
+            logger.warning("update_queue_full", extra={"update_class": name, "update_id": update.update_id})
+            return False
+        self._stats[name].submitted += 1
+        return True
+
+    async def _worker(self, name: str) -> None:
+        queue = self._queues[name]
+        stats = self._stats[name]
+        while True:
+            update, enqueued_at = await queue.get()
+            started_at = time.monotonic()
+            wait = started_at - enqueued_at
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                stats.failed += 1
+                logger.exception("update_processing_failed", extra={"update_class": name, "update_id": update.update_id})
+            else:
+                stats.processed += 1
+            finally:
+                stats.total_handle += time.monotonic() - started_at
+                queue.task_done()
+
+    async def join(self) -> None:
+        for queue in self._queues.values():
+            await queue.join()
+
+    def stats(self) -> dict:
+        classes = {}
+        for name, stats in self._stats.items():
+            done = stats.processed + stats.failed
+            classes[name] = {
+                "queue_depth": self._queues[name].qsize(),
+                "workers": self._pool_sizes[name],
+                "submitted": stats.submitted,
+                "dropped": stats.dropped,
+                "processed": stats.processed,
+                "failed": stats.failed,
+                "avg_queue_wait_ms": round(stats.total_wait / done * 1000, 3) if done else 0.0,
+                "max_queue_wait_ms": round(stats.max_wait * 1000, 3),
+                "avg_handle_ms": round(stats.total_handle / done * 1000, 3) if done else 0.0,
+            }
+        return classes
+
+
+async def poll_updates(
+    bot: Bot,
+    scheduler: UpdateScheduler,
+    *,
+    allowed_updates: list[str] | None = None,
+    timeout: int = 30,
+) -> None:
+    # Replaces dp.start_polling so polled updates go through the same
+    # per-class queues as webhook updates. Nothing here waits on a queue: a
+    # full "other" queue sheds the update, so a /start flood never holds back
+    # the getUpdates call that brings the next pre-checkout query, and the
+    # unbounded payment queues accept every payment update.
+    offset = None
+    backoff = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("get_updates_failed", extra={"retry_in": backoff})
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+
+        backoff = 1.0
+        for update in updates:
+            scheduler.submit(update)
+            offset = update.update_id + 1
@@ -0,0 +1,61 @@
+import hmac
+import logging
+
+from aiohttp import web
+from aiogram.types import Update
+
+from metrics import reject
+from update_scheduler import UpdateScheduler
+
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookIngress:
+    # Telegram waits for the HTTP response before sending the next update, so
+    # the handler only checks the secret, parses the update and hands it to the
+    # UpdateScheduler. When that class's queue is full we answer 503 and let
+    # Telegram redeliver instead of buffering without limit.
+    def __init__(self, scheduler: UpdateScheduler, secret_token: str) -> None:
+        self.scheduler = scheduler
+        self._secret_token = secret_token.encode()
+        self.received = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def _secret_matches(self, request: web.Request) -> bool:
+        provided = request.headers.get(SECRET_TOKEN_HEADER, "").encode()
+        return hmac.compare_digest(provided, self._secret_token)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._secret_matches(request):
+            self.rejected += 1
+            reject("webhook_secret_mismatch")
+            logger.warning("webhook_secret_mismatch", extra={"remote": request.remote})
+            return web.json_response({"error": "forbidden"}, status=403)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.scheduler.bot})
+        except Exception:
+            self.rejected += 1
+            reject("webhook_update_invalid")
+            logger.warning("webhook_update_invalid", exc_info=True)
+            return web.json_response({"error": "invalid_update"}, status=400)
+
+        if not self.scheduler.submit(update):
+            self.dropped += 1
+            reject("webhook_busy")
+            return web.json_response({"error": "busy"}, status=503)
+
+        self.received += 1
+        return web.Response(status=200)
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "updates": self.scheduler.stats(),
+        }
@@ -51,4 +51,4 @@ pip install -q --upgrade pip
 pip install -q -r "$ROOT_DIR/bot/requirements.txt"
 
 # Run bot in foreground (so systemd/pm2/docker can supervise it)
-exec python -u "$ROOT_DIR/bot/main.py"
+exec python -u "$ROOT_DIR/bot/supervisor.py"